@@ -11,6 +11,11 @@ admin.site.register(
         models.Size,
         models.ShippingAddress,
         models.BillingAddress,
-        models.Order
+        models.Order,
+        models.IdSequence,
+        models.DailyOrderStats,
+        models.OutboxMessage,
+        models.StripeEvent,
+        models.DesignUpload
     ]
 )
\ No newline at end of file
@@ -0,0 +1,134 @@
+import asyncio
+import atexit
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.core.cache import cache
+from rest_framework.throttling import BaseThrottle
+
+logger = logging.getLogger(__name__)
+
+
+_hash_pool = None
+_hash_pool_lock = threading.Lock()
+
+
+def get_hash_pool():
+    # bounded, so a login spike queues up instead of starving the event loop and the db pool
+    global _hash_pool
+    if _hash_pool is None:
+        with _hash_pool_lock:
+            if _hash_pool is None:
+                _hash_pool = ThreadPoolExecutor(
+                    max_workers=settings.LOGIN_HASH_WORKERS,
+                    thread_name_prefix='password-hash',
+                )
+    return _hash_pool
+
+
+async def acheck_password(user, password):
+    # same as user.check_password(), but the PBKDF2 work runs on the hash pool
+    loop = asyncio.get_running_loop()
+    is_correct, must_update = await loop.run_in_executor(
+        get_hash_pool(), hashers.verify_password, password, user.password
+    )
+    if is_correct and must_update:
+        user.password = await loop.run_in_executor(get_hash_pool(), hashers.make_password, password)
+        await user.asave(update_fields=['password'])
+    return is_correct
+
+
+async def alogin_retry_after(request, email):
+    '''
+    Seconds until another login attempt is allowed, 0 when this one may go ahead.
+    The login view is a plain django view, so DRF's anon throttle does not apply:
+    LOGIN_RATE_LIMIT attempts per minute per client address and per email.
+    '''
+    now = time.time()
+    window = int(now // 60)
+    client = BaseThrottle().get_ident(request)  # REMOTE_ADDR / X-Forwarded-For, as DRF throttles key it
+    account = hashlib.md5(email.strip().lower().encode()).hexdigest()
+    allowed = True
+    for key in (f'login:attempts:ip:{client}:{window}', f'login:attempts:email:{account}:{window}'):
+        await cache.aadd(key, 0, 61)
+        try:
+            attempts = await cache.aincr(key)
+        except ValueError:  # expired between add and incr
+            await cache.aset(key, 1, 61)
+            attempts = 1
+        allowed = allowed and attempts <= settings.LOGIN_RATE_LIMIT
+    return 0 if allowed else max(1, int((window + 1) * 60 - now))
+
+
+class AuthEventBuffer:
+    '''
+    In-process queue for login/logout/failed-login events. Events are handed
+    to Celery in batches (one broker round trip per AUTH_EVENT_BATCH_SIZE
+    events or per AUTH_EVENT_FLUSH_INTERVAL seconds) by a background thread,
+    so publishing never touches the network on the request path.
+    '''
+
+    LOGIN = 'login'
+    LOGOUT = 'logout'
+    LOGIN_FAILED = 'login_failed'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.events = []
+        self.thread = None
+        self.pid = None
+
+    def publish(self, kind, email):
+        if not email:
+            return
+        if settings.AUTH_EVENT_FLUSH_INTERVAL <= 0:
+            self.send([(kind, email)])
+            return
+
+        with self.lock:
+            if self.pid != os.getpid():
+                # forked worker, the parent's buffer and thread are not ours
+                self.events = []
+                self.thread = None
+                self.pid = os.getpid()
+            if len(self.events) >= settings.AUTH_EVENT_BUFFER_LIMIT:
+                logger.warning('auth event buffer full, dropping %s event', kind)
+                return
+            self.events.append((kind, email))
+            full = len(self.events) >= settings.AUTH_EVENT_BATCH_SIZE
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='auth-events', daemon=True)
+                self.thread.start()
+        if full:
+            self.wakeup.set()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(settings.AUTH_EVENT_FLUSH_INTERVAL)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            events, self.events = self.events, []
+        batch_size = settings.AUTH_EVENT_BATCH_SIZE
+        for start in range(0, len(events), batch_size):
+            self.send(events[start:start + batch_size])
+
+    def send(self, events):
+        from app.tasks import process_auth_events
+
+        try:
+            process_auth_events.delay(events)
+        except Exception:
+            logger.exception('could not publish %s auth events', len(events))
+
+
+auth_events = AuthEventBuffer()
+atexit.register(auth_events.flush)
@@ -0,0 +1,64 @@
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+
+CATALOG_VERSION_KEY = 'catalog:version'
+
+
+def get_catalog_version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, 1, None)
+        version = cache.get(CATALOG_VERSION_KEY, 1)
+    return version
+
+
+def bump_catalog_version():
+    # old entries are never read again and expire on their own
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.set(CATALOG_VERSION_KEY, 2, None)
+
+
+class CatalogCacheMixin:
+    '''
+    Read-through cache for the public GET endpoints of the storefront catalog.
+    Entries are keyed by the catalog version, so any product/pricing/size change
+    (see signals.py) invalidates all of them at once.
+    '''
+
+    def catalog_cache_key(self, request):
+        query = request.GET.urlencode()
+        return f'catalog:{get_catalog_version()}:{request.get_host()}{request.path}?{query}'
+
+    def cached_response(self, request, build_response):
+        key = self.catalog_cache_key(request)
+        cached = cache.get(key)
+        if cached is None:
+            response = build_response()
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            data = response.data
+            etag = '"%s"' % hashlib.md5(JSONRenderer().render(data)).hexdigest()
+            cached = (etag, data)
+            cache.set(key, cached, settings.CATALOG_CACHE_TTL)
+
+        etag, data = cached
+        if etag in request.headers.get('If-None-Match', ''):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(data)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'public, max-age=0, must-revalidate'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(CatalogCacheMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(CatalogCacheMixin, self).retrieve(request, *args, **kwargs))
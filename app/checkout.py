@@ -0,0 +1,115 @@
+import asyncio
+import weakref
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.utils import timezone
+import stripe
+from app import models, choices
+
+
+class CheckoutError(Exception):
+    pass
+
+
+_clients = weakref.WeakKeyDictionary()
+
+
+def build_stripe_client(http_client):
+    base_addresses = {'api': settings.STRIPE_API_BASE} if settings.STRIPE_API_BASE else None
+    return stripe.StripeClient(
+        settings.STRIPE_SECRET_KEY or '',
+        base_addresses=base_addresses,
+        max_network_retries=settings.STRIPE_MAX_NETWORK_RETRIES,
+        http_client=http_client,
+    )
+
+
+def get_stripe_client():
+    # one client (and aiohttp connection pool) per event loop, i.e. per asgi worker
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = build_stripe_client(stripe.AIOHTTPClient(timeout=settings.STRIPE_TIMEOUT))
+    return client
+
+
+def session_is_reusable(order, unit_amount):
+    # a session charges the price it was created with, a changed total needs a new one
+    return (
+        order.checkout_session_id
+        and order.checkout_session_amount == unit_amount
+        and order.checkout_session_expires_at
+        and order.checkout_session_expires_at > timezone.now() + timedelta(minutes=settings.STRIPE_SESSION_REUSE_MARGIN)
+    )
+
+
+def idempotency_key(order, unit_amount):
+    # a double click sends the same key, so Stripe answers with the session it already made.
+    # the previous session id is part of the key: once that one expires the next request
+    # must not be answered with it again
+    return f'checkout-{order.order_id}-{unit_amount}-{order.checkout_session_id or "new"}'
+
+
+def session_params(order, unit_amount):
+    return {
+        'payment_method_types': ['card'],
+        'line_items': [{
+            'price_data': {
+                'currency': 'usd',
+                'unit_amount': unit_amount,  # Stripe expects cents
+                'product_data': {
+                    'name': f'Order {order.id}',
+                },
+            },
+            'quantity': 1,
+        }],
+        'mode': 'payment',
+        'success_url': settings.STRIPE_SUCCESS_URL,
+        'cancel_url': settings.STRIPE_CANCEL_URL,
+        'metadata': {'order_id': order.id},
+        # metadata has to flow to the PaymentIntent as well for payment_intent.* webhooks
+        'payment_intent_data': {
+            'metadata': {'order_id': order.id},
+        },
+    }
+
+
+async def create_session(client, order, unit_amount):
+    return await client.v1.checkout.sessions.create_async(
+        session_params(order, unit_amount),
+        {'idempotency_key': idempotency_key(order, unit_amount)},
+    )
+
+
+async def get_checkout_session(order, pooled=True):
+    '''
+    Returns (session id, url) for the order, reusing the stored session while it is
+    still open. pooled=False uses a throwaway client, for callers without a long
+    lived event loop (wsgi, where every async view gets a fresh loop).
+    '''
+    if order.payment == choices.PaymentStatus.PAID:
+        raise CheckoutError('Order is already paid')
+    unit_amount = int(order.total_amount * 100)
+    if session_is_reusable(order, unit_amount):
+        return order.checkout_session_id, order.checkout_session_url
+
+    if pooled:
+        session = await create_session(get_stripe_client(), order, unit_amount)
+    else:
+        http_client = stripe.AIOHTTPClient(timeout=settings.STRIPE_TIMEOUT)
+        try:
+            session = await create_session(build_stripe_client(http_client), order, unit_amount)
+        finally:
+            await http_client.close_async()
+
+    order.checkout_session_id = session.id
+    order.checkout_session_url = session.url
+    order.checkout_session_expires_at = datetime.fromtimestamp(session.expires_at, tz=dt_timezone.utc)
+    order.checkout_session_amount = unit_amount
+    await models.Order.objects.filter(id=order.id).aupdate(
+        checkout_session_id=order.checkout_session_id,
+        checkout_session_url=order.checkout_session_url,
+        checkout_session_expires_at=order.checkout_session_expires_at,
+        checkout_session_amount=order.checkout_session_amount,
+    )
+    return order.checkout_session_id, order.checkout_session_url
@@ -52,3 +52,25 @@ class PaymentStatus(TextChoices):
     FAILED = "Failed", "FAILED"
 
 
+
+
+class OutboxStatus(TextChoices):
+    PENDING = 'pending', 'PENDING'
+    SENT = 'sent', 'SENT'
+    FAILED = 'failed', 'FAILED'
+
+
+class StripeEventStatus(TextChoices):
+    PENDING = 'pending', 'PENDING'
+    PROCESSED = 'processed', 'PROCESSED'
+    IGNORED = 'ignored', 'IGNORED'
+
+
+class DesignUploadStatus(TextChoices):
+    PENDING = 'pending', 'PENDING'
+    COMPLETE = 'complete', 'COMPLETE'
+
+
+class DesignUploadField(TextChoices):
+    IMAGE_FRONT = 'image_front', 'IMAGE_FRONT'
+    IMAGE_BACK = 'image_back', 'IMAGE_BACK'
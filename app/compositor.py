@@ -0,0 +1,87 @@
+'''
+Apparel mockups: the product photo tinted to the design colour with the artwork
+printed on it. Pure numpy/Pillow and no Django imports, so it runs in the
+mockup process pool (see mockups.py) without setting Django up.
+'''
+import io
+import numpy as np
+from PIL import Image, ImageColor
+
+# print area as fractions of the template: left, top, width, height
+PRINT_AREA = (0.30, 0.22, 0.40, 0.45)
+
+# how much of the template's light and shade survives on top of the new colour,
+# without it a black garment would lose every fold
+SHADE_STRENGTH = 0.35
+
+
+def parse_color(color):
+    try:
+        return ImageColor.getrgb(color.strip())[:3]
+    except (AttributeError, ValueError):
+        return (255, 255, 255)
+
+
+def open_rgba(source, max_side):
+    image = Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+    image.draft('RGB', (max_side, max_side))  # jpeg decodes at reduced scale
+    image.thumbnail((max_side, max_side), Image.BILINEAR, reducing_gap=2.0)
+    return image.convert('RGBA')
+
+
+def to_array(image):
+    return np.asarray(image, dtype=np.float32) * np.float32(1 / 255)
+
+
+def shading(rgb, mask):
+    # luminance relative to the garment's average: 1 on flat cloth, below in folds, above in highlights
+    luminance = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    reference = luminance[mask].mean() if mask.any() else 1
+    return luminance / max(reference, 1e-3)
+
+
+def tint(template, color):
+    rgb, alpha = template[..., :3], template[..., 3]
+    shade = shading(rgb, alpha > 0.5)[..., None]
+    target = np.array(color, dtype=np.float32) / 255
+    tinted = shade * target
+    tinted += SHADE_STRENGTH * (shade - 1)
+    return np.clip(tinted, 0, 1, out=tinted), shade
+
+
+def place(artwork, width, height):
+    # scale to fit the print area, centred horizontally and hung from its top edge
+    left, top, area_width, area_height = PRINT_AREA
+    box_width, box_height = int(width * area_width), int(height * area_height)
+    scale = min(box_width / artwork.width, box_height / artwork.height)
+    size = (max(1, round(artwork.width * scale)), max(1, round(artwork.height * scale)))
+    x = int(width * left) + (box_width - size[0]) // 2
+    y = int(height * top)
+    return to_array(artwork.resize(size, Image.BILINEAR, reducing_gap=2.0)), x, y
+
+
+def render_mockup(template_source, color, artwork_source=None, max_side=640, quality=85):
+    '''
+    Returns the mockup as WebP bytes. Sources are file paths or bytes; the template's
+    alpha channel (if any) marks the garment, transparent pixels stay transparent.
+    '''
+    template = to_array(open_rgba(template_source, max_side))
+    height, width = template.shape[:2]
+    rgb, shade = tint(template, parse_color(color))
+
+    if artwork_source is not None:
+        art, x, y = place(open_rgba(artwork_source, max_side), width, height)
+        art_height, art_width = art.shape[:2]
+        region = (slice(y, y + art_height), slice(x, x + art_width))
+        art_alpha = art[..., 3:] * template[region][..., 3:]
+        # ink follows the cloth: the print darkens in folds like the garment does
+        ink = art[..., :3] * np.clip(shade[region], 0, 1.15)
+        rgb[region] = ink * art_alpha + rgb[region] * (1 - art_alpha)
+
+    # reuse the template buffer for the output, its alpha is the mockup's alpha
+    template[..., :3] = rgb
+    template *= 255
+    template += 0.5
+    buffer = io.BytesIO()
+    Image.fromarray(template.astype(np.uint8)).save(buffer, 'WEBP', quality=quality, method=1)
+    return buffer.getvalue()
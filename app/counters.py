@@ -0,0 +1,46 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from app import models
+
+
+USER_TOTAL_KEY = 'user-counters:total'
+USER_ACTIVE_KEY = 'user-counters:active'
+
+
+def count_users():
+    # the only place that counts rows; runs when the counters are cold or past USER_COUNTERS_TTL
+    total = models.User.objects.count()
+    active = models.User.objects.filter(is_active=True).count()
+    cache.set_many({USER_TOTAL_KEY: total, USER_ACTIVE_KEY: active}, settings.USER_COUNTERS_TTL)
+    return total, active
+
+
+def get_user_counters():
+    values = cache.get_many([USER_TOTAL_KEY, USER_ACTIVE_KEY])
+    if len(values) == 2:
+        total, active = values[USER_TOTAL_KEY], values[USER_ACTIVE_KEY]
+    else:
+        total, active = count_users()
+    return {'total': total, 'active': active, 'suspended': total - active}
+
+
+def adjust_now(total=0, active=0):
+    for key, delta in ((USER_TOTAL_KEY, total), (USER_ACTIVE_KEY, active)):
+        if delta:
+            try:
+                cache.incr(key, delta)
+            except ValueError:
+                # not cached, the next read counts from the table anyway
+                reset_user_counters()
+                return
+
+
+def adjust_user_counters(total=0, active=0):
+    # after commit, so rolled back changes never reach the counters
+    if total or active:
+        transaction.on_commit(lambda: adjust_now(total, active))
+
+
+def reset_user_counters():
+    cache.delete_many([USER_TOTAL_KEY, USER_ACTIVE_KEY])
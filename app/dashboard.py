@@ -0,0 +1,119 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, When, Sum, Q, DateField
+from django.db.models.functions import TruncMonth, TruncWeek
+from django.utils import timezone
+from app import models
+
+
+DASHBOARD_CACHE_KEY = 'admin-dashboard:metrics'
+
+
+def get_dashboard_metrics():
+    metrics = cache.get(DASHBOARD_CACHE_KEY)
+    if metrics is None:
+        metrics = compute_dashboard_metrics()
+        cache.set(DASHBOARD_CACHE_KEY, metrics, settings.DASHBOARD_CACHE_TTL)
+    return metrics
+
+
+def invalidate_dashboard_metrics():
+    cache.delete(DASHBOARD_CACHE_KEY)
+
+
+def compute_dashboard_metrics():
+    now = timezone.localtime()
+    month_start_at = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    month_start = month_start_at.date()
+    last_3m = (now - timedelta(days=90)).date()
+    last_6m = (now - timedelta(days=180)).date()
+
+    # one grouped pass over the daily rollup: a row per month, split into weeks for the current month
+    rows = models.DailyOrderStats.objects.annotate(
+        month=TruncMonth('day'),
+        week=Case(
+            When(day__gte=month_start, then=TruncWeek('day')),
+            output_field=DateField()
+        ),
+    ).values('month', 'week').annotate(
+        value=Sum('revenue'),
+        value_3m=Sum('revenue', filter=Q(day__gte=last_3m)),
+        orders_3m=Sum('order_count', filter=Q(day__gte=last_3m)),
+        value_6m=Sum('revenue', filter=Q(day__gte=last_6m)),
+        orders_6m=Sum('order_count', filter=Q(day__gte=last_6m)),
+        orders=Sum('order_count'),
+        active_orders=Sum('active_count'),
+        cancelled_orders=Sum('cancelled_count'),
+        payments_received=Sum('completed_amount'),
+        new_customers=Sum('new_customers'),
+    ).order_by('month', 'week')
+
+    months = {}
+    one_m = []
+    active_orders = cancelled_orders = 0
+    payments_received = 0
+    new_customers = 0
+    for row in rows:
+        active_orders += row['active_orders'] or 0
+        cancelled_orders += row['cancelled_orders'] or 0
+        payments_received += row['payments_received'] or 0
+        if row['month'] == month_start:
+            new_customers += row['new_customers'] or 0
+        if not row['orders']:
+            continue  # signup-only days
+
+        bucket = months.setdefault(row['month'], {
+            'value': 0, 'value_3m': 0, 'orders_3m': 0, 'value_6m': 0, 'orders_6m': 0
+        })
+        for key in bucket:
+            bucket[key] += row[key] or 0
+
+        if row['week'] is not None:
+            one_m.append({"name": f"Week {len(one_m) + 1}", "value": row['value'] or 0})
+
+    return {
+        'monthly_revenue': months.get(month_start, {}).get('value', 0),
+        'new_apparel_designs': models.UserDesign.objects.filter(created_at__gte=month_start_at).count(),
+        'active_orders': active_orders,
+        'payments_received': payments_received,
+        'new_customers': new_customers,
+        'cancelled_orders': cancelled_orders,
+        "1M": one_m,
+        "3M": three_month_series(months),
+        "6M": six_month_series(months),
+        "1Y": one_year_series(months, now.year),
+        "ALL": all_time_series(months),
+    }
+
+
+def three_month_series(months):
+    return [
+        {"name": month.strftime("%b"), "value": bucket['value_3m']}
+        for month, bucket in months.items() if bucket['orders_3m']
+    ]
+
+
+def six_month_series(months):
+    quarters = {}
+    for month, bucket in months.items():
+        if bucket['orders_6m']:
+            quarter = (month.year, (month.month - 1) // 3)
+            quarters[quarter] = quarters.get(quarter, 0) + bucket['value_6m']
+    return [
+        {"name": f"Q{i}", "value": value}
+        for i, value in enumerate(quarters.values(), start=1)
+    ]
+
+
+def one_year_series(months, year):
+    h1 = sum(bucket['value'] for month, bucket in months.items() if month.year == year and month.month <= 6)
+    h2 = sum(bucket['value'] for month, bucket in months.items() if month.year == year and month.month > 6)
+    return [{"name": "H1", "value": h1}, {"name": "H2", "value": h2}]
+
+
+def all_time_series(months):
+    years = {}
+    for month, bucket in months.items():
+        years[month.year] = years.get(month.year, 0) + bucket['value']
+    return [{"name": year, "value": value} for year, value in years.items()]
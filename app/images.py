@@ -0,0 +1,136 @@
+import io
+import logging
+from django.apps import apps
+from django.db import transaction
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+from app.catalog import bump_catalog_version
+from app.storage import content_hash
+
+logger = logging.getLogger(__name__)
+
+# longest side in px. order grids get the thumbnail, detail pages the preview
+RENDITIONS = {
+    'preview': 640,
+    'thumb': 160,
+}
+
+# models with uploads -> their image fields, the renditions of all of them live in `renditions`
+IMAGE_FIELDS = {
+    'app.user': ['profile_picture'],
+    'app.apparelproduct': ['upload_image'],
+    'app.userdesign': ['image_front', 'image_back'],
+}
+
+
+def needs_renditions(instance):
+    renditions = instance.renditions or {}
+    for field in IMAGE_FIELDS[instance._meta.label_lower]:
+        image = getattr(instance, field)
+        entry = renditions.get(field)
+        if (image.name or None) != (entry['source'] if entry else None):
+            return True
+    return False
+
+
+def schedule_renditions(instance, update_fields=None):
+    from app.tasks import generate_image_renditions
+
+    fields = IMAGE_FIELDS[instance._meta.label_lower]
+    if update_fields is not None and not set(fields).intersection(update_fields):
+        return
+    # renditions deferred by .only(): let the task compare instead of loading the column here
+    if 'renditions' in instance.get_deferred_fields() or needs_renditions(instance):
+        label, pk = instance._meta.label_lower, instance.pk
+        transaction.on_commit(lambda: generate_image_renditions.delay(label, pk))
+
+
+def rendition_names(digest, has_alpha):
+    # keyed by content, identical uploads share one set of files
+    base = f'renditions/{digest[:2]}/{digest}'
+    fallback = 'png' if has_alpha else 'jpg'
+    names = {}
+    for rendition in RENDITIONS:
+        names[rendition] = f'{base}/{rendition}.{fallback}'
+        names[f'{rendition}_webp'] = f'{base}/{rendition}.webp'
+    return names
+
+
+def encode(image, format):
+    buffer = io.BytesIO()
+    if format == 'WEBP':
+        image.save(buffer, 'WEBP', quality=80, method=4)
+    elif format == 'PNG':
+        image.save(buffer, 'PNG', optimize=True)
+    else:
+        image.convert('RGB').save(buffer, 'JPEG', quality=85, optimize=True, progressive=True)
+    return ContentFile(buffer.getvalue())
+
+
+def build_renditions(image_file):
+    with image_file.open('rb') as source:
+        digest = content_hash(source)
+        image = Image.open(source)
+        has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+        names = rendition_names(digest, has_alpha)
+        entry = {'source': image_file.name, **names}
+        if all(default_storage.exists(name) for name in names.values()):
+            return entry
+
+        # jpeg can decode straight at a reduced scale, no need to inflate a print sized file
+        image.draft('RGB', (max(RENDITIONS.values()),) * 2)
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    # largest first, every smaller size is resampled from the previous one
+    for rendition, size in RENDITIONS.items():
+        image.thumbnail((size, size), Image.LANCZOS)
+        for name, format in ((names[rendition], 'PNG' if has_alpha else 'JPEG'), (names[f'{rendition}_webp'], 'WEBP')):
+            if not default_storage.exists(name):
+                default_storage.save(name, encode(image, format))
+    return entry
+
+
+def generate_renditions(model_label, pk):
+    model = apps.get_model(model_label)
+    fields = IMAGE_FIELDS[model_label]
+    instance = model.objects.only('renditions', *fields).filter(pk=pk).first()
+    if instance is None:
+        return None
+
+    renditions = {}
+    for field in fields:
+        image = getattr(instance, field)
+        if not image:
+            continue
+        entry = (instance.renditions or {}).get(field)
+        if entry and entry['source'] == image.name:
+            renditions[field] = entry
+            continue
+        try:
+            renditions[field] = build_renditions(image)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            logger.warning('could not render %s.%s of %s', model_label, field, pk, exc_info=True)
+
+    # plain UPDATE, and only while the images are still the ones rendered here;
+    # a newer upload has its own task queued
+    updated = model.objects.filter(
+        pk=pk, **{field: getattr(instance, field).name for field in fields}
+    ).update(renditions=renditions)
+    if updated and model_label == 'app.apparelproduct':
+        bump_catalog_version()  # the cached catalog lists carry the rendition urls
+    return renditions
+
+
+def rendition_urls(renditions, field, request=None):
+    entry = (renditions or {}).get(field)
+    if not entry:
+        return None
+    urls = {}
+    for rendition, name in entry.items():
+        if rendition == 'source':
+            continue
+        url = default_storage.url(name)
+        urls[rendition] = request.build_absolute_uri(url) if request else url
+    return urls
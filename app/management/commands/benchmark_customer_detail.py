@@ -0,0 +1,81 @@
+import copy
+import statistics
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+from app import models
+from app.views import ViewUserViewSet
+
+
+class Command(BaseCommand):
+    help = "Time of the admin customer detail (/view_user/<id>/) as the order table grows"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, nargs='+', default=[1000, 10000, 100000], help='total orders in the table')
+        parser.add_argument('--customer-orders', type=int, default=50, help="orders of the customer, the rest belong to others")
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        # everything is seeded in a transaction that is rolled back at the end
+        with transaction.atomic():
+            self.seed()
+            self.stdout.write(f"{'orders':>8} {'customer':>9} {'queries':>8} {'median ms':>10}")
+            total = 0
+            for size in sorted(options['orders']):
+                total = self.grow(total, size, options['customer_orders'])
+                queries, timings = self.measure(options['repeat'])
+                customer = models.Order.objects.filter(user=self.customer).count()
+                self.stdout.write(f'{size:>8} {customer:>9} {queries:>8} {statistics.median(timings):>10.2f}')
+            transaction.set_rollback(True)
+
+    def seed(self):
+        pricing = models.PricingRules.objects.create(
+            product_name='Benchmark', base_price=Decimal('20.00'), ai_design_cost=Decimal('2.00'),
+            custom_design_upload_cost=Decimal('1.00'), print_cost=Decimal('8.00'),
+        )
+        size = models.Size.objects.create(name='benchmark')
+        apparel = models.ApparelProduct.objects.create(product=pricing, color_options='black', description='benchmark')
+        self.admin = models.User(is_staff=True, is_superuser=True)
+        self.customer, self.other = [
+            models.User.objects.create(email=f'benchmark-{name}@example.com', username=name, first_name=name, last_name=name)
+            for name in ('customer', 'other')
+        ]
+        self.templates = {}
+        for user in (self.customer, self.other):
+            design = models.UserDesign.objects.create(user=user, apparel=apparel, shirt_size=size)
+            address = models.ShippingAddress.objects.create(
+                user=user, full_name=user.first_name, email=user.email, street_address='street', city='city',
+            )
+            self.templates[user] = models.Order.objects.create(
+                user=user, user_design=design, shipping_address=address, apparel=apparel, color=design.color,
+            )
+
+    def grow(self, total, size, customer_orders):
+        copies = []
+        for index in range(total, size):
+            user = self.customer if index < customer_orders else self.other
+            order = copy.copy(self.templates[user])
+            order.pk = None
+            order.order_id = f'B-{index}'
+            copies.append(order)
+        models.Order.objects.bulk_create(copies, batch_size=1000)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        return size
+
+    def measure(self, repeat):
+        view = ViewUserViewSet.as_view({'get': 'retrieve'}, throttle_classes=[])
+        timings = []
+        for _ in range(repeat):
+            request = APIRequestFactory().get(f'/view_user/{self.customer.id}/')
+            force_authenticate(request, self.admin)
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = view(request, pk=self.customer.id).render()
+                timings.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                raise CommandError(f'customer detail answered {response.status_code}: {response.data}')
+        return len(queries), timings
@@ -0,0 +1,79 @@
+import io
+import os
+import resource
+import tempfile
+import tracemalloc
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+from django.core.management.base import BaseCommand
+from django.http.multipartparser import MultiPartParser
+from django.test import override_settings
+from PIL import Image
+from rest_framework import serializers
+from app.serializers import DesignImageField
+from app.uploads import DesignUploadHandler
+
+BOUNDARY = 'benchmarkboundary'
+CHUNK = 1024 * 1024
+
+
+def write_body(path, size):
+    # a real jpeg header followed by filler: the upload path never decodes pixels,
+    # so only the byte count matters, and building the file costs no memory here
+    header = io.BytesIO()
+    Image.new('RGB', (1200, 800), 'red').save(header, 'JPEG')
+    with open(path, 'wb') as body:
+        body.write(
+            f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="image_front"; filename="art.jpg"\r\n'
+            f'Content-Type: image/jpeg\r\n\r\n'.encode()
+        )
+        body.write(header.getvalue())
+        remaining = size - header.tell()
+        while remaining > 0:
+            body.write(b'\0' * min(CHUNK, remaining))
+            remaining -= CHUNK
+        body.write(f'\r\n--{BOUNDARY}--\r\n'.encode())
+    return os.path.getsize(path)
+
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # kB on linux
+
+
+class Command(BaseCommand):
+    help = "Peak memory of parsing and validating one design upload, per file size"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[5, 20, 50], help='upload sizes in MB')
+        parser.add_argument('--baseline', action='store_true', help="django's default handlers and DRF's ImageField")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'size MB':>8} {'python peak MB':>15} {'max rss MB':>11}")
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+            DESIGN_UPLOAD_MAX_BYTES=max(options['sizes']) * 2 * CHUNK, FILE_UPLOAD_TEMP_DIR=directory,
+        ):
+            for size in options['sizes']:
+                path = os.path.join(directory, f'body-{size}')
+                length = write_body(path, size * CHUNK)
+                peak = self.upload(path, length, options['baseline'])
+                os.remove(path)
+                self.stdout.write(f'{size:>8} {peak / CHUNK:>15.1f} {max_rss_mb():>11.1f}')
+
+    def upload(self, path, length, baseline):
+        if baseline:
+            handlers = [MemoryFileUploadHandler(), TemporaryFileUploadHandler()]
+            field = serializers.ImageField()
+        else:
+            handlers = [DesignUploadHandler()]
+            field = DesignImageField()
+        meta = {
+            'CONTENT_TYPE': f'multipart/form-data; boundary={BOUNDARY}',
+            'CONTENT_LENGTH': str(length),
+        }
+        tracemalloc.start()
+        with open(path, 'rb') as stream:
+            _, files = MultiPartParser(meta, stream, handlers).parse()
+            upload = field.run_validation(files['image_front'])
+            upload.close()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return peak
@@ -0,0 +1,21 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from app.dashboard import invalidate_dashboard_metrics
+from app.rollups import rebuild_daily_stats
+
+
+class Command(BaseCommand):
+    help = "Backfill / rebuild the DailyOrderStats rollup from the orders and users tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='only rebuild the last N days')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['days']:
+            since = timezone.localdate() - timedelta(days=options['days'])
+
+        rebuilt = rebuild_daily_stats(since=since)
+        invalidate_dashboard_metrics()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rebuilt} daily order stats rows."))
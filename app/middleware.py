@@ -0,0 +1,135 @@
+import hmac
+import logging
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse, HttpResponseForbidden
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class RouteMetrics:
+    # per process totals, scraped by db_metrics()
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+
+    def record(self, route, queries, duration, duplicates, over_budget):
+        with self.lock:
+            totals = self.routes.setdefault(route, Counter())
+            totals['requests'] += 1
+            totals['queries'] += queries
+            totals['db_seconds'] += duration
+            totals['duplicate_queries'] += duplicates
+            totals['budget_exceeded'] += 1 if over_budget else 0
+
+    def snapshot(self):
+        with self.lock:
+            return {route: dict(totals) for route, totals in self.routes.items()}
+
+    def reset(self):
+        with self.lock:
+            self.routes = {}
+
+
+route_metrics = RouteMetrics()
+
+METRIC_NAMES = {
+    'requests': 'cad_db_requests_total',
+    'queries': 'cad_db_queries_total',
+    'db_seconds': 'cad_db_seconds_total',
+    'duplicate_queries': 'cad_db_duplicate_queries_total',
+    'budget_exceeded': 'cad_db_budget_exceeded_total',
+}
+
+
+class QueryRecorder:
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.shapes[sql] += 1  # sql still has its %s placeholders, same shape = same statement
+
+    @property
+    def duplicates(self):
+        return sum(count - 1 for count in self.shapes.values() if count > 1)
+
+
+def get_route_name(view_func, method):
+    method = method.lower()
+    view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    if view_class is None:
+        return getattr(view_func, '__name__', 'unknown')
+    actions = getattr(view_func, 'actions', None) or {}
+    # viewsets: the router maps http methods to action names, e.g. ListOrderViewset.list
+    return f'{view_class.__name__}.{actions.get(method, method)}'
+
+
+class QueryInstrumentationMiddleware:
+    '''
+    Opt-in (settings.QUERY_INSTRUMENTATION) per request SQL accounting:
+    query count, db time and repeated statements per view/action.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        request._query_view = None
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+
+        route = 'unresolved'
+        if request._query_view is not None:
+            route = get_route_name(request._query_view, request.method)
+        budget = settings.QUERY_BUDGETS.get(route, settings.QUERY_BUDGET_DEFAULT)
+        over_budget = budget is not None and recorder.count > budget
+        route_metrics.record(route, recorder.count, recorder.duration, recorder.duplicates, over_budget)
+
+        if settings.DEBUG:
+            response['X-DB-Route'] = route
+            response['X-DB-Query-Count'] = str(recorder.count)
+            response['X-DB-Time-Ms'] = f'{recorder.duration * 1000:.2f}'
+            response['X-DB-Duplicate-Queries'] = str(recorder.duplicates)
+
+        if over_budget:
+            message = f'{route} ran {recorder.count} queries, budget is {budget}'
+            if settings.QUERY_BUDGET_STRICT:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._query_view = view_func
+
+
+def db_metrics(request):
+    # production per-route timings, never served without QUERY_METRICS_TOKEN
+    token = settings.QUERY_METRICS_TOKEN
+    if not token or not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponseForbidden()
+
+    routes = sorted(route_metrics.snapshot().items())
+    lines = []
+    for name, metric in METRIC_NAMES.items():
+        lines.append(f'# TYPE {metric} counter')
+        for route, totals in routes:
+            lines.append(f'{metric}{{route="{route}"}} {totals.get(name, 0)}')
+    return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4')
@@ -0,0 +1,115 @@
+import hashlib
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from app import compositor
+
+logger = logging.getLogger(__name__)
+
+SIDES = {
+    'front': 'image_front',
+    'back': 'image_back',
+}
+
+
+class MockupError(Exception):
+    pass
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_render_pool():
+    # spawned, not forked: workers only import numpy, Pillow and compositor.py.
+    # one pool per web worker process, a forked child builds its own
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ProcessPoolExecutor(
+                    max_workers=settings.MOCKUP_WORKERS,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def discard_render_pool(pool):
+    # a worker died (e.g. killed for memory on a huge template), the pool refuses all work after that
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def source_name(instance, field):
+    # the preview rendition once images.py has made it: a fraction of the pixels to decode
+    entry = (instance.renditions or {}).get(field)
+    return entry['preview'] if entry else getattr(instance, field).name
+
+
+def mockup_name(template, color, artwork):
+    # uploads and renditions are named by content hash, so this key is (apparel, colour, design hash)
+    key = hashlib.md5(f'{template}\n{color}\n{artwork or ""}'.encode()).hexdigest()
+    return f'mockups/{key[:2]}/{key}.webp'
+
+
+def read_source(name):
+    try:
+        return default_storage.path(name)
+    except NotImplementedError:
+        with default_storage.open(name, 'rb') as source:
+            return source.read()
+
+
+def render(jobs):
+    if not settings.MOCKUP_WORKERS:
+        return {name: compositor.render_mockup(*args) for name, args in jobs.items()}
+    for attempt in range(2):
+        pool = get_render_pool()
+        try:
+            futures = {name: pool.submit(compositor.render_mockup, *args) for name, args in jobs.items()}
+            return {name: future.result() for name, future in futures.items()}
+        except BrokenProcessPool:
+            logger.warning('mockup render pool broke, starting a new one')
+            discard_render_pool(pool)
+    raise MockupError('the mockup renderer crashed, try again later')
+
+
+def get_mockups(design):
+    '''
+    Storage names of the front and back mockups of a design, rendered on first
+    request. Sides without artwork show the tinted garment alone.
+    '''
+    apparel = design.apparel
+    if not apparel.upload_image:
+        raise MockupError('this apparel has no product image to render on')
+
+    template = source_name(apparel, 'upload_image')
+    color = design.color.strip().lower()
+    names, jobs = {}, {}
+    for side, field in SIDES.items():
+        artwork = source_name(design, field) if getattr(design, field) else None
+        name = names[side] = mockup_name(template, color, artwork)
+        if name not in jobs and not default_storage.exists(name):
+            jobs[name] = (
+                read_source(template), color, read_source(artwork) if artwork else None, settings.MOCKUP_MAX_SIDE,
+            )
+
+    try:
+        rendered = render(jobs)
+    except (OSError, ValueError) as exc:
+        raise MockupError(f'could not render the mockup: {exc}')
+    for name, data in rendered.items():
+        if not default_storage.exists(name):  # a concurrent request may have stored it meanwhile
+            default_storage.save(name, ContentFile(data))
+    return names
@@ -1,15 +1,101 @@
-from django.db import models
-from django.contrib.auth.models import AbstractUser
+from django.db import models, connection, transaction, IntegrityError
+from django.contrib.auth.models import AbstractUser, UserManager
+from django.db.models import Count, Sum, Max, OuterRef, Subquery, Value, Q
+from django.db.models.functions import Coalesce
 from .choices import *
+from . import pricing
+from .storage import content_storage
 from django.utils import timezone
 from datetime import timedelta
-import random
-import string
 from django.utils.translation import gettext_lazy as _
 from decimal import Decimal
+import uuid
 
 
 
+class IdSequence(models.Model):
+    '''
+    Counter rows backing the human readable ids (U-101, P-101, A-101).
+    A single UPDATE ... RETURNING bumps the counter, so parallel gunicorn and
+    celery workers never read the last row and never hand out the same id.
+    '''
+
+    name = models.CharField(max_length=50, unique=True)
+    last_value = models.BigIntegerField(default=100)
+
+    class Meta:
+        verbose_name = 'Id Sequence'
+        verbose_name_plural = 'Id Sequences'
+
+    def __str__(self):
+        return f'{self.name} - {self.last_value}'
+
+    @classmethod
+    def reserve(cls, name, count=1):
+        # returns the reserved block as a range, or None if the sequence row is missing
+        table = connection.ops.quote_name(cls._meta.db_table)
+        sql = f'UPDATE {table} SET last_value = last_value + %s WHERE name = %s RETURNING last_value'
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [count, name])
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return range(row[0] - count + 1, row[0] + 1)
+
+    @classmethod
+    def create_sequence(cls, name, count=1, start=100):
+        try:
+            with transaction.atomic():
+                cls.objects.create(name=name, last_value=start + count)
+            return range(start + 1, start + count + 1)
+        except IntegrityError:
+            # another worker created the row first, bump it instead
+            return cls.reserve(name, count)
+
+    @classmethod
+    def legacy_start(cls, model, field):
+        # ids handed out before the sequence existed, only read once per sequence
+        last_code = model.objects.exclude(**{f'{field}__isnull': True}).order_by('-id').values_list(field, flat=True).first()
+        try:
+            return int(last_code.split('-')[1])
+        except (AttributeError, IndexError, ValueError):
+            return 100
+
+    @classmethod
+    def next_codes(cls, model, field, prefix, count=1):
+        name = f'{model._meta.label_lower}.{field}'
+        block = cls.reserve(name, count)
+        if block is None:
+            block = cls.create_sequence(name, count, start=cls.legacy_start(model, field))
+        return [f'{prefix}-{value}' for value in block]
+
+    @classmethod
+    def next_code(cls, model, field, prefix):
+        return cls.next_codes(model, field, prefix)[0]
+
+
+
+class UserQuerySet(models.QuerySet):
+
+    def with_order_stats(self):
+        # ListUserSerializer: correlated subqueries, so a page never groups the whole order table
+        orders = Order.objects.filter(user=OuterRef('pk')).order_by().values('user')
+        return self.annotate(
+            total_orders=Coalesce(Subquery(orders.annotate(value=Count('id')).values('value')), 0),
+            total_spent=Coalesce(
+                Subquery(orders.annotate(value=Sum('total_amount')).values('value')),
+                Value(Decimal('0.00')),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2),
+            ),
+            last_order_at=Subquery(orders.annotate(value=Max('created_at')).values('value')),
+        )
+
+
+class CustomUserManager(UserManager.from_queryset(UserQuerySet)):
+    # module level class, migrations serialize managers with use_in_migrations
+    pass
+
+
 class User(AbstractUser):
 
     user_id = models.CharField(max_length=10 , unique=True , null=True ,blank=True)
@@ -25,9 +111,11 @@ class User(AbstractUser):
     consent = models.BooleanField(default=False)
     otp = models.CharField(max_length=6, blank=True, null=True)
     otp_expiry = models.DateTimeField(blank=True, null=True)
+    otp_attempts = models.PositiveSmallIntegerField(default=0)  # wrong guesses against the current otp
      
     #profile model
-    profile_picture = models.ImageField(upload_to='user/profile_pictures', blank=True, null=True)
+    profile_picture = models.ImageField(upload_to='user/profile_pictures', storage=content_storage, blank=True, null=True)
+    renditions = models.JSONField(default=dict, blank=True)  # thumbnails/webp of the picture, see images.py
     country = models.CharField(max_length=50, blank=True, null=True)
 
     #notification settings
@@ -41,6 +129,15 @@ class User(AbstractUser):
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username']
 
+    objects = CustomUserManager()
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # rollup rebuilds and the user list filters
+            models.Index(fields=['created_at'], name='user_created_idx'),
+            models.Index(fields=['is_active', '-created_at'], name='user_active_created_idx'),
+        ]
+
     welcome_message = _(
         'Hi, {name}\n'
         'Here is your OTP for registration: {otp}\n'
@@ -53,28 +150,17 @@ class User(AbstractUser):
         'This OTP is valid only for 10 minutes, after that you will need to resend OTP.'
     )
 
-    def generate_otp(self):
-        otp = ''.join(random.choices(string.digits, k=6))
-        self.otp = otp
-        self.otp_expiry = timezone.now() + timedelta(minutes=10)
-        self.save()
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # stored flag, the user-management counters only move when it changes (see counters.py)
+        instance._loaded_is_active = instance.__dict__.get('is_active')
+        return instance
 
     def save(self, *args, **kwargs):
         if not self.user_id:
-            last_user = User.objects.order_by('-id').first()  
-
-            if last_user and last_user.user_id:
-                try:
-                    last_id = int(last_user.user_id.split('-')[1])
-                except (IndexError, ValueError):
-                    last_id = 100
-            else:
-                last_id = 100
-
-            new_id = last_id + 1
-            self.user_id = f'U-{new_id}'
-
-        super().save(*args, **kwargs)  
+            self.user_id = IdSequence.next_code(User, 'user_id', 'U')
+        super().save(*args, **kwargs)
 
 
 
@@ -92,7 +178,8 @@ class ApparelProduct(models.Model):
     sizes_available = models.ManyToManyField('Size', related_name='apparel_sizes')
     color_options = models.CharField(max_length=100)
     description = models.TextField()
-    upload_image = models.ImageField(upload_to='admin/product/thumbnails/', null=True, blank=True)
+    upload_image = models.ImageField(upload_to='admin/product/thumbnails/', storage=content_storage, null=True, blank=True)
+    renditions = models.JSONField(default=dict, blank=True)  # see images.py
     is_active = models.BooleanField(default=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
@@ -100,20 +187,8 @@ class ApparelProduct(models.Model):
     
     def save(self, *args, **kwargs):
         if not self.product_uid:
-            last_product = ApparelProduct.objects.order_by('-id').first()  
-
-            if last_product and last_product.product_uid:
-                try:
-                    last_id = int(last_product.product_uid.split('-')[1])
-                except (IndexError, ValueError):
-                    last_id = 100
-            else:
-                last_id= 100
-
-            new_id = last_id + 1
-            self.product_uid = f'P-{new_id}'
-
-        super().save(*args, **kwargs)  
+            self.product_uid = IdSequence.next_code(ApparelProduct, 'product_uid', 'P')
+        super().save(*args, **kwargs)
 
 
     def __str__(self):
@@ -156,8 +231,9 @@ class UserDesign(models.Model):
     design_type = models.CharField(max_length=10, choices=UserDesignType.choices, default=UserDesignType.AI_GENERATED)
 
     prompt = models.TextField(blank=True, null=True)
-    image_front = models.ImageField(upload_to='user/product-design/front_images/', null=True, blank=True)
-    image_back = models.ImageField(upload_to='user/product-design/back_images/', null=True, blank=True)
+    image_front = models.ImageField(upload_to='user/product-design/front_images/', storage=content_storage, null=True, blank=True)
+    image_back = models.ImageField(upload_to='user/product-design/back_images/', storage=content_storage, null=True, blank=True)
+    renditions = models.JSONField(default=dict, blank=True)  # see images.py
 
     font = models.CharField(max_length=30, blank=True, null=True)
     style = models.CharField(max_length=20, choices=ProductPrintMethods.choices, default=ProductPrintMethods.embroidary)
@@ -167,22 +243,17 @@ class UserDesign(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     is_draft = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # the drafts list only ever reads a user's drafts, finished designs stay out of the index
+            models.Index(fields=['user', '-created_at'], condition=Q(is_draft=True), name='design_user_drafts_idx'),
+            models.Index(fields=['created_at'], name='design_created_idx'),
+        ]
 
     @property
     def calculate_price(self):
-        
-        if not hasattr(self.product, 'pricing_rule') or not self.product.pricing_rule:
-            raise ValueError(f"PricingRule not found for product ID {self.product.id}")
-
-        pricing_rule = self.product.pricing_rule
-        cost = pricing_rule.base_price + pricing_rule.print_cost
-        
-        if self.design_type == UserDesignType.AI_GENERATED:
-            cost += pricing_rule.ai_design_cost
-        else:
-            cost += pricing_rule.custom_design_upload_cost
-        
-        return cost
+        # per item price of this design
+        return pricing.quote(self.apparel_id, self.design_type).unit_price
 
 
     def __str__(self):
@@ -240,6 +311,27 @@ class BillingAddress(models.Model):
         return f'User {self.user.get_full_name()} Billing Address'
 
 
+class OrderQuerySet(models.QuerySet):
+
+    def with_apparel(self):
+        # ListOrderSerializer, AdminUserViewOrdersSerializer
+        return self.select_related('apparel__product')
+
+    def with_thumbnail(self):
+        # ListOrderSerializer's design thumbnail
+        return self.select_related('user_design')
+
+    def with_details(self):
+        # TrackOrderSerializer, ViewUserOrderDetailsSerializer
+        return self.select_related(
+            'user',
+            'shipping_address',
+            'apparel__product',
+            'user_design__shirt_size',
+            'user_design__apparel__product',
+        )
+
+
 def get_estimated_delivery_date():
     return timezone.now() + timedelta(days=5)
 
@@ -270,37 +362,76 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     estimated_delivery_date = models.DateTimeField(default=get_estimated_delivery_date)
 
-    def calculate_price(self):
-        try:
-            pricing = self.apparel.product
-            base_price = self.apparel.product.base_price if self.apparel.product.base_price else 0
-        except PricingRules.DoesNotExist:
-            base_price = None
+    # open Stripe checkout session, reused until it expires (see checkout.py)
+    checkout_session_id = models.CharField(max_length=255, null=True, blank=True)
+    checkout_session_url = models.URLField(max_length=1000, null=True, blank=True)
+    checkout_session_expires_at = models.DateTimeField(null=True, blank=True)
+    checkout_session_amount = models.PositiveIntegerField(null=True, blank=True)  # cents the stored session charges
 
-        # base_price = pricing.base_price if pricing else 0
-        ai_cost = pricing.ai_design_cost if self.design_type == 'ai' and pricing is not None  else 0
-        upload_cost = pricing.custom_design_upload_cost if self.design_type == 'upload' else 0
-        print_cost = pricing.print_cost
+    objects = OrderQuerySet.as_manager()
 
-        # Calculate price for one item
-        per_item_price = base_price + ai_cost + upload_cost + print_cost
+    class Meta:
+        indexes = [
+            # a customer's orders newest first: ViewUserViewSet, UserQuerySet.with_order_stats
+            models.Index(fields=['user', '-created_at'], name='order_user_created_idx'),
+            # date ranges (rollup rebuilds, bulk actions) and the admin status counts
+            models.Index(fields=['created_at'], name='order_created_idx'),
+            models.Index(fields=['order_status', 'payment'], name='order_status_payment_idx'),
+            # partial indexes over the small, hot subsets: open orders and the fulfilment queue
+            models.Index(fields=['created_at'], condition=Q(is_active=True), name='order_active_created_idx'),
+            models.Index(
+                fields=['order_tracking_status', 'created_at'],
+                condition=Q(order_status=OrderStatus.PROCESSING),
+                name='order_processing_idx',
+            ),
+        ]
+
+    # the columns stats_contribution() reads
+    STATS_FIELDS = ['created_at', 'total_amount', 'quantity', 'is_active', 'order_status']
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remember what this row already contributes to DailyOrderStats. not for only()/defer()
+        # loads: reading a deferred field here refreshes it through from_db again
+        if all(field in instance.__dict__ for field in cls.STATS_FIELDS):
+            instance._loaded_stats = instance.stats_contribution()
+        else:
+            instance._loaded_stats = None
+        return instance
+
+    def stored_stats(self):
+        # stats_contribution() of the row as it is in the database
+        row = Order.objects.filter(pk=self.pk).values(*self.STATS_FIELDS).first()
+        return Order(**row).stats_contribution() if row else None
+
+    def stats_contribution(self):
+        if self.created_at is None or self.total_amount is None:
+            return None
+        return {
+            'day': timezone.localdate(self.created_at),
+            'revenue': self.total_amount * self.quantity,
+            'order_count': 1,
+            'active_count': 1 if self.is_active else 0,
+            'cancelled_count': 1 if self.order_status == OrderStatus.CANCELLED else 0,
+            'completed_amount': self.total_amount if self.order_status == OrderStatus.COMPLETED else 0,
+        }
 
-        self.subtotal = per_item_price * self.quantity
-        self.total_amount = self.subtotal - self.discount_applied + self.shipping_fee
+    def calculate_price(self):
+        quote = pricing.quote(
+            self.apparel_id,
+            self.design_type,
+            self.quantity,
+            self.discount_applied,
+            self.shipping_fee,
+        )
+        self.subtotal = quote.subtotal
+        self.total_amount = quote.total
 
     def save(self, *args, **kwargs):
 
         if not self.order_id:
-            last_order = Order.objects.order_by('id').last()
-            if last_order and last_order.order_id:
-                try:
-                    last_id = int(last_order.order_id.split('-')[1])
-                except:
-                    last_id = 100
-            else:
-                last_id = 100
-            new_id = last_id + 1
-            self.order_id = f'A-{new_id}'
+            self.order_id = IdSequence.next_code(Order, 'order_id', 'A')
 
 
         # Auto-update order_status based on tracking status
@@ -308,9 +439,120 @@ class Order(models.Model):
             self.order_status = OrderStatus.COMPLETED
         elif self.order_status != OrderStatus.CANCELLED:  # don't override if manually cancelled
             self.order_status = OrderStatus.PROCESSING
-        print(self.order_status)
         self.calculate_price()
         super().save(*args, **kwargs)
 
     def __str__(self):
-        return f"Order #{self.pk} - {self.order_status}"
\ No newline at end of file
+        return f"Order #{self.pk} - {self.order_status}"
+
+
+
+class DailyOrderStats(models.Model):
+    '''
+    Per day rollup of orders and signups feeding the admin dashboard charts.
+    Kept up to date by the Order/User signals, rebuilt with `rebuild_order_stats`.
+    '''
+
+    day = models.DateField(unique=True)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    order_count = models.IntegerField(default=0)
+    active_count = models.IntegerField(default=0)
+    cancelled_count = models.IntegerField(default=0)
+    completed_amount = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    new_customers = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Daily Order Stats'
+        verbose_name_plural = 'Daily Order Stats'
+        ordering = ['day']
+
+    def __str__(self):
+        return f'{self.day} - {self.order_count} orders'
+
+
+
+class OutboxMessage(models.Model):
+    '''
+    Outgoing email waiting to be delivered by the `drain_email_outbox` task,
+    which sends them in batches over one SMTP connection.
+    '''
+
+    to_email = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True, null=True)
+
+    status = models.CharField(max_length=10, choices=OutboxStatus.choices, default=OutboxStatus.PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'Outbox Message'
+        verbose_name_plural = 'Outbox Messages'
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.subject} -> {self.to_email} ({self.status})'
+
+
+
+class StripeEvent(models.Model):
+    '''
+    Verified Stripe webhook deliveries, one row per Stripe event id. The webhook
+    only inserts here; the `process_stripe_events` task applies them in batches.
+    '''
+
+    event_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=100)
+    payload = models.JSONField()
+
+    status = models.CharField(max_length=10, choices=StripeEventStatus.choices, default=StripeEventStatus.PENDING)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'Stripe Event'
+        verbose_name_plural = 'Stripe Events'
+        indexes = [
+            models.Index(fields=['status', 'id']),
+        ]
+
+    def __str__(self):
+        return f'{self.event_type} {self.event_id} ({self.status})'
+
+
+
+class DesignUpload(models.Model):
+    '''
+    A resumable upload of one design image. Chunks are appended to a partial file
+    (see resumable.py); `offset` is how many bytes of it are confirmed, so an
+    interrupted client asks for it and carries on from there.
+    '''
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='design_uploads')
+    design = models.ForeignKey(UserDesign, on_delete=models.CASCADE, related_name='uploads')
+    field = models.CharField(max_length=20, choices=DesignUploadField.choices)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    checksum = models.CharField(max_length=64)  # sha256 hex of the whole file
+    offset = models.BigIntegerField(default=0)
+
+    status = models.CharField(max_length=10, choices=DesignUploadStatus.choices, default=DesignUploadStatus.PENDING)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Design Upload'
+        verbose_name_plural = 'Design Uploads'
+        indexes = [
+            models.Index(fields=['status', 'updated_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.filename} {self.offset}/{self.size} ({self.status})'
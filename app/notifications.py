@@ -0,0 +1,147 @@
+import hashlib
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from app import models, choices
+
+logger = logging.getLogger(__name__)
+
+DRAIN_SCHEDULED_KEY = 'outbox:drain-scheduled'
+
+
+def enqueue_email(to_email, subject, body, html_body=None, dedupe_seconds=None):
+    # dedupe_seconds: drop repeats of the same subject to the same address (alert storms)
+    dedupe_key = 'outbox:dedupe:' + hashlib.md5(f'{to_email}\n{subject}'.encode()).hexdigest()
+    if dedupe_seconds and not cache.add(dedupe_key, 1, dedupe_seconds):
+        return None
+
+    message = models.OutboxMessage.objects.create(
+        to_email=to_email,
+        subject=subject,
+        body=body,
+        html_body=html_body,
+    )
+    transaction.on_commit(schedule_drain)
+    return message
+
+
+def enqueue_emails(messages):
+    # messages: iterable of (to_email, subject, body) tuples, one INSERT for all of them
+    messages = models.OutboxMessage.objects.bulk_create(
+        [models.OutboxMessage(to_email=to_email, subject=subject, body=body) for to_email, subject, body in messages],
+        batch_size=1000,
+    )
+    if messages:
+        transaction.on_commit(schedule_drain)
+    return messages
+
+
+def schedule_drain(countdown=None):
+    # at most one drain task waiting at a time, messages queued meanwhile ride along
+    from app.tasks import drain_email_outbox
+
+    if countdown is None:
+        countdown = settings.NOTIFICATION_DRAIN_DELAY
+    if cache.add(DRAIN_SCHEDULED_KEY, 1, countdown + 1):
+        drain_email_outbox.apply_async(countdown=countdown)
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=settings.NOTIFICATION_RETRY_BACKOFF * 2 ** (attempts - 1))
+
+
+def build_email(message, connection):
+    email = EmailMultiAlternatives(
+        message.subject,
+        message.body,
+        settings.EMAIL_HOST_USER,
+        [message.to_email],
+        connection=connection,
+    )
+    if message.html_body:
+        email.attach_alternative(message.html_body, 'text/html')
+    return email
+
+
+def claim_batch(batch_size):
+    # rows stay locked only while they are claimed: the lease keeps other drains
+    # off them while this one talks to SMTP outside any transaction
+    with transaction.atomic():
+        batch = list(
+            models.OutboxMessage.objects.select_for_update(skip_locked=True).filter(
+                status=choices.OutboxStatus.PENDING,
+                next_attempt_at__lte=timezone.now(),
+            ).order_by('id')[:batch_size]
+        )
+        if batch:
+            models.OutboxMessage.objects.filter(id__in=[message.id for message in batch]).update(
+                next_attempt_at=timezone.now() + timedelta(seconds=settings.NOTIFICATION_CLAIM_TIMEOUT)
+            )
+    return batch
+
+
+def record_failure(message, error):
+    message.attempts += 1
+    message.last_error = str(error)
+    if message.attempts >= settings.NOTIFICATION_MAX_ATTEMPTS:
+        message.status = choices.OutboxStatus.FAILED
+    else:
+        message.next_attempt_at = timezone.now() + retry_delay(message.attempts)
+
+
+def drain_outbox(batch_size=None):
+    batch_size = batch_size or settings.NOTIFICATION_BATCH_SIZE
+    cache.delete(DRAIN_SCHEDULED_KEY)
+    sent = 0
+
+    while True:
+        batch = claim_batch(batch_size)
+        if not batch:
+            break
+
+        # one SMTP session for the whole batch
+        connection = get_connection(fail_silently=False)
+        delivered, failed = [], []
+        try:
+            connection.open()
+        except Exception as e:
+            # relay down: the whole batch backs off, attempts and the cap still apply
+            logger.warning('outbox connection failed, %s messages postponed: %s', len(batch), e)
+            for message in batch:
+                record_failure(message, e)
+            failed = batch
+        else:
+            try:
+                for message in batch:
+                    try:
+                        connection.send_messages([build_email(message, connection)])
+                    except Exception as e:
+                        logger.warning('outbox message %s failed: %s', message.id, e)
+                        record_failure(message, e)
+                        failed.append(message)
+                    else:
+                        delivered.append(message.id)
+            finally:
+                connection.close()
+
+        # the common case is one plain UPDATE, only failures need per row values
+        models.OutboxMessage.objects.filter(id__in=delivered).update(
+            status=choices.OutboxStatus.SENT, attempts=F('attempts') + 1, sent_at=timezone.now()
+        )
+        models.OutboxMessage.objects.bulk_update(failed, ['status', 'attempts', 'next_attempt_at', 'last_error'])
+        sent += len(delivered)
+        if len(batch) < batch_size:
+            break
+
+    # come back for the messages that are waiting on a retry
+    retry_at = models.OutboxMessage.objects.filter(
+        status=choices.OutboxStatus.PENDING
+    ).order_by('next_attempt_at').values_list('next_attempt_at', flat=True).first()
+    if retry_at is not None:
+        schedule_drain(max(int((retry_at - timezone.now()).total_seconds()), 0) + 1)
+    return sent
@@ -0,0 +1,131 @@
+from django.db import transaction
+from django.db.models import QuerySet
+from app import models, choices, notifications, rollups, utils
+from app.dashboard import invalidate_dashboard_metrics
+
+
+class TransitionError(ValueError):
+    pass
+
+
+# field -> target value -> values the order may move from
+TRANSITIONS = {
+    'order_tracking_status': {
+        choices.OrderTrackingStatus.ORDER_PACKED: [choices.OrderTrackingStatus.ORDER_PLACED],
+        choices.OrderTrackingStatus.IN_TRANSIT: [choices.OrderTrackingStatus.ORDER_PACKED],
+        choices.OrderTrackingStatus.OUT_FOR_DELIVERY: [choices.OrderTrackingStatus.IN_TRANSIT],
+        choices.OrderTrackingStatus.DELIVERED: [choices.OrderTrackingStatus.OUT_FOR_DELIVERY],
+    },
+    'order_status': {
+        choices.OrderStatus.CANCELLED: [choices.OrderStatus.PROCESSING],
+    },
+    'payment': {
+        choices.PaymentStatus.PAID: [choices.PaymentStatus.UNPAID, choices.PaymentStatus.FAILED],
+        choices.PaymentStatus.FAILED: [choices.PaymentStatus.UNPAID],
+        choices.PaymentStatus.UNPAID: [choices.PaymentStatus.FAILED],
+    },
+}
+
+# state every order must be in before the field may change at all
+PRECONDITIONS = {
+    'order_tracking_status': {'order_status': choices.OrderStatus.PROCESSING},
+}
+
+# columns that follow from a transition, what Order.save() derives for a full save
+FOLLOW_UPS = {
+    ('order_tracking_status', choices.OrderTrackingStatus.DELIVERED): {'order_status': choices.OrderStatus.COMPLETED},
+    ('order_status', choices.OrderStatus.CANCELLED): {'is_active': False},
+}
+
+# enough of the order for the stats delta, nothing else is loaded
+LOADED_FIELDS = [
+    'id', 'order_id', 'created_at', 'total_amount', 'quantity',
+    'is_active', 'order_status', 'order_tracking_status', 'payment',
+]
+
+
+def allowed_sources(field, target):
+    try:
+        return TRANSITIONS[field][target]
+    except KeyError:
+        raise TransitionError(f'{field} cannot be set to {target}')
+
+
+def transition_orders(orders, field, target):
+    '''
+    Moves every order in `orders` (ids or an Order queryset) that is in an allowed
+    source state to `target` with one UPDATE of just the changed columns. Orders in
+    any other state are skipped. Returns the updated orders.
+    '''
+    sources = allowed_sources(field, target)
+    changes = {field: target, **FOLLOW_UPS.get((field, target), {})}
+
+    if isinstance(orders, QuerySet):
+        orders = orders.values('id')
+    eligible = models.Order.objects.filter(
+        id__in=orders,
+        **{f'{field}__in': sources},
+        **PRECONDITIONS.get(field, {}),
+    )
+
+    with transaction.atomic():
+        # rows stay locked until commit, so the UPDATE below hits exactly these
+        updated = list(
+            eligible.select_for_update().only(*LOADED_FIELDS).order_by('id')
+        )
+        if not updated:
+            return []
+        eligible.update(**changes)
+
+        stats = []
+        for order in updated:
+            for name, value in changes.items():
+                setattr(order, name, value)
+            new = order.stats_contribution()
+            stats.append((order._loaded_stats, new))
+            order._loaded_stats = new
+        if any(old != new for old, new in stats):
+            rollups.apply_order_changes(stats)
+            transaction.on_commit(invalidate_dashboard_metrics)
+
+        if field == 'order_tracking_status':
+            schedule_tracking_notifications([order.id for order in updated], target)
+    return updated
+
+
+def transition_matching(orders, field, target, limit):
+    '''
+    transition_orders for an admin filter or id list. The matched orders are locked
+    first, so matched and skipped describe exactly the rows the UPDATE saw, and a
+    filter matching more than `limit` orders is refused instead of locking them all.
+    Returns (matched count, updated orders).
+    '''
+    with transaction.atomic():
+        matched = list(orders.select_for_update().order_by('id').values_list('id', flat=True)[:limit + 1])
+        if len(matched) > limit:
+            raise TransitionError(f'more than {limit} orders match, narrow the filters')
+        return len(matched), transition_orders(matched, field, target)
+
+
+def transition_order(order_id, field, target):
+    updated = transition_orders([order_id], field, target)
+    if not updated:
+        raise TransitionError(f'order {order_id} cannot move to {field} {target}')
+    return updated[0]
+
+
+def schedule_tracking_notifications(order_ids, target):
+    # one task for the whole batch, it does the user lookups off the request
+    from app.tasks import send_tracking_notifications
+
+    transaction.on_commit(lambda: send_tracking_notifications.delay(order_ids, target))
+
+
+def send_tracking_notifications(order_ids, target):
+    label = choices.OrderTrackingStatus(target).label
+    rows = models.Order.objects.filter(
+        id__in=order_ids, user__shipping_delivery_updates=True
+    ).values_list('user__email', 'order_id')
+    return len(notifications.enqueue_emails([
+        utils.shipping_delivery_message(email, order_id, label) for email, order_id in rows
+    ]))
@@ -0,0 +1,169 @@
+import hashlib
+import logging
+import secrets
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+from redis.exceptions import ConnectionError, TimeoutError
+from app import models
+
+logger = logging.getLogger(__name__)
+
+WELCOME = 'welcome'
+PASSWORD_RESET = 'reset'
+
+# compare-and-delete: a code verifies once. wrong guesses count against the code and
+# burn it after OTP_MAX_ATTEMPTS, so six digits cannot be brute forced within the ttl.
+# returns -1 when there is no code at all
+VERIFY_SCRIPT = '''
+local code = redis.call('GET', KEYS[1])
+if not code then
+    return -1
+end
+if code == ARGV[1] then
+    redis.call('DEL', KEYS[1], KEYS[2])
+    return 1
+end
+if redis.call('INCR', KEYS[2]) >= tonumber(ARGV[2]) then
+    redis.call('DEL', KEYS[1], KEYS[2])
+else
+    redis.call('PEXPIRE', KEYS[2], redis.call('PTTL', KEYS[1]))
+end
+return 0
+'''
+
+# sliding window over a sorted set of send timestamps, returns the ms to wait (0 = allowed)
+SEND_LIMIT_SCRIPT = '''
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[3]) then
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    return math.max(1, tonumber(oldest[2]) + window - now)
+end
+redis.call('ZADD', KEYS[1], now, ARGV[4])
+redis.call('PEXPIRE', KEYS[1], window)
+return 0
+'''
+
+
+def generate_code():
+    return ''.join(secrets.choice('0123456789') for _ in range(6))
+
+
+def email_key(email):
+    return hashlib.md5(email.strip().lower().encode()).hexdigest()
+
+
+class DatabaseOTPStore:
+    '''
+    Fallback for setups without redis (tests, local sqlite). Codes live in the
+    otp/otp_expiry columns, written and cleared with single conditional UPDATEs.
+    Wrong guesses count in otp_attempts, a code stops verifying at OTP_MAX_ATTEMPTS.
+    '''
+
+    def issue(self, purpose, email):
+        code = generate_code()
+        models.User.objects.filter(email=email).update(
+            otp=code, otp_expiry=timezone.now() + timedelta(seconds=settings.OTP_TTL), otp_attempts=0
+        )
+        return code
+
+    def verify(self, purpose, email, code):
+        live = models.User.objects.filter(email=email, otp__isnull=False, otp_expiry__gt=timezone.now())
+        if live.filter(otp=code, otp_attempts__lt=settings.OTP_MAX_ATTEMPTS).update(
+            otp=None, otp_expiry=None, otp_attempts=0
+        ) == 1:
+            return True
+        live.update(otp_attempts=F('otp_attempts') + 1)
+        return False
+
+    def send_retry_after(self, email):
+        key = f'otp:sends:{email_key(email)}'
+        now = time.time()
+        sends = [sent for sent in cache.get(key, []) if sent > now - settings.OTP_SEND_WINDOW]
+        if len(sends) >= settings.OTP_SEND_LIMIT:
+            return sends[0] + settings.OTP_SEND_WINDOW - now
+        cache.set(key, sends + [now], settings.OTP_SEND_WINDOW)
+        return 0
+
+
+class RedisOTPStore:
+    '''
+    Codes as redis keys with a native ttl, nothing is written to the users table.
+    Falls back to the database store while redis is unreachable.
+    '''
+
+    def __init__(self):
+        from django_redis import get_redis_connection
+
+        self.redis = get_redis_connection('default')
+        self.verify_script = self.redis.register_script(VERIFY_SCRIPT)
+        self.send_limit_script = self.redis.register_script(SEND_LIMIT_SCRIPT)
+        self.fallback = DatabaseOTPStore()
+
+    def keys(self, purpose, email):
+        key = f'otp:{purpose}:{email_key(email)}'
+        return key, f'{key}:attempts'
+
+    def issue(self, purpose, email):
+        code = generate_code()
+        code_key, attempts_key = self.keys(purpose, email)
+        try:
+            with self.redis.pipeline() as pipe:
+                pipe.set(code_key, code, ex=settings.OTP_TTL)
+                pipe.delete(attempts_key)
+                pipe.execute()
+        except (ConnectionError, TimeoutError):
+            logger.warning('redis unavailable, storing the otp in the database')
+            return self.fallback.issue(purpose, email)
+        return code
+
+    def verify(self, purpose, email, code):
+        try:
+            verified = self.verify_script(keys=self.keys(purpose, email), args=[code, settings.OTP_MAX_ATTEMPTS])
+        except (ConnectionError, TimeoutError):
+            return self.fallback.verify(purpose, email, code)
+        if verified == -1:
+            # no code in redis: it may have been issued to the database during an outage
+            return self.fallback.verify(purpose, email, code)
+        return verified == 1
+
+    def send_retry_after(self, email):
+        now = int(time.time() * 1000)
+        try:
+            wait = self.send_limit_script(
+                keys=[f'otp:sends:{email_key(email)}'],
+                args=[now, settings.OTP_SEND_WINDOW * 1000, settings.OTP_SEND_LIMIT, f'{now}-{secrets.token_hex(4)}'],
+            )
+        except (ConnectionError, TimeoutError):
+            return self.fallback.send_retry_after(email)
+        return wait / 1000
+
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        backend = settings.OTP_STORE
+        if not backend:
+            backend = 'redis' if settings.CACHES['default']['BACKEND'].startswith('django_redis') else 'db'
+        _store = RedisOTPStore() if backend == 'redis' else DatabaseOTPStore()
+    return _store
+
+
+def issue(purpose, email):
+    return get_store().issue(purpose, email)
+
+
+def verify(purpose, email, code):
+    return get_store().verify(purpose, email, code)
+
+
+def send_retry_after(email):
+    return get_store().send_retry_after(email)
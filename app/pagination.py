@@ -1,15 +1,123 @@
-from rest_framework.pagination import PageNumberPagination
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, FieldDoesNotExist
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models.functions import Coalesce
+from django.utils.functional import cached_property
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import PageNumberPagination, CursorPagination
+
+
+def estimated_count(queryset):
+    # postgres planner estimate, only for unfiltered tables big enough that COUNT(*) hurts
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql' or queryset.query.where:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [queryset.model._meta.db_table])
+        row = cursor.fetchone()
+    if row is None or row[0] < settings.PAGINATION_ESTIMATE_THRESHOLD:
+        return None
+    return int(row[0])
+
+
+def cached_count(queryset):
+    if not settings.PAGINATION_COUNT_CACHE_TTL:
+        return estimated_count(queryset) or queryset.count()
+
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:  # .none() or an empty __in, nothing to count
+        return 0
+    key = 'pagination-count:' + hashlib.md5(f'{sql}{params}'.encode()).hexdigest()
+    count = cache.get(key)
+    if count is None:
+        count = estimated_count(queryset)
+        if count is None:
+            count = queryset.count()
+        cache.set(key, count, settings.PAGINATION_COUNT_CACHE_TTL)
+    return count
+
+
+class CachedCountPaginator(Paginator):
+
+    @cached_property
+    def count(self):
+        if hasattr(self.object_list, 'query'):
+            return cached_count(self.object_list)
+        return super().count
+
+
+class KeysetPagination(CursorPagination):
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
+    count_query_param = 'include_count'
+
+    def get_ordering(self, request, queryset, view):
+        # key on the queryset's own ordering, with the pk as tie breaker
+        ordering = tuple(queryset.query.order_by)
+        if not ordering:
+            return super().get_ordering(request, queryset, view)
+        if not all(isinstance(field, str) for field in ordering) or not self.is_cursor_key(queryset, ordering[0]):
+            raise ValidationError({'pagination': 'cursor pages are not available for this ordering, use page numbers'})
+        if not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+            ordering += ('-id' if ordering[0].startswith('-') else 'id',)
+        return ordering
+
+    @staticmethod
+    def is_cursor_key(queryset, field):
+        # the cursor only remembers the first ordering value, a NULL there breaks the page boundaries
+        name = field.lstrip('-')
+        if name in ('id', 'pk'):
+            return True
+        annotation = queryset.query.annotations.get(name)
+        if annotation is not None:
+            return isinstance(annotation, Coalesce)
+        try:
+            model_field = queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return False
+        return model_field.concrete and not model_field.null
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if request.query_params.get(self.count_query_param) in ('1', 'true'):
+            self.count = cached_count(queryset)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.count is not None:
+            response.data['count'] = self.count
+        return response
+
 
 class CustomPagination(PageNumberPagination):
     page_size = 10  
     page_size_query_param = 'page_size'  
     max_page_size = 100  
     page_query_param = 'page'
+    django_paginator_class = CachedCountPaginator
+    mode_query_param = 'pagination'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # ?pagination=cursor switches to keyset pages, next/previous links keep the cursor
+        self.keyset = None
+        if request.query_params.get(self.mode_query_param) == 'cursor' or KeysetPagination.cursor_query_param in request.query_params:
+            self.keyset = KeysetPagination()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
 
     def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
         response = super().get_paginated_response(data)
         response.data['page'] = self.page.number
         response.data['count'] = self.page.paginator.count
         response.data['next'] = self.get_next_link()
         response.data['previous'] = self.get_previous_link()
-        return response
\ No newline at end of file
+        return response
@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import namedtuple
+from decimal import Decimal
+from types import MappingProxyType
+from django.conf import settings
+from django.core.cache import cache
+from app import models, choices
+
+
+PRICING_VERSION_KEY = 'pricing:version'
+DEFAULT_SHIPPING_FEE = Decimal('10.00')
+
+PriceRule = namedtuple('PriceRule', ['unit_price', 'print_method'])
+Quote = namedtuple('Quote', ['unit_price', 'quantity', 'subtotal', 'discount', 'shipping_fee', 'total'])
+
+
+class PricingError(ValueError):
+    pass
+
+
+class PriceTable:
+    '''
+    Immutable snapshot of every PricingRules row, keyed by (apparel id, design type).
+    Built with a single query and shared by every quote in the process.
+    '''
+
+    def __init__(self, version, rules):
+        self.version = version
+        self.rules = MappingProxyType(rules)
+        self.checked_at = time.monotonic()
+
+    @classmethod
+    def load(cls, version):
+        rows = models.ApparelProduct.objects.filter(product__isnull=False).values_list(
+            'id',
+            'product__base_price',
+            'product__print_cost',
+            'product__ai_design_cost',
+            'product__custom_design_upload_cost',
+            'product__printing_method',
+        )
+        rules = {}
+        for apparel_id, base_price, print_cost, ai_cost, upload_cost, print_method in rows:
+            base = (base_price or 0) + print_cost
+            rules[(apparel_id, choices.UserDesignType.AI_GENERATED)] = PriceRule(base + ai_cost, print_method)
+            rules[(apparel_id, choices.UserDesignType.CUSTOM_DESIGN)] = PriceRule(base + upload_cost, print_method)
+        return cls(version, rules)
+
+    def rule(self, apparel_id, design_type):
+        if design_type != choices.UserDesignType.AI_GENERATED:
+            design_type = choices.UserDesignType.CUSTOM_DESIGN
+        try:
+            return self.rules[(apparel_id, design_type)]
+        except KeyError:
+            raise PricingError(f'PricingRule not found for apparel ID {apparel_id}')
+
+    def quote(self, apparel_id, design_type, quantity=1, discount=0, shipping_fee=DEFAULT_SHIPPING_FEE):
+        unit_price = self.rule(apparel_id, design_type).unit_price
+        subtotal = unit_price * quantity
+        total = subtotal - discount + shipping_fee
+        return Quote(unit_price, quantity, subtotal, discount, shipping_fee, total)
+
+
+_table = None
+_lock = threading.Lock()
+
+
+def get_pricing_version():
+    version = cache.get(PRICING_VERSION_KEY)
+    if version is None:
+        cache.add(PRICING_VERSION_KEY, 1, None)
+        version = cache.get(PRICING_VERSION_KEY, 1)
+    return version
+
+
+def get_price_table(reload=False):
+    global _table
+    table = _table
+    if not reload and table is not None and time.monotonic() - table.checked_at < settings.PRICING_TABLE_CHECK_INTERVAL:
+        return table
+
+    # other processes signal rule changes through the shared version counter
+    version = get_pricing_version()
+    with _lock:
+        if reload or _table is None or _table.version != version:
+            _table = PriceTable.load(version)
+        else:
+            _table.checked_at = time.monotonic()
+        return _table
+
+
+def invalidate_price_table():
+    global _table
+    with _lock:
+        _table = None
+    try:
+        cache.incr(PRICING_VERSION_KEY)
+    except ValueError:
+        cache.set(PRICING_VERSION_KEY, 2, None)
+
+
+def quote(apparel_id, design_type, quantity=1, discount=0, shipping_fee=DEFAULT_SHIPPING_FEE):
+    return quote_many([{
+        'apparel_id': apparel_id,
+        'design_type': design_type,
+        'quantity': quantity,
+        'discount': discount,
+        'shipping_fee': shipping_fee,
+    }])[0]
+
+
+def quote_many(lines):
+    # lines: list of dicts with the quote() keyword arguments, all priced against one table
+    table = get_price_table()
+    try:
+        return [table.quote(**line) for line in lines]
+    except PricingError:
+        # the apparel may be newer than our snapshot, retry once on a fresh table
+        table = get_price_table(reload=True)
+        return [table.quote(**line) for line in lines]
@@ -0,0 +1,114 @@
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from app import models
+
+
+# user fields that end up in the snapshot, saves touching only other fields (last_login, otp, ...) keep it
+PROFILE_FIELDS = {
+    'role', 'profile_picture', 'first_name', 'last_name', 'phone_number', 'email', 'consent', 'is_active',
+    'order_confirmation_email', 'payment_success_notification', 'shipping_delivery_updates',
+    'AI_design_approvals_alerts', 'account_activity_alerts',
+}
+
+EMPTY_SHIPPING_ADDRESS = {
+    'full_name': '',
+    'phone_number': '',
+    'email': '',
+    'street_address': '',
+    'city': '',
+    'postal_code': '',
+    'province_state': '',
+    'country': '',
+}
+
+
+def version_key(user_id):
+    return f'profile:{user_id}:version'
+
+
+def get_profile_version(user_id):
+    version = cache.get(version_key(user_id))
+    if version is None:
+        # never reuse a number, an evicted counter must not resurrect an old snapshot
+        cache.add(version_key(user_id), time.time_ns(), None)
+        version = cache.get(version_key(user_id))
+    return version
+
+
+def bump_profile_version(user_id):
+    try:
+        cache.incr(version_key(user_id))
+    except ValueError:
+        cache.set(version_key(user_id), time.time_ns(), None)
+
+
+def invalidate_profile(user_id):
+    # now, so the rest of this transaction reads fresh data, and again after commit,
+    # in case another request cached the old rows in between
+    bump_profile_version(user_id)
+    transaction.on_commit(lambda: bump_profile_version(user_id))
+
+
+def invalidate_profiles(user_ids):
+    # bulk version for queryset .update() calls: dropped counters restart at a fresh value
+    keys = [version_key(user_id) for user_id in user_ids]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def build_profile(user):
+    shipping = getattr(user, 'shipping_address', None)
+    return {
+        'id': user.id,
+        'role': user.role,
+        'profile_picture': user.profile_picture.url if user.profile_picture else '',
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+        'phone_number': user.phone_number,
+        'email': user.email,
+        'consent': user.consent,
+        'is_active': user.is_active,
+        'shipping_address': {
+            'full_name': shipping.full_name,
+            'phone_number': shipping.phone_number,
+            'email': shipping.email,
+            'street_address': shipping.street_address,
+            'city': shipping.city,
+            'postal_code': shipping.postal_code,
+            'province_state': shipping.province_state,
+            'country': shipping.country,
+        } if shipping else None,
+        'notifications': {
+            'order_confirmation_email': user.order_confirmation_email,
+            'payment_success_notification': user.payment_success_notification,
+            'shipping_delivery_updates': user.shipping_delivery_updates,
+            'AI_design_approvals_alerts': user.AI_design_approvals_alerts,
+            'account_activity_alerts': user.account_activity_alerts,
+        },
+    }
+
+
+def get_profile(user_id):
+    key = f'profile:{user_id}:{get_profile_version(user_id)}'
+    profile = cache.get(key)
+    if profile is None:
+        user = models.User.objects.select_related('shipping_address').get(id=user_id)
+        profile = build_profile(user)
+        cache.set(key, profile, settings.PROFILE_CACHE_TTL)
+    return profile
+
+
+aget_profile = sync_to_async(get_profile)
+
+
+def profile_payload(request, profile):
+    # the login/profile response shape, built from a cached snapshot
+    picture = profile['profile_picture']
+    return {
+        **profile,
+        'profile_picture': request.build_absolute_uri(picture) if picture else '',
+        'shipping_address': profile['shipping_address'] or EMPTY_SHIPPING_ADDRESS,
+    }
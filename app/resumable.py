@@ -0,0 +1,181 @@
+import hashlib
+import logging
+import os
+import shutil
+from datetime import timedelta
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+from app import models, choices, uploads
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 64 * 1024
+
+
+class UploadError(ValueError):
+    pass
+
+
+class UploadConflict(Exception):
+    # the client's offset is not the confirmed one, it has to resume from `offset`
+
+    def __init__(self, offset):
+        super().__init__(f'resume from offset {offset}')
+        self.offset = offset
+
+
+class PartialFile(File):
+    # storages move files that have a path on disk (FileSystemStorage._save) instead of copying them
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def partial_path(upload):
+    return os.path.join(settings.RESUMABLE_UPLOAD_DIR, f'{upload.id}.part')
+
+
+def start(user, design, field, filename, size, checksum):
+    os.makedirs(settings.RESUMABLE_UPLOAD_DIR, exist_ok=True)
+    upload = models.DesignUpload.objects.create(
+        user=user, design=design, field=field, filename=filename, size=size, checksum=checksum,
+    )
+    open(partial_path(upload), 'wb').close()
+    return upload
+
+
+def discard(upload):
+    try:
+        os.remove(partial_path(upload))
+    except FileNotFoundError:
+        pass
+    upload.delete()
+
+
+def write_chunk(upload, offset, stream, length, checksum=None):
+    '''
+    Writes `length` bytes from `stream` at `offset` and confirms them. Bytes are
+    only confirmed once the whole chunk arrived (and matched its sha256, when the
+    client sent one); a dropped connection leaves the offset where it was.
+    '''
+    if upload.status != choices.DesignUploadStatus.PENDING:
+        raise UploadError('upload is already complete')
+    if offset != upload.offset:
+        raise UploadConflict(upload.offset)
+    if not 0 < length <= settings.RESUMABLE_UPLOAD_MAX_CHUNK:
+        raise UploadError(f'send chunks of 1 to {settings.RESUMABLE_UPLOAD_MAX_CHUNK} bytes')
+    if offset + length > upload.size:
+        raise UploadError(f'chunk runs past the declared size of {upload.size} bytes')
+
+    digest = hashlib.sha256()
+    remaining = length
+    with open(partial_path(upload), 'r+b') as partial:
+        partial.seek(offset)
+        while remaining:
+            data = stream.read(min(READ_SIZE, remaining))
+            if not data:
+                break
+            partial.write(data)
+            digest.update(data)
+            remaining -= len(data)
+    if remaining:
+        raise UploadError('chunk ended before its Content-Length')
+    if checksum and digest.hexdigest() != checksum.lower():
+        raise UploadError('chunk checksum does not match, send it again')
+
+    # two PUTs for the same offset (a retry racing the original): one of them confirms
+    confirmed = models.DesignUpload.objects.filter(
+        id=upload.id, offset=offset, status=choices.DesignUploadStatus.PENDING
+    ).update(offset=offset + length, updated_at=timezone.now())
+    if not confirmed:
+        upload.refresh_from_db(fields=['offset'])
+        raise UploadConflict(upload.offset)
+    upload.offset = offset + length
+
+    # reject oversized or non-image artwork from its header, not after the last chunk
+    if offset < uploads.PROBE_LIMIT:
+        try:
+            uploads.probe_header(partial_path(upload))
+        except uploads.UploadRejected:
+            discard(upload)
+            raise
+    return upload.offset
+
+
+def stage(path):
+    # storage moves the file it is given: hand it a hard link, so the partial file
+    # survives until the design is saved and a failed complete can be retried
+    staged = f'{path}.staged'
+    if os.path.exists(staged):
+        os.remove(staged)
+    try:
+        os.link(path, staged)
+    except OSError:
+        shutil.copyfile(path, staged)  # no hard links across filesystems
+    return staged
+
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as partial:
+        for data in iter(lambda: partial.read(READ_SIZE), b''):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def complete(upload):
+    if upload.status != choices.DesignUploadStatus.PENDING:
+        raise UploadError('upload is already complete')
+    if upload.offset != upload.size:
+        raise UploadError(f'{upload.offset} of {upload.size} bytes received, resume from offset {upload.offset}')
+
+    path = partial_path(upload)
+    if not os.path.exists(path):
+        discard(upload)
+        raise UploadError('the received bytes are gone, start a new upload')
+    digest = file_checksum(path)
+    if digest != upload.checksum:
+        discard(upload)
+        raise UploadError('file checksum does not match, start a new upload')
+
+    staged = stage(path)
+    try:
+        with open(staged, 'rb') as partial:
+            artwork = PartialFile(partial, name=upload.filename)
+            artwork.content_hash = digest
+            try:
+                uploads.probe_image(artwork)
+            except uploads.UploadRejected:
+                discard(upload)
+                raise
+
+            with transaction.atomic():
+                design = models.UserDesign.objects.select_for_update().get(id=upload.design_id)
+                if not design.is_draft:
+                    raise UploadError('the design has been ordered, its images can no longer change')
+                # the staged link is moved into media storage, not copied
+                getattr(design, upload.field).save(upload.filename, artwork, save=False)
+                design.save(update_fields=[upload.field])
+                models.DesignUpload.objects.filter(id=upload.id).update(
+                    status=choices.DesignUploadStatus.COMPLETE, updated_at=timezone.now()
+                )
+                transaction.on_commit(lambda: os.remove(path) if os.path.exists(path) else None)
+    finally:
+        if os.path.exists(staged):
+            os.remove(staged)  # identical artwork was stored already, nothing was moved
+    upload.status = choices.DesignUploadStatus.COMPLETE
+    return design
+
+
+def expire_uploads():
+    stale = models.DesignUpload.objects.filter(
+        updated_at__lt=timezone.now() - timedelta(seconds=settings.RESUMABLE_UPLOAD_TTL)
+    )
+    expired = 0
+    for upload in stale.only('id', 'status'):
+        discard(upload)
+        expired += 1
+    logger.info('expired %s design uploads', expired)
+    return expired
@@ -0,0 +1,95 @@
+from datetime import datetime, time, timedelta
+from django.db import transaction, IntegrityError
+from django.db.models import Count, Sum, F, Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from app import models, choices
+
+
+ORDER_STAT_FIELDS = ['revenue', 'order_count', 'active_count', 'cancelled_count', 'completed_amount']
+
+
+def add_to_day(day, **changes):
+    updated = models.DailyOrderStats.objects.filter(day=day).update(
+        **{field: F(field) + value for field, value in changes.items()}
+    )
+    if not updated:
+        try:
+            with transaction.atomic():
+                models.DailyOrderStats.objects.create(day=day, **changes)
+        except IntegrityError:
+            # the row was created by a concurrent request in the meantime
+            add_to_day(day, **changes)
+
+
+def apply_order_change(old, new):
+    # old/new are Order.stats_contribution() values, None when the order did not / no longer exists
+    apply_order_changes([(old, new)])
+
+
+def apply_order_changes(changes):
+    # one F() update per touched day, however many orders changed
+    days = {}
+    for old, new in changes:
+        for contribution, sign in ((old, -1), (new, 1)):
+            if contribution:
+                totals = days.setdefault(contribution['day'], dict.fromkeys(ORDER_STAT_FIELDS, 0))
+                for field in ORDER_STAT_FIELDS:
+                    totals[field] += sign * contribution[field]
+
+    for day, totals in days.items():
+        totals = {field: value for field, value in totals.items() if value}
+        if totals:
+            add_to_day(day, **totals)
+
+
+def day_start(day):
+    # local midnight. filtering on created_at__date casts every row and skips the created_at indexes,
+    # plain >= / < bounds can range scan them
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def created_on(days):
+    condition = Q(pk__in=[])
+    for day in days:
+        condition |= Q(created_at__gte=day_start(day), created_at__lt=day_start(day + timedelta(days=1)))
+    return condition
+
+
+def rebuild_daily_stats(since=None, days=None):
+    orders = models.Order.objects.all()
+    users = models.User.objects.all()
+    stats = models.DailyOrderStats.objects.all()
+    if since is not None:
+        orders = orders.filter(created_at__gte=day_start(since))
+        users = users.filter(created_at__gte=day_start(since))
+        stats = stats.filter(day__gte=since)
+    if days is not None:
+        orders = orders.filter(created_on(days))
+        users = users.filter(created_on(days))
+        stats = stats.filter(day__in=days)
+
+    order_rows = orders.annotate(day=TruncDate('created_at')).values('day').annotate(
+        revenue=Sum(F('total_amount') * F('quantity')),
+        order_count=Count('id'),
+        active_count=Count('id', filter=Q(is_active=True)),
+        cancelled_count=Count('id', filter=Q(order_status=choices.OrderStatus.CANCELLED)),
+        completed_amount=Sum('total_amount', filter=Q(order_status=choices.OrderStatus.COMPLETED)),
+    ).order_by()
+    user_rows = users.annotate(day=TruncDate('created_at')).values('day').annotate(
+        new_customers=Count('id')
+    ).order_by()
+
+    rows = {}
+    for row in order_rows:
+        rows[row['day']] = models.DailyOrderStats(
+            day=row['day'],
+            **{field: row[field] or 0 for field in ORDER_STAT_FIELDS}
+        )
+    for row in user_rows:
+        rows.setdefault(row['day'], models.DailyOrderStats(day=row['day'])).new_customers = row['new_customers']
+
+    with transaction.atomic():
+        stats.delete()
+        models.DailyOrderStats.objects.bulk_create(rows.values(), batch_size=1000)
+    return len(rows)
@@ -1,7 +1,11 @@
-from rest_framework import serializers
+from rest_framework import serializers, exceptions
 from rest_framework.validators import ValidationError
-from app import models
+from app import models, choices, pricing, rollups, profiles, order_states, otp, images, uploads, resumable
+from app.dashboard import invalidate_dashboard_metrics
 from app.tasks import send_welcome_otp
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
 from django.contrib.auth import get_user_model
 from datetime import timedelta
 from django.utils import timezone
@@ -9,6 +13,32 @@ from django.utils import timezone
 
 User = get_user_model()
 
+class ImageRenditionsField(serializers.ReadOnlyField):
+    # thumbnail/preview urls (jpeg or png, plus webp) of one image field, None until the task rendered them
+
+    def __init__(self, image_field, **kwargs):
+        self.image_field = image_field
+        super().__init__(**kwargs)
+
+    def to_representation(self, renditions):
+        return images.rendition_urls(renditions, self.image_field, self.context.get('request'))
+
+
+
+class DesignImageField(serializers.FileField):
+    # header-only check, DRF's ImageField runs a full Pillow verify on every upload
+
+    def to_internal_value(self, data):
+        file = super().to_internal_value(data)
+        if not hasattr(file, 'image_size'):  # already probed by uploads.DesignUploadHandler
+            try:
+                file.image_format, file.image_size = uploads.probe_image(file)
+            except uploads.UploadRejected as exc:
+                raise ValidationError(str(exc))
+        return file
+
+
+
 class LoginSerializer(serializers.Serializer):
     email = serializers.EmailField()
     password = serializers.CharField(write_only=True)
@@ -52,7 +82,7 @@ class UserSerializer(serializers.ModelSerializer):
             user.is_active = True
             user.save()
         else:
-            send_welcome_otp.delay(user.id)
+            send_welcome_otp.delay(user.email, user.username)
         return user
     
 
@@ -62,23 +92,33 @@ class ResendOTPSerializer(serializers.Serializer):
 
     def save(self, **kwargs):
         email = self.validated_data['email']
-        try:
-            user = User.objects.get(email=email)
-            user.otp = ''
-            user.otp_expiry = None
-            send_welcome_otp.delay(user.id)
-        except User.DoesNotExist:
+        user = User.objects.filter(email=email).only('email', 'username').first()
+        if user is None:
             raise ValidationError(
                 {'email': 'user with this email does not exist'},
                 code='user_not_found'
                 )
+        retry_after = otp.send_retry_after(email)
+        if retry_after:
+            raise exceptions.Throttled(wait=retry_after)
+        send_welcome_otp.delay(user.email, user.username)
     
 
 
-class VerifyOTPSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = User
-        fields = ['email', 'otp']
+class VerifyOTPSerializer(serializers.Serializer):
+    email = serializers.EmailField()
+    otp = serializers.CharField(max_length=6)
+
+    def save(self, **kwargs):
+        # compare-and-delete in the otp store: a code activates at most one request
+        email = self.validated_data['email']
+        if not otp.verify(otp.WELCOME, email, self.validated_data['otp']):
+            return None
+        user = User.objects.filter(email=email).first()
+        if user is not None and not user.is_active:
+            user.is_active = True
+            user.save(update_fields=['is_active'])
+        return user
 
 
 
@@ -158,21 +198,7 @@ class PatchUserProfileSerializer(serializers.ModelSerializer):
 
 
     def get_shipping_address(self, instance):
-
-        default = models.ShippingAddress.objects.filter(user=self.context['request'].user).first() 
-        
-        if default:
-            return {
-                'full_name': default.full_name,
-                'phone_number': default.phone_number,
-                'email': default.email,
-                'street_address': default.street_address,
-                'city': default.city,
-                'postal_code': default.postal_code,
-                'province_state': default.province_state,
-                'country': default.country
-            }
-        return None
+        return profiles.get_profile(self.context['request'].user.id)['shipping_address']
     
 
     # def get_billing_address(self, instance):
@@ -268,6 +294,7 @@ class ApparelProductSerializer(serializers.ModelSerializer):
     product_name = serializers.CharField(source='product.product_name', read_only=True)
     base_price = serializers.DecimalField(source='product.base_price', max_digits=6, decimal_places=2, read_only=True)
     print_methods = serializers.CharField(source='product.printing_method', read_only=True)
+    upload_image_renditions = ImageRenditionsField('upload_image', source='renditions')
     
     class Meta:
         model = models.ApparelProduct
@@ -278,6 +305,7 @@ class ApparelProductSerializer(serializers.ModelSerializer):
             'product_name',
             'description',
             'upload_image',
+            'upload_image_renditions',
             'sizes_available',
             'color_options',
             'print_methods',
@@ -328,6 +356,10 @@ class SizeSerializer(serializers.ModelSerializer):
 class UserDesignSerializer(serializers.ModelSerializer):
 
     order_quantity = serializers.IntegerField(write_only=True, required = False)
+    image_front = DesignImageField(required=False, allow_null=True)
+    image_back = DesignImageField(required=False, allow_null=True)
+    image_front_renditions = ImageRenditionsField('image_front', source='renditions')
+    image_back_renditions = ImageRenditionsField('image_back', source='renditions')
 
     class Meta:
         model = models.UserDesign
@@ -339,6 +371,8 @@ class UserDesignSerializer(serializers.ModelSerializer):
             'prompt',
             'image_front',
             'image_back',
+            'image_front_renditions',
+            'image_back_renditions',
             'font',
             'style',
             'shirt_size',
@@ -406,11 +440,150 @@ class UserDesignSerializer(serializers.ModelSerializer):
         return design
 
 
+class DesignUploadSerializer(serializers.ModelSerializer):
+    checksum = serializers.RegexField(r'^[0-9a-fA-F]{64}$', write_only=True, help_text='sha256 of the whole file, hex')
+
+    class Meta:
+        model = models.DesignUpload
+        fields = [
+            'id',
+            'design',
+            'field',
+            'filename',
+            'size',
+            'checksum',
+            'offset',
+            'status',
+            'created_at',
+        ]
+        read_only_fields = ['offset', 'status', 'created_at']
+
+    def validate_design(self, design):
+        if design.user_id != self.context['request'].user.id or not design.is_draft:
+            raise ValidationError('upload to one of your draft designs')
+        return design
+
+    def validate_size(self, size):
+        if not 0 < size <= settings.DESIGN_UPLOAD_MAX_BYTES:
+            raise ValidationError(f'files up to {settings.DESIGN_UPLOAD_MAX_BYTES} bytes')
+        return size
+
+    def create(self, validated_data):
+        validated_data['checksum'] = validated_data['checksum'].lower()
+        return resumable.start(self.context['request'].user, **validated_data)
+
+
+
 class OrderFromDraftSerializer(serializers.Serializer):
     user_design_id = serializers.IntegerField()
     quantity = serializers.IntegerField(min_value=1)
 
 
+class BulkOrderLineSerializer(serializers.Serializer):
+    user_design = serializers.IntegerField()
+    size = serializers.IntegerField()
+    color = serializers.CharField(max_length=models.Order._meta.get_field('color').max_length)
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class BulkOrderSerializer(serializers.Serializer):
+    lines = BulkOrderLineSerializer(many=True, allow_empty=False, max_length=settings.BULK_ORDER_MAX_LINES)
+
+    def validate(self, attrs):
+        user = self.context['request'].user
+        lines = attrs['lines']
+
+        if not hasattr(user, 'shipping_address'):
+            raise ValidationError({'detail': 'Shipping address not found for this user.'})
+
+        # one query for the designs, one for every (apparel, size) pair they allow
+        designs = models.UserDesign.objects.filter(
+            user=user, id__in={line['user_design'] for line in lines}
+        ).in_bulk()
+        allowed_sizes = set(
+            models.ApparelProduct.sizes_available.through.objects.filter(
+                apparelproduct_id__in={design.apparel_id for design in designs.values()}
+            ).values_list('apparelproduct_id', 'size_id')
+        )
+
+        errors = []
+        for line in lines:
+            design = designs.get(line['user_design'])
+            if design is None:
+                errors.append({'user_design': 'design not found'})
+            elif (design.apparel_id, line['size']) not in allowed_sizes:
+                errors.append({'size': 'no such size found for this apparel'})
+            else:
+                errors.append({})
+                line['design'] = design
+        if any(errors):
+            raise ValidationError({'lines': errors})
+
+        attrs['shipping_address'] = user.shipping_address
+        return attrs
+
+    def create(self, validated_data):
+        user = self.context['request'].user
+        lines = validated_data['lines']
+
+        quotes = pricing.quote_many([
+            {
+                'apparel_id': line['design'].apparel_id,
+                'design_type': line['design'].design_type,
+                'quantity': line['quantity'],
+            }
+            for line in lines
+        ])
+
+        with transaction.atomic():
+            # lines in another size/colour than the saved design get their own copy of it
+            copies = {}
+            for line in lines:
+                design = line['design']
+                key = (design.id, line['size'], line['color'])
+                if (design.shirt_size_id, design.color) != key[1:] and key not in copies:
+                    copies[key] = models.UserDesign(
+                        user=user,
+                        apparel_id=design.apparel_id,
+                        design_type=design.design_type,
+                        prompt=design.prompt,
+                        image_front=design.image_front.name,
+                        image_back=design.image_back.name,
+                        renditions=design.renditions,  # same files, bulk_create skips the rendition signal
+                        font=design.font,
+                        style=design.style,
+                        shirt_size_id=line['size'],
+                        color=line['color'],
+                        is_draft=False,
+                    )
+            models.UserDesign.objects.bulk_create(copies.values())
+
+            order_ids = models.IdSequence.next_codes(models.Order, 'order_id', 'A', count=len(lines))
+            orders = []
+            for line, quote, order_id in zip(lines, quotes, order_ids):
+                design = copies.get((line['design'].id, line['size'], line['color']), line['design'])
+                orders.append(models.Order(
+                    user=user,
+                    user_design=design,
+                    shipping_address=validated_data['shipping_address'],
+                    order_id=order_id,
+                    design_type=design.design_type,
+                    apparel_id=design.apparel_id,
+                    color=line['color'],
+                    print_method=design.style,
+                    quantity=line['quantity'],
+                    subtotal=quote.subtotal,
+                    shipping_fee=quote.shipping_fee,
+                    total_amount=quote.total,
+                ))
+            models.Order.objects.bulk_create(orders, batch_size=1000)
+
+            # bulk_create skips the post_save handlers
+            rollups.apply_order_changes([(None, order.stats_contribution()) for order in orders])
+            transaction.on_commit(invalidate_dashboard_metrics)
+        return orders
+
+
 class ShippingAddressSerializer(serializers.ModelSerializer):
 
     class Meta:
@@ -507,6 +680,8 @@ class ViewUserOrderDetailsSerializer(serializers.ModelSerializer):
     size = serializers.CharField(source = 'user_design.shirt_size' , read_only = True)
     image_front = serializers.ImageField(source = 'user_design.image_front', read_only=True)
     image_back = serializers.ImageField(source = 'user_design.image_back', read_only=True)
+    image_front_renditions = ImageRenditionsField('image_front', source='user_design.renditions')
+    image_back_renditions = ImageRenditionsField('image_back', source='user_design.renditions')
     per_unit_price = serializers.CharField(source = 'apparel.product.base_price', read_only=True)
     apparel_name = serializers.CharField(source = 'apparel.product.product_name', read_only=True)
 
@@ -526,6 +701,8 @@ class ViewUserOrderDetailsSerializer(serializers.ModelSerializer):
             'order_status',
             'image_front',
             'image_back',
+            'image_front_renditions',
+            'image_back_renditions',
             'apparel_name',
             'color',
             'size',
@@ -556,14 +733,16 @@ class ViewUserOrderDetailsSerializer(serializers.ModelSerializer):
 
 class UserOrderSerializer(serializers.ModelSerializer):
     profile_picture = serializers.CharField(source = 'user.profile_picture' ,read_only = True)
+    profile_picture_renditions = ImageRenditionsField('profile_picture', source='user.renditions')
     full_name = serializers.CharField(source = 'user.get_full_name', read_only=True)
-    apparel_name = serializers.CharField(source = 'apparel.product_name' , read_only = True)
+    apparel_name = serializers.CharField(source = 'apparel.product.product_name' , read_only = True)
 
     class Meta:
         model = models.Order
         fields = [
             'id',
             'profile_picture',
+            'profile_picture_renditions',
             'full_name',
             'design_type',
             'apparel_name',
@@ -578,6 +757,7 @@ class UserOrderSerializer(serializers.ModelSerializer):
 class ListOrderSerializer(serializers.ModelSerializer):
     apparel_name = serializers.CharField(source = 'apparel.product.product_name' , read_only = True)
     print_method = serializers.CharField(source='apparel.product.printing_method', read_only=True)
+    thumbnail = ImageRenditionsField('image_front', source='user_design.renditions')
 
     
     class Meta:
@@ -592,11 +772,66 @@ class ListOrderSerializer(serializers.ModelSerializer):
             'quantity',
             'created_at',
             'payment',
-            'order_status'
+            'order_status',
+            'thumbnail',
             ]
 
 
     
+class OrderTransitionSerializer(serializers.Serializer):
+    field = serializers.ChoiceField(choices=list(order_states.TRANSITIONS))
+    status = serializers.CharField()
+
+    def validate(self, attrs):
+        if attrs['status'] not in order_states.TRANSITIONS[attrs['field']]:
+            raise ValidationError({'status': f"{attrs['field']} cannot be set to {attrs['status']}"})
+        return attrs
+
+
+class BulkOrderTransitionFilterSerializer(serializers.Serializer):
+    order_status = serializers.ChoiceField(choices=choices.OrderStatus.choices, required=False)
+    order_tracking_status = serializers.ChoiceField(choices=choices.OrderTrackingStatus.choices, required=False)
+    payment = serializers.ChoiceField(choices=choices.PaymentStatus.choices, required=False)
+    user = serializers.IntegerField(required=False)
+    created_from = serializers.DateField(required=False)
+    created_to = serializers.DateField(required=False)
+
+    def to_lookups(self, filters):
+        lookups = {}
+        for field in ['order_status', 'order_tracking_status', 'payment']:
+            if field in filters:
+                lookups[field] = filters[field]
+        if 'user' in filters:
+            lookups['user_id'] = filters['user']
+        if 'created_from' in filters:
+            lookups['created_at__gte'] = rollups.day_start(filters['created_from'])
+        if 'created_to' in filters:
+            lookups['created_at__lt'] = rollups.day_start(filters['created_to'] + timedelta(days=1))
+        return lookups
+
+
+class BulkOrderTransitionSerializer(OrderTransitionSerializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(), required=False, allow_empty=False,
+        max_length=settings.BULK_ORDER_ACTION_MAX_IDS,
+    )
+    filters = BulkOrderTransitionFilterSerializer(required=False)
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        if not attrs.get('ids') and not attrs.get('filters'):
+            raise ValidationError({'detail': 'Send a list of order ids or at least one filter.'})
+        return attrs
+
+    def get_queryset(self):
+        queryset = models.Order.objects.all()
+        if self.validated_data.get('ids'):
+            queryset = queryset.filter(id__in=self.validated_data['ids'])
+        if self.validated_data.get('filters'):
+            queryset = queryset.filter(**self.fields['filters'].to_lookups(self.validated_data['filters']))
+        return queryset
+
+
 class TrackOrderSerializer(serializers.ModelSerializer):
     customer_name = serializers.CharField(source ='user.first_name' ,read_only = True)
     email = serializers.CharField(source = 'user.email' ,read_only = True)
@@ -609,6 +844,8 @@ class TrackOrderSerializer(serializers.ModelSerializer):
     size = serializers.CharField(source = 'user_design.shirt_size' , read_only = True)
     image_front = serializers.ImageField(source = 'user_design.image_front', read_only=True)
     image_back = serializers.ImageField(source = 'user_design.image_back', read_only=True)
+    image_front_renditions = ImageRenditionsField('image_front', source='user_design.renditions')
+    image_back_renditions = ImageRenditionsField('image_back', source='user_design.renditions')
 
     class Meta:
         model = models.Order
@@ -635,6 +872,8 @@ class TrackOrderSerializer(serializers.ModelSerializer):
             'total_amount',
             'image_front',
             'image_back',
+            'image_front_renditions',
+            'image_back_renditions',
             ]
         
     def to_representation(self, instance):
@@ -655,9 +894,19 @@ class TrackOrderSerializer(serializers.ModelSerializer):
         return data
  
 
+class BulkUserIdsSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(), allow_empty=False,
+        max_length=settings.BULK_USER_ACTION_MAX_IDS,
+    )
+
+
 class ListUserSerializer(serializers.ModelSerializer):
     design_type = serializers.CharField(source='product.design_type', read_only=True)
-    total_orders = serializers.SerializerMethodField()
+    # annotated by User.objects.with_order_stats()
+    total_orders = serializers.IntegerField(read_only=True)
+    total_spent = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    last_order_at = serializers.DateTimeField(read_only=True)
     full_name = serializers.ReadOnlyField(source="get_full_name")
     profile_picture = serializers.CharField(source = 'user.profile_picture' ,read_only = True)
     
@@ -672,11 +921,40 @@ class ListUserSerializer(serializers.ModelSerializer):
             'is_active',
             'last_login',
             'design_type',
-            'total_orders'
-
+            'total_orders',
+            'total_spent',
+            'last_order_at',
         ]
-    def get_total_orders(self , obj):
-        return obj.user_orders.count()
+
+
+class ListUserFilterSerializer(serializers.Serializer):
+    ORDERING = ['id', 'created_at', 'last_login', 'total_orders', 'total_spent', 'last_order_at']
+
+    ordering = serializers.ChoiceField(
+        choices=ORDERING + [f'-{field}' for field in ORDERING], required=False, default='id'
+    )
+    is_active = serializers.BooleanField(required=False, allow_null=True, default=None)
+    min_orders = serializers.IntegerField(required=False, min_value=0)
+    min_spent = serializers.DecimalField(required=False, max_digits=12, decimal_places=2)
+    # dormant users: no order in the last N days, including users who never ordered
+    dormant_days = serializers.IntegerField(required=False, min_value=1)
+
+    def filter_queryset(self, queryset):
+        params = self.validated_data
+        if params['is_active'] is not None:
+            queryset = queryset.filter(is_active=params['is_active'])
+        if 'min_orders' in params:
+            queryset = queryset.filter(total_orders__gte=params['min_orders'])
+        if 'min_spent' in params:
+            queryset = queryset.filter(total_spent__gte=params['min_spent'])
+        if 'dormant_days' in params:
+            cutoff = timezone.now() - timedelta(days=params['dormant_days'])
+            queryset = queryset.filter(Q(last_order_at__lt=cutoff) | Q(last_order_at__isnull=True))
+        ordering = params['ordering']
+        if ordering.lstrip('-') == 'id':
+            return queryset.order_by(ordering)
+        # id keeps pages stable between equal values
+        return queryset.order_by(ordering, 'id')
 
 class ViewUserSerializer(serializers.ModelSerializer):
 
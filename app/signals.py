@@ -1,23 +1,119 @@
 from django.contrib.auth.signals import user_logged_in, user_login_failed, user_logged_out
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.db import transaction
 from django.dispatch import receiver
-from .utils import send_login_email, login_failed_email, send_logout_email
-from .models import User, Order
+from django.utils import timezone
+from .auth import auth_events
+from .models import User, Order, ApparelProduct, PricingRules, Size, ShippingAddress, UserDesign
+from .dashboard import invalidate_dashboard_metrics
+from .rollups import apply_order_change, add_to_day
+from .catalog import bump_catalog_version
+from .pricing import invalidate_price_table
+from .profiles import invalidate_profile, PROFILE_FIELDS
+from .counters import adjust_user_counters, reset_user_counters
+from .images import schedule_renditions
 
 
+# auth events are buffered and handed to celery in batches, see auth.AuthEventBuffer
+
 @receiver(user_logged_in)
 def handle_user_logged_in(sender, request, user, **kwargs):
-    send_login_email.delay(user.email)
+    auth_events.publish(auth_events.LOGIN, user.email)
 
 
 @receiver(user_login_failed)
 def handle_user_login_failed(sender, credentials, **kwargs):
-    try:
-        user = User.objects.get(email=credentials.get('username'))
-        login_failed_email.delay(user)
-    except User.DoesNotExist:
-        pass 
+    auth_events.publish(auth_events.LOGIN_FAILED, credentials.get('username'))
 
 
 @receiver(user_logged_out)
 def handle_user_logged_out(sender, request, user, **kwargs):
-    send_logout_email.delay(user)
\ No newline at end of file
+    if user is not None:
+        auth_events.publish(auth_events.LOGOUT, user.email)
+
+
+@receiver(pre_save, sender=Order)
+@receiver(pre_delete, sender=Order)
+def load_order_stats(sender, instance, **kwargs):
+    # rows loaded with deferred stats fields have no snapshot, read it before the row changes
+    if not instance._state.adding and getattr(instance, '_loaded_stats', None) is None:
+        instance._loaded_stats = instance.stored_stats()
+
+
+@receiver(post_save, sender=Order)
+def handle_order_saved(sender, instance, **kwargs):
+    current = instance.stats_contribution()
+    apply_order_change(getattr(instance, '_loaded_stats', None), current)
+    instance._loaded_stats = current
+    invalidate_dashboard_metrics()
+
+
+@receiver(post_delete, sender=Order)
+def handle_order_deleted(sender, instance, **kwargs):
+    apply_order_change(getattr(instance, '_loaded_stats', None), None)  # set by load_order_stats
+    invalidate_dashboard_metrics()
+
+
+@receiver(post_save, sender=User)
+def handle_user_created(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        add_to_day(timezone.localdate(instance.created_at), new_customers=1)
+        adjust_user_counters(total=1, active=1 if instance.is_active else 0)
+        instance._loaded_is_active = instance.is_active
+    elif update_fields is None or 'is_active' in update_fields:
+        loaded = getattr(instance, '_loaded_is_active', None)
+        if loaded is None:
+            # is_active was never loaded, nothing to compare against
+            reset_user_counters()
+        elif loaded != instance.is_active:
+            adjust_user_counters(active=1 if instance.is_active else -1)
+        instance._loaded_is_active = instance.is_active
+
+
+@receiver(post_delete, sender=User)
+def handle_user_deleted(sender, instance, **kwargs):
+    add_to_day(timezone.localdate(instance.created_at), new_customers=-1)
+    loaded = getattr(instance, '_loaded_is_active', None)
+    if loaded is None:
+        reset_user_counters()
+    else:
+        adjust_user_counters(total=-1, active=-1 if loaded else 0)
+
+
+@receiver([post_save, post_delete], sender=ApparelProduct)
+@receiver([post_save, post_delete], sender=PricingRules)
+@receiver([post_save, post_delete], sender=Size)
+def handle_catalog_changed(sender, **kwargs):
+    bump_catalog_version()
+
+
+@receiver([post_save, post_delete], sender=ApparelProduct)
+@receiver([post_save, post_delete], sender=PricingRules)
+def handle_pricing_changed(sender, **kwargs):
+    transaction.on_commit(invalidate_price_table)
+
+
+@receiver(m2m_changed, sender=ApparelProduct.sizes_available.through)
+def handle_catalog_sizes_changed(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_catalog_version()
+
+
+@receiver([post_save, post_delete], sender=User)
+def handle_profile_changed(sender, instance, update_fields=None, **kwargs):
+    # login saves last_login only, that must not throw the snapshot away
+    if update_fields is None or PROFILE_FIELDS.intersection(update_fields):
+        invalidate_profile(instance.id)
+
+
+@receiver([post_save, post_delete], sender=ShippingAddress)
+def handle_shipping_address_changed(sender, instance, **kwargs):
+    invalidate_profile(instance.user_id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=ApparelProduct)
+@receiver(post_save, sender=UserDesign)
+def handle_images_saved(sender, instance, update_fields=None, **kwargs):
+    # thumbnails and webp copies are rendered by a celery task once the upload is committed
+    schedule_renditions(instance, update_fields)
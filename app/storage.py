@@ -0,0 +1,38 @@
+import hashlib
+import posixpath
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    '''
+    Media storage that names uploads after the sha256 of their content, inside the
+    field's upload_to directory. The same picture uploaded twice is stored once and
+    both rows point at the same file (and the same renditions, see images.py).
+    '''
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        directory, filename = posixpath.split(name.replace('\\', '/'))
+        # 128 bits of the hash are plenty and keep the name inside ImageField's 100 characters
+        digest = (getattr(content, 'content_hash', None) or content_hash(content))[:32]
+        name = posixpath.join(directory, digest[:2], digest + posixpath.splitext(filename)[1].lower())
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length)
+
+
+content_storage = ContentAddressedStorage()
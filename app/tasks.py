@@ -1,63 +1,78 @@
 from celery import shared_task
-from django.core.mail import send_mail
 from django.conf import settings
 # from django.utils import timezone
 # from datetime import timedelta
 # from rest_framework.response import Response
 
 from app.models import User
+from app import notifications, utils, webhooks, order_states, otp, images, resumable
+from app.auth import AuthEventBuffer
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
 
 @shared_task
-def send_welcome_otp(user_id):
-    try:
-        user = User.objects.get(id=user_id)
-    except Exception as e:
-        return "user not found"
-    
-    user.generate_otp()        
+def send_welcome_otp(email, name):
+    # the code goes to the otp store (redis), the users table is not touched
+    code = otp.issue(otp.WELCOME, email)
 
     subject = 'CAD - OTP REQUEST'
-    message = user.welcome_message.format(
-        name = user.username,
-        otp = user.otp
+    message = User.welcome_message.format(
+        name = name,
+        otp = code
     )
-    from_email = settings.EMAIL_HOST_USER
-    to_email = [user.email]
-    send_mail(
-        subject, 
-        message, 
-        from_email, 
-        to_email,
-        fail_silently=False
-        )
+    notifications.enqueue_email(email, subject, message)
 
 
 @shared_task
-def password_reset_otp(email):
-    try:
-        user = User.objects.get(email=email)
-    except Exception as e:
-        return "user not found with this email"
-
-    user.generate_otp()  
-
-    print(user.email, user.username, user.otp, user.otp_expiry)      
+def password_reset_otp(email, name):
+    code = otp.issue(otp.PASSWORD_RESET, email)
 
     subject = 'CAD - PASSWORD RESET REQUEST'
-    message = user.forget_password_message.format(
-        name = user.username,
-        otp = user.otp
+    message = User.forget_password_message.format(
+        name = name,
+        otp = code
     )
-    from_email = settings.EMAIL_HOST_USER
-    to_email = [user.email]
-    send_mail(
-        subject, 
-        message, 
-        from_email, 
-        to_email,
-        fail_silently=False
-        )
\ No newline at end of file
+    notifications.enqueue_email(email, subject, message)
+
+
+@shared_task
+def generate_image_renditions(model_label, pk):
+    images.generate_renditions(model_label, pk)
+
+
+@shared_task
+def expire_design_uploads():
+    return resumable.expire_uploads()
+
+
+@shared_task
+def drain_email_outbox():
+    return notifications.drain_outbox()
+
+
+@shared_task
+def process_stripe_events():
+    return webhooks.process_events()
+
+
+@shared_task
+def send_tracking_notifications(order_ids, status):
+    return order_states.send_tracking_notifications(order_ids, status)
+
+
+@shared_task
+def process_auth_events(events):
+    # events: [(kind, email), ...] batched by auth.AuthEventBuffer
+    failed = {email for kind, email in events if kind == AuthEventBuffer.LOGIN_FAILED}
+    known = set(User.objects.filter(email__in=failed).values_list('email', flat=True)) if failed else set()
+
+    for kind, email in events:
+        if kind == AuthEventBuffer.LOGIN:
+            utils.send_login_email(email)
+        elif kind == AuthEventBuffer.LOGOUT:
+            utils.send_logout_email(email)
+        elif kind == AuthEventBuffer.LOGIN_FAILED and email in known:
+            utils.login_failed_email(email)
+    return len(events)
@@ -1,3 +1,1399 @@
-from django.test import TestCase
+import copy
+import hashlib
+import hmac
+import json
+import io
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import skipUnless, mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, connection
+from django.db.models import F
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.request import Request
+from rest_framework.test import APIClient
+from PIL import Image
+
+from app.management.commands import benchmark_customer_detail, benchmark_uploads
+from app.pagination import CustomPagination, KeysetPagination, cached_count
+from app import models, serializers, dashboard, rollups, middleware, pricing, notifications, choices, utils, auth, webhooks, order_states, counters, otp, images, resumable, compositor, mockups
+
+
+def create_user(index, **kwargs):
+    return models.User.objects.create(
+        email=f'user{index}@example.com',
+        username=f'user{index}',
+        first_name='Test',
+        last_name=f'User {index}',
+        phone_number='0000000000',
+        **kwargs
+    )
+
+
+def create_order(user, quantity=1, **kwargs):
+    pricing = models.PricingRules.objects.create(
+        product_name='Hoodie',
+        base_price=Decimal('20.00'),
+        ai_design_cost=Decimal('2.00'),
+        custom_design_upload_cost=Decimal('1.00'),
+        print_cost=Decimal('8.00'),
+    )
+    size = models.Size.objects.create(name='M')
+    apparel = models.ApparelProduct.objects.create(product=pricing, color_options='black', description='hoodie')
+    apparel.sizes_available.add(size)
+    design = models.UserDesign.objects.create(user=user, apparel=apparel, shirt_size=size)
+    address, _ = models.ShippingAddress.objects.get_or_create(
+        user=user,
+        defaults={'full_name': 'Test User', 'email': user.email, 'street_address': 'street', 'city': 'city'}
+    )
+    return models.Order.objects.create(
+        user=user,
+        user_design=design,
+        shipping_address=address,
+        design_type=design.design_type,
+        apparel=apparel,
+        color=design.color,
+        print_method=design.style,
+        quantity=quantity,
+        **kwargs
+    )
+
+
+class IdSequenceTests(TestCase):
+
+    def test_ids_are_sequential(self):
+        first = create_user(1)
+        second = create_user(2)
+        self.assertEqual(first.user_id, 'U-101')
+        self.assertEqual(second.user_id, 'U-102')
+
+    def test_sequence_continues_from_legacy_ids(self):
+        create_user(1, user_id='U-250')
+        self.assertEqual(create_user(2).user_id, 'U-251')
+
+    def test_reserve_block(self):
+        codes = models.IdSequence.next_codes(models.Order, 'order_id', 'A', count=3)
+        self.assertEqual(codes, ['A-101', 'A-102', 'A-103'])
+        self.assertEqual(models.IdSequence.next_code(models.Order, 'order_id', 'A'), 'A-104')
+
+
+@skipUnless(connection.vendor == 'postgresql', 'needs a database shared between threads')
+class IdSequenceConcurrencyTests(TransactionTestCase):
+
+    def test_parallel_creates_get_unique_ids(self):
+        def create(index):
+            try:
+                return create_user(index).user_id
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            user_ids = list(pool.map(create, range(200)))
+
+        self.assertEqual(len(set(user_ids)), 200)
+        self.assertEqual(models.User.objects.count(), 200)
+
+
+class PricingTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.order = create_order(create_user(1), quantity=3)
+        self.apparel = self.order.apparel
+
+    def test_quotes(self):
+        ai = pricing.quote(self.apparel.id, models.UserDesignType.AI_GENERATED, quantity=2, discount=Decimal('5.00'))
+        self.assertEqual(ai.unit_price, Decimal('30.00'))
+        self.assertEqual(ai.total, Decimal('65.00'))
+
+        custom, = pricing.quote_many([
+            {'apparel_id': self.apparel.id, 'design_type': models.UserDesignType.CUSTOM_DESIGN}
+        ])
+        self.assertEqual(custom.unit_price, Decimal('29.00'))
+        self.assertEqual(self.order.user_design.calculate_price, Decimal('30.00'))
+        self.assertEqual(self.order.total_amount, Decimal('100.00'))
+
+    def test_orders_are_priced_without_reading_rules(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.order.quantity = 1
+            self.order.save()
+        self.assertFalse([query for query in queries if 'app_pricingrules' in query['sql']])
+        self.assertEqual(self.order.total_amount, Decimal('40.00'))
+
+    def test_rule_changes_refresh_the_table(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            models.PricingRules.objects.filter(pk=self.apparel.product_id).update(base_price=Decimal('50.00'))
+            self.apparel.product.refresh_from_db()
+            self.apparel.product.save()
+        self.assertEqual(pricing.quote(self.apparel.id, models.UserDesignType.AI_GENERATED).unit_price, Decimal('60.00'))
+
+
+class BulkOrderTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user(1)
+        self.design = create_order(self.user).user_design
+        self.large = models.Size.objects.create(name='L')
+        self.design.apparel.sizes_available.add(self.large)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_bulk_create(self):
+        lines = [
+            {'user_design': self.design.id, 'size': size.id, 'color': 'white', 'quantity': 2}
+            for size in [self.design.shirt_size, self.large] * 50
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/user/bulk-orders/', {'lines': lines}, format='json')
+        self.assertLess(len(queries), 12)  # no per line queries
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 100)
+        self.assertEqual(response.data['lines'][0]['order_id'], 'A-102')
+        self.assertEqual(response.data['lines'][-1]['order_id'], 'A-201')
+
+        orders = models.Order.objects.filter(color='white')
+        self.assertEqual(orders.count(), 100)
+        self.assertEqual(orders.values('user_design').distinct().count(), 2)  # one copy per size
+        self.assertEqual(orders.first().total_amount, Decimal('70.00'))
+        self.assertEqual(models.DailyOrderStats.objects.get().order_count, 101)
+
+    def test_invalid_lines_are_reported_per_line(self):
+        other_size = models.Size.objects.create(name='XS')
+        lines = [
+            {'user_design': self.design.id, 'size': self.large.id, 'color': 'white', 'quantity': 1},
+            {'user_design': self.design.id, 'size': other_size.id, 'color': 'white', 'quantity': 1},
+            {'user_design': 0, 'size': self.large.id, 'color': 'white', 'quantity': 1},
+        ]
+        response = self.client.post('/user/bulk-orders/', {'lines': lines}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['lines'][0], {})
+        self.assertIn('size', response.data['lines'][1])
+        self.assertIn('user_design', response.data['lines'][2])
+        self.assertEqual(models.Order.objects.count(), 1)
+
+    def test_color_longer_than_the_order_column_is_rejected(self):
+        lines = [{'user_design': self.design.id, 'size': self.large.id, 'color': 'c' * 21, 'quantity': 1}]
+        response = self.client.post('/user/bulk-orders/', {'lines': lines}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('color', response.data['lines'][0])
+        self.assertEqual(models.Order.objects.count(), 1)
+
+
+class DashboardMetricsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user(1)
+
+    def test_metrics(self):
+        create_order(self.user, quantity=2)
+        create_order(self.user, order_status=models.OrderStatus.CANCELLED, is_active=False)
+
+        metrics = dashboard.get_dashboard_metrics()
+        # (base 20 + print 8 + ai 2) * 2 + shipping 10 = 70, times quantity as before
+        self.assertEqual(metrics['monthly_revenue'], 70 * 2 + 40)
+        self.assertEqual(metrics['active_orders'], 1)
+        self.assertEqual(metrics['cancelled_orders'], 1)
+        self.assertEqual(metrics['new_customers'], 1)
+        self.assertEqual(metrics['new_apparel_designs'], 2)
+        self.assertEqual(len(metrics['1M']), 1)
+        self.assertEqual(metrics['ALL'][0]['value'], 180)
+
+    def test_metrics_are_cached_until_an_order_changes(self):
+        order = create_order(self.user)
+        dashboard.get_dashboard_metrics()
+        with self.assertNumQueries(0):
+            dashboard.get_dashboard_metrics()
+
+        order.quantity = 3
+        order.save()
+        with self.assertNumQueries(2):
+            metrics = dashboard.get_dashboard_metrics()
+        self.assertEqual(metrics['ALL'][0]['value'], (30 * 3 + 10) * 3)
+
+
+class DailyOrderStatsTests(TestCase):
+
+    def stats(self):
+        return list(models.DailyOrderStats.objects.values(
+            'day', 'revenue', 'order_count', 'active_count', 'cancelled_count', 'completed_amount', 'new_customers'
+        ))
+
+    def test_incremental_updates_match_rebuild(self):
+        user = create_user(1)
+        order = create_order(user, quantity=2)
+        create_order(user)
+        order = models.Order.objects.get(pk=order.pk)
+        order.order_status = models.OrderStatus.CANCELLED
+        order.is_active = False
+        order.save()
+        create_order(user).delete()
+
+        incremental = self.stats()
+        self.assertEqual(incremental[0]['order_count'], 2)
+        self.assertEqual(incremental[0]['cancelled_count'], 1)
+        self.assertEqual(incremental[0]['new_customers'], 1)
+
+        rollups.rebuild_daily_stats()
+        self.assertEqual(self.stats(), incremental)
+
+    def test_deferred_loads_keep_the_stats_right(self):
+        user = create_user(1)
+        create_order(user)
+        create_order(user)
+        order = models.Order.objects.only('id').first()
+        self.assertIsNone(order._loaded_stats)
+
+        order = models.Order.objects.only('id', 'order_status').first()
+        order.order_status = models.OrderStatus.CANCELLED
+        order.save()
+        models.Order.objects.defer('total_amount').last().delete()
+
+        incremental = self.stats()
+        self.assertEqual(incremental[0]['order_count'], 1)
+        self.assertEqual(incremental[0]['cancelled_count'], 1)
+        rollups.rebuild_daily_stats()
+        self.assertEqual(self.stats(), incremental)
+
+
+class OrderQueryCountTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.admin = create_user(0, is_staff=True, is_superuser=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.users = [create_user(index) for index in range(1, 4)]
+
+    def create_orders(self, count):
+        for index in range(count):
+            create_order(self.users[index % len(self.users)])
+
+    def count_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_order_list_query_count_is_constant(self):
+        self.create_orders(2)
+        small_page = self.count_queries('/list_orders/?page_size=2')
+        self.create_orders(10)
+        self.assertEqual(self.count_queries('/list_orders/?page_size=12'), small_page)
+
+    def test_order_detail_serializers_do_not_query(self):
+        self.create_orders(5)
+        orders = list(models.Order.objects.with_details())
+        with self.assertNumQueries(0):
+            serializers.TrackOrderSerializer(orders, many=True).data
+            serializers.ViewUserOrderDetailsSerializer(orders, many=True).data
+
+    def test_view_user_query_count_is_constant(self):
+        user = self.users[0]
+        create_order(user)
+        one_order = self.count_queries(f'/view_user/{user.pk}/')
+        for _ in range(5):
+            create_order(user)
+        self.assertEqual(self.count_queries(f'/view_user/{user.pk}/'), one_order)
+
+
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(create_user(0, is_staff=True, is_superuser=True))
+        user = create_user(1)
+        self.orders = [create_order(user) for _ in range(5)]
+
+    def test_cursor_pages_cover_every_order(self):
+        seen = []
+        url = '/list_orders/?pagination=cursor&page_size=2&include_count=true'
+        while url:
+            data = self.client.get(url).data
+            self.assertEqual(data['count'], 5)
+            seen += [order['id'] for order in data['results']]
+            url = data['next']
+        self.assertEqual(seen, [order.id for order in self.orders])
+
+    def test_cursor_keys_must_not_be_null(self):
+        response = self.client.get('/list_user/?pagination=cursor&ordering=-last_order_at')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/list_user/?pagination=cursor&ordering=-total_orders')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['total_orders'], 5)
+
+        request = Request(RequestFactory().get('/'))
+        with self.assertRaises(ValidationError):
+            KeysetPagination().paginate_queryset(models.Order.objects.order_by(F('created_at').desc()), request)
+
+    def test_empty_filter_is_an_empty_page(self):
+        paginator = CustomPagination()
+        request = Request(RequestFactory().get('/'))
+        self.assertEqual(paginator.paginate_queryset(models.Order.objects.filter(id__in=[]), request), [])
+        self.assertEqual(paginator.get_paginated_response([]).data['count'], 0)
+        self.assertEqual(cached_count(models.Order.objects.none()), 0)
+
+    def test_page_count_is_cached(self):
+        self.client.get('/list_orders/')
+        create_order(create_user(2))
+        self.assertEqual(self.client.get('/list_orders/').data['count'], 5)
+        cache.clear()
+        self.assertEqual(self.client.get('/list_orders/').data['count'], 6)
+
+
+class CatalogCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.apparel = create_order(create_user(1)).apparel
+
+    def test_hits_do_not_query_and_honour_etags(self):
+        first = self.client.get('/apparel-products/')
+        self.assertEqual(first.status_code, 200)
+        with self.assertNumQueries(0):
+            second = self.client.get('/apparel-products/')
+            not_modified = self.client.get('/apparel-products/', headers={'If-None-Match': first['ETag']})
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_catalog_changes_invalidate(self):
+        first = self.client.get('/apparel-products/')
+        self.apparel.sizes_available.add(models.Size.objects.create(name='XL'))
+        second = self.client.get('/apparel-products/', headers={'If-None-Match': first['ETag']})
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(len(second.json()['results'][0]['sizes_available']), 2)
+
+
+@override_settings(
+    MIDDLEWARE=['app.middleware.QueryInstrumentationMiddleware'] + settings.MIDDLEWARE,
+    DEBUG=True,
+)
+class QueryInstrumentationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        middleware.route_metrics.reset()
+        self.client = APIClient()
+        self.client.force_authenticate(create_user(0, is_staff=True, is_superuser=True))
+        create_order(create_user(1))
+
+    def test_debug_headers_and_metrics(self):
+        response = self.client.get('/list_orders/')
+        self.assertEqual(response['X-DB-Route'], 'ListOrderViewset.list')
+        self.assertEqual(response['X-DB-Query-Count'], '2')
+
+        request = RequestFactory().get('/metrics/db/', headers={'Authorization': 'Bearer secret'})
+        with override_settings(QUERY_METRICS_TOKEN='secret'):
+            metrics = middleware.db_metrics(request).content.decode()
+        self.assertIn('cad_db_queries_total{route="ListOrderViewset.list"} 2', metrics)
+
+    def test_metrics_need_a_token(self):
+        self.assertEqual(middleware.db_metrics(RequestFactory().get('/metrics/db/')).status_code, 403)
+        request = RequestFactory().get('/metrics/db/', headers={'Authorization': 'Bearer wrong'})
+        with override_settings(QUERY_METRICS_TOKEN='secret'):
+            self.assertEqual(middleware.db_metrics(request).status_code, 403)
+
+    def test_metrics_are_not_routed_without_instrumentation(self):
+        self.assertEqual(self.client.get('/metrics/db/').status_code, 404)
+
+    @override_settings(QUERY_BUDGETS={'ListOrderViewset.list': 1}, QUERY_BUDGET_STRICT=True)
+    def test_budget_exceeded(self):
+        with self.assertRaises(middleware.QueryBudgetExceeded):
+            self.client.get('/list_orders/')
+
+
+class NotificationOutboxTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_queued_messages_are_sent_over_one_connection(self):
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.open') as opened:
+            with self.captureOnCommitCallbacks(execute=True):
+                notifications.enqueue_emails([(f'user{i}@example.com', 'Hello', 'body') for i in range(3)])
+                notifications.enqueue_email('user3@example.com', 'Hello', 'body', html_body='<p>body</p>')
+        self.assertEqual(opened.call_count, 1)
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertEqual(mail.outbox[3].alternatives[0][0], '<p>body</p>')
+        self.assertFalse(models.OutboxMessage.objects.exclude(status=choices.OutboxStatus.SENT).exists())
+
+    def test_alerts_are_deduplicated(self):
+        utils.send_login_email('user1@example.com')
+        utils.send_login_email('user1@example.com')
+        self.assertEqual(models.OutboxMessage.objects.count(), 1)
+
+    @override_settings(NOTIFICATION_MAX_ATTEMPTS=2)
+    def test_failed_messages_back_off_then_give_up(self):
+        message = notifications.enqueue_email('user1@example.com', 'Hello', 'body')
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('down')):
+            notifications.drain_outbox()
+            message.refresh_from_db()
+            self.assertEqual(message.status, choices.OutboxStatus.PENDING)
+            self.assertEqual(message.attempts, 1)
+            self.assertGreater(message.next_attempt_at, message.created_at)
+
+            models.OutboxMessage.objects.update(next_attempt_at=message.created_at)
+            notifications.drain_outbox()
+            message.refresh_from_db()
+        self.assertEqual(message.status, choices.OutboxStatus.FAILED)
+        self.assertEqual(message.last_error, 'down')
+        self.assertEqual(len(mail.outbox), 0)
+
+    @override_settings(NOTIFICATION_MAX_ATTEMPTS=2)
+    def test_unreachable_relay_backs_off_the_whole_batch(self):
+        notifications.enqueue_emails([(f'user{i}@example.com', 'Hello', 'body') for i in range(3)])
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.open', side_effect=OSError('relay down')):
+            self.assertEqual(notifications.drain_outbox(), 0)
+            messages = models.OutboxMessage.objects.all()
+            self.assertEqual({(message.status, message.attempts) for message in messages}, {(choices.OutboxStatus.PENDING, 1)})
+            self.assertTrue(all(message.next_attempt_at > message.created_at for message in messages))
+            self.assertEqual(notifications.drain_outbox(), 0)  # nothing is due yet
+
+            messages.update(next_attempt_at=timezone.now())
+            notifications.drain_outbox()
+        self.assertFalse(models.OutboxMessage.objects.exclude(status=choices.OutboxStatus.FAILED).exists())
+
+    def test_claimed_messages_are_skipped_by_other_drains(self):
+        notifications.enqueue_email('user1@example.com', 'Hello', 'body')
+        self.assertEqual(len(notifications.claim_batch(10)), 1)
+        self.assertEqual(notifications.claim_batch(10), [])
+
+
+class AsyncLoginTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user(1, is_active=True)
+        self.user.set_password('secret-password')
+        self.user.save()
+
+    @override_settings(AUTH_EVENT_FLUSH_INTERVAL=0)
+    def test_login(self):
+        response = self.client.post('/user/login/', {'email': self.user.email, 'password': 'secret-password'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.json())
+        self.assertEqual(response.json()['user']['shipping_address']['city'], '')
+
+        response = self.client.post('/user/login/', {'email': self.user.email, 'password': 'wrong'}, content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(
+            sorted(models.OutboxMessage.objects.values_list('subject', flat=True)),
+            ['Login Alert - CAD', 'Login Failed Alert - CAD'],
+        )
+
+    def login(self, email, **extra):
+        return self.client.post('/user/login/', {'email': email, 'password': 'wrong'}, content_type='application/json', **extra)
+
+    def test_eleventh_attempt_in_a_minute_is_throttled(self):
+        with mock.patch('app.auth.time.time', return_value=120.0):
+            for _ in range(10):
+                self.assertEqual(self.login(self.user.email).status_code, 401)
+            response = self.login(self.user.email)
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response['Retry-After'], '60')
+
+            # per address as well: other accounts from the same client
+            for index in range(10):
+                self.login(f'other{index}@example.com', REMOTE_ADDR='10.0.0.2')
+            self.assertEqual(self.login('another@example.com', REMOTE_ADDR='10.0.0.2').status_code, 429)
+            self.assertEqual(self.login('another@example.com', REMOTE_ADDR='10.0.0.3').status_code, 401)
+
+        with mock.patch('app.auth.time.time', return_value=180.0):
+            self.assertEqual(self.login(self.user.email).status_code, 401)
+
+    @override_settings(AUTH_EVENT_FLUSH_INTERVAL=3600)
+    def test_events_are_buffered_until_flushed(self):
+        buffer = auth.AuthEventBuffer()
+        buffer.publish(buffer.LOGIN, self.user.email)
+        buffer.publish(buffer.LOGIN_FAILED, 'nobody@example.com')
+        buffer.publish(buffer.LOGOUT, self.user.email)
+        self.assertFalse(models.OutboxMessage.objects.exists())
+
+        buffer.flush()
+        self.assertEqual(
+            sorted(models.OutboxMessage.objects.values_list('subject', flat=True)),
+            ['Login Alert - CAD', 'Logout Alert - CAD'],
+        )
+
+
+class ProfileCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user(1, is_active=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_profile_is_served_from_cache_until_changed(self):
+        first = self.client.get('/user/profile/').json()
+        self.assertIsNone(models.ShippingAddress.objects.filter(user=self.user).first())
+        self.assertEqual(first['shipping_address']['city'], '')
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/user/profile/').json(), first)
+
+        # last_login only saves keep the snapshot
+        self.user.save(update_fields=['last_login'])
+        with self.assertNumQueries(0):
+            self.client.get('/user/profile/')
+
+        response = self.client.post('/user/patch-user-profile/', {
+            'first_name': 'New', 'last_name': 'User', 'country': 'Pakistan',
+            'street_address': 'Mall Road', 'city': 'Lahore', 'postal_code': '54000', 'province_state': 'Punjab',
+        })
+        self.assertEqual(response.json()['data']['shipping_address']['city'], 'Lahore')
+        profile = self.client.get('/user/profile/').json()
+        self.assertEqual(profile['first_name'], 'New')
+        self.assertEqual(profile['shipping_address']['city'], 'Lahore')
+
+
+class FakeStripeServer:
+    # just enough of POST /v1/checkout/sessions, idempotency keys included, to run checkout offline
+
+    def __init__(self):
+        self.requests = []
+        self.sessions = {}
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                key = self.headers.get('Idempotency-Key')
+                server.requests.append(key)
+                if key not in server.sessions:
+                    session_id = f'cs_test_{len(server.sessions) + 1}'
+                    server.sessions[key] = {
+                        'id': session_id,
+                        'object': 'checkout.session',
+                        'url': f'https://checkout.stripe.test/{session_id}',
+                        'expires_at': int(time.time()) + 24 * 60 * 60,
+                    }
+                body = json.dumps(server.sessions[key]).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.httpd.server_address[1]}'
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class CheckoutSessionTests(TestCase):
+
+    def setUp(self):
+        self.stripe = FakeStripeServer()
+        self.addCleanup(self.stripe.close)
+        settings_override = override_settings(STRIPE_API_BASE=self.stripe.url, STRIPE_SECRET_KEY='sk_test_fake', STRIPE_MAX_NETWORK_RETRIES=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.order = create_order(create_user(1))
+
+    def test_session_is_stored_and_reused(self):
+        first = self.client.post(f'/create-checkout-session/{self.order.id}/').json()
+        second = self.client.post(f'/create-checkout-session/{self.order.id}/').json()
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.stripe.requests), 1)
+        self.assertEqual(self.stripe.requests[0], f'checkout-{self.order.order_id}-{int(self.order.total_amount * 100)}-new')
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.checkout_session_id, first['id'])
+
+    def test_expired_session_is_replaced(self):
+        self.client.post(f'/create-checkout-session/{self.order.id}/')
+        models.Order.objects.filter(id=self.order.id).update(checkout_session_expires_at=timezone.now())
+        response = self.client.post(f'/create-checkout-session/{self.order.id}/').json()
+        self.assertEqual(response['id'], 'cs_test_2')
+        self.assertEqual(len(set(self.stripe.requests)), 2)
+
+    def test_price_change_replaces_the_session(self):
+        first = self.client.post(f'/create-checkout-session/{self.order.id}/').json()
+        models.Order.objects.filter(id=self.order.id).update(total_amount=F('total_amount') + 5)
+        second = self.client.post(f'/create-checkout-session/{self.order.id}/').json()
+        self.assertNotEqual(first['id'], second['id'])
+        self.order.refresh_from_db()
+        self.assertEqual(self.stripe.requests[-1].split('-')[3], str(int(self.order.total_amount * 100)))
+        self.assertEqual(self.order.checkout_session_amount, int(self.order.total_amount * 100))
+
+    def test_paid_orders_are_rejected(self):
+        models.Order.objects.filter(id=self.order.id).update(payment=choices.PaymentStatus.PAID)
+        response = self.client.post(f'/create-checkout-session/{self.order.id}/')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.stripe.requests, [])
+
+
+@override_settings(STRIPE_WEBHOOK_KEY='whsec_test')
+class StripeWebhookTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.order = create_order(create_user(1))
+
+    def deliver(self, event_id, event_type, order_id):
+        payload = json.dumps({
+            'id': event_id,
+            'object': 'event',
+            'type': event_type,
+            'data': {'object': {'metadata': {'order_id': str(order_id)}}},
+        })
+        timestamp = int(time.time())
+        signature = hmac.new(b'whsec_test', f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+        return self.client.post(
+            '/stripe/webhook/', payload, content_type='application/json',
+            headers={'Stripe-Signature': f't={timestamp},v1={signature}'},
+        )
+
+    def test_events_are_stored_once_and_applied_in_batches(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            for _ in range(3):
+                self.assertEqual(self.deliver('evt_1', 'checkout.session.completed', self.order.id).status_code, 200)
+            self.deliver('evt_2', 'payment_intent.payment_failed', self.order.id)
+            self.deliver('evt_3', 'customer.created', self.order.id)
+        self.assertEqual(models.StripeEvent.objects.count(), 3)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(webhooks.process_events(batch_size=3), 3)
+        # one order UPDATE for the batch, plus one per event status
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('UPDATE')]), 3)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment, choices.PaymentStatus.PAID)
+        self.assertEqual(
+            dict(models.StripeEvent.objects.values_list('event_id', 'status')),
+            {'evt_1': 'processed', 'evt_2': 'processed', 'evt_3': 'ignored'},
+        )
+
+    def test_bad_signature_is_rejected(self):
+        response = self.client.post('/stripe/webhook/', '{}', content_type='application/json', headers={'Stripe-Signature': 't=1,v1=bad'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(models.StripeEvent.objects.exists())
+
+
+class OrderTransitionTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user(1, shipping_delivery_updates=True)
+        self.orders = [create_order(self.user) for _ in range(3)]
+        self.ids = [order.id for order in self.orders]
+
+    def test_bulk_transition_is_one_update(self):
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            updated = order_states.transition_orders(self.ids, 'order_tracking_status', choices.OrderTrackingStatus.ORDER_PACKED)
+        self.assertEqual(len(updated), 3)
+        order_updates = [q['sql'] for q in queries if q['sql'].startswith('UPDATE "app_order"')]
+        self.assertEqual(len(order_updates), 1)
+        self.assertIn('SET "order_tracking_status"', order_updates[0])
+        self.assertEqual(models.OutboxMessage.objects.count(), 3)
+
+        # already packed, skipping a step is refused
+        self.assertEqual(order_states.transition_orders(self.ids, 'order_tracking_status', choices.OrderTrackingStatus.ORDER_PACKED), [])
+        with self.assertRaises(order_states.TransitionError):
+            order_states.transition_order(self.ids[0], 'order_tracking_status', choices.OrderTrackingStatus.DELIVERED)
+
+    def test_delivery_completes_and_cancel_updates_stats(self):
+        order = self.orders[0]
+        for step in ['packed', 'transit', 'delivery', 'delivered']:
+            order_states.transition_order(order.id, 'order_tracking_status', step)
+        order_states.transition_order(self.ids[1], 'order_status', choices.OrderStatus.CANCELLED)
+
+        order.refresh_from_db()
+        self.assertEqual(order.order_status, choices.OrderStatus.COMPLETED)
+        stats = models.DailyOrderStats.objects.get()
+        self.assertEqual(stats.completed_amount, order.total_amount)
+        self.assertEqual(stats.cancelled_count, 1)
+        self.assertEqual(stats.active_count, 2)
+        with self.assertRaises(order_states.TransitionError):
+            order_states.transition_order(order.id, 'order_status', choices.OrderStatus.CANCELLED)
+
+    def test_cancel_endpoint_refuses_orders_that_cannot_be_cancelled(self):
+        client = APIClient()
+        client.force_authenticate(create_user(0, is_staff=True, is_superuser=True))
+        order = self.orders[0]
+        self.assertEqual(client.post(f'/list_orders/{order.id}/cancel_order/').status_code, 200)
+        response = client.post(f'/list_orders/{order.id}/cancel_order/')
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('already cancelled', response.data['message'])
+
+        models.Order.objects.filter(id=self.ids[1]).update(order_status=choices.OrderStatus.COMPLETED)
+        self.assertEqual(client.post(f'/list_orders/{self.ids[1]}/cancel_order/').status_code, 409)
+        self.assertEqual(client.post('/list_orders/999999/cancel_order/').status_code, 404)
+
+    def test_notifications_respect_user_preference(self):
+        self.user.shipping_delivery_updates = False
+        self.user.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            order_states.transition_orders(self.ids, 'order_tracking_status', choices.OrderTrackingStatus.ORDER_PACKED)
+        self.assertFalse(models.OutboxMessage.objects.exists())
+
+
+class BulkOrderTransitionTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(create_user(0, is_staff=True, is_superuser=True))
+        self.user = create_user(1, shipping_delivery_updates=True)
+
+    def create_orders(self, count):
+        order = create_order(self.user)
+        copies = []
+        for index in range(1, count):
+            order.pk = None
+            order.order_id = f'B-{index}'
+            copies.append(copy.copy(order))
+        models.Order.objects.bulk_create(copies, batch_size=1000)
+        rollups.rebuild_daily_stats()
+
+    def test_ten_thousand_orders_in_one_call(self):
+        self.create_orders(10000)
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/list_orders/bulk_update_status/',
+                {'field': 'order_tracking_status', 'status': 'packed', 'filters': {'user': self.user.id}},
+                format='json',
+            )
+        self.assertEqual(response.json(), {'matched': 10000, 'updated': 10000, 'skipped': 0})
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('UPDATE "app_order"')]), 1)
+        self.assertEqual(models.OutboxMessage.objects.count(), 10000)
+
+    def test_cancel_by_ids_updates_stats(self):
+        self.create_orders(100)
+        ids = list(models.Order.objects.values_list('id', flat=True))
+        models.Order.objects.filter(id=ids[0]).update(order_status=choices.OrderStatus.CANCELLED)
+        response = self.client.post(
+            '/list_orders/bulk_update_status/',
+            {'field': 'order_status', 'status': 'Cancelled', 'ids': ids},
+            format='json',
+        )
+        self.assertEqual(response.json(), {'matched': 100, 'updated': 99, 'skipped': 1})
+        self.assertEqual(models.DailyOrderStats.objects.get().cancelled_count, 99)
+
+    @override_settings(BULK_ORDER_ACTION_MAX_IDS=5)
+    def test_filters_matching_too_many_orders_are_refused(self):
+        self.create_orders(6)
+        response = self.client.post(
+            '/list_orders/bulk_update_status/',
+            {'field': 'order_tracking_status', 'status': 'packed', 'filters': {'user': self.user.id}},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(models.Order.objects.filter(order_tracking_status='packed').exists())
+
+    def test_ids_or_filters_are_required(self):
+        response = self.client.post('/list_orders/bulk_update_status/', {'field': 'payment', 'status': 'Paid'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class UserCounterTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(create_user(0, is_staff=True, is_superuser=True, is_active=True))
+        self.users = [create_user(index, is_active=True) for index in range(1, 6)]
+
+    def test_counters_follow_changes_without_counting(self):
+        self.assertEqual(self.client.get('/user_management/').json(), {'totals_users': 6, 'active_users': 6, 'suspended_user': 0})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/list_user/bulk-suspend/', {'ids': [user.id for user in self.users[:3]]}, format='json')
+        self.assertEqual(response.json()['updated'], 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.users[3].is_active = False
+            self.users[3].save()
+            create_user(6, is_active=False)
+            self.users[4].delete()
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/user_management/')
+        self.assertEqual(response.json(), {'totals_users': 6, 'active_users': 1, 'suspended_user': 5})
+        self.assertEqual(counters.count_users(), (6, 1))
+
+    def test_bulk_suspend_skips_superusers(self):
+        admin = models.User.objects.get(is_superuser=True)
+        response = self.client.post('/list_user/bulk-suspend/', {'ids': [admin.id, self.users[0].id]}, format='json')
+        self.assertEqual(response.json()['updated'], 1)
+        response = self.client.post('/list_user/bulk-reactivate/', {'ids': [self.users[0].id, self.users[1].id]}, format='json')
+        self.assertEqual(response.json()['updated'], 1)
+
+
+class ListUserTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.admin = create_user(0, is_staff=True, is_superuser=True)
+        self.client.force_authenticate(self.admin)
+        self.users = [create_user(index) for index in range(1, 6)]
+        for index, user in enumerate(self.users):
+            for _ in range(index):
+                create_order(user)
+
+    def test_query_count_is_constant(self):
+        with self.assertNumQueries(2):  # count + page
+            response = self.client.get('/list_user/', {'page_size': 3})
+        with self.assertNumQueries(1):  # count is cached
+            self.client.get('/list_user/', {'page_size': 6})
+        self.assertEqual(response.json()['results'][1]['total_orders'], 0)
+
+    def test_top_spenders_and_dormant_users(self):
+        results = self.client.get('/list_user/', {'ordering': '-total_spent', 'min_orders': 1}).json()['results']
+        self.assertEqual([row['id'] for row in results], [user.id for user in reversed(self.users[1:])])
+        self.assertEqual(Decimal(results[0]['total_spent']), 4 * models.Order.objects.filter(user=self.users[4]).first().total_amount)
+        self.assertIsNotNone(results[0]['last_order_at'])
+
+        dormant = self.client.get('/list_user/', {'dormant_days': 30}).json()['results']
+        self.assertEqual({row['id'] for row in dormant}, {self.admin.id, self.users[0].id})
+
+        response = self.client.get('/list_user/', {'ordering': 'password'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ViewUserTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = create_user(0, is_staff=True, is_superuser=True)
+        self.client.force_authenticate(self.admin)
+        self.user = create_user(1)
+        self.other = create_user(2)
+
+    def test_customer_detail_query_count_is_constant(self):
+        create_order(self.other)
+        create_order(self.user)
+        with self.assertNumQueries(2):  # user with stats + recent orders
+            self.client.get(f'/view_user/{self.user.id}/')
+
+        orders = [create_order(self.user) for _ in range(8)]
+        with self.assertNumQueries(2):
+            data = self.client.get(f'/view_user/{self.user.id}/').json()
+        self.assertEqual(data['total_user_orders'], 9)
+        self.assertEqual(Decimal(str(data['total_spent'])), sum(order.total_amount for order in orders) + orders[0].total_amount)
+        recent = [order['id'] for order in data['list_of_recent_orders']]
+        self.assertEqual(recent, [order.id for order in reversed(orders)][:6])
+
+    def test_missing_user(self):
+        self.assertEqual(self.client.get('/view_user/999999/').status_code, 400)
+
+    def test_benchmark_cost_does_not_follow_the_order_table(self):
+        output = io.StringIO()
+        benchmark_customer_detail.Command(stdout=output).handle(orders=[50, 500], customer_orders=10, repeat=2)
+        rows = [line.split() for line in output.getvalue().splitlines()[1:]]
+        self.assertEqual([(row[0], row[1], row[2]) for row in rows], [('50', '11', '2'), ('500', '11', '2')])
+        self.assertFalse(models.Order.objects.filter(order_id__startswith='B-').exists())  # rolled back
+
+
+class IndexUsageTests(TestCase):
+    '''
+    EXPLAIN the hot filters against a seeded table and check they pick the intended index.
+    On PostgreSQL sequential scans are switched off for the transaction, a table this
+    small would otherwise always be scanned.
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user(1)
+        order = create_order(cls.user)
+        statuses = [choices.OrderStatus.COMPLETED] * 8 + [choices.OrderStatus.CANCELLED, choices.OrderStatus.PROCESSING]
+        copies = []
+        for index in range(2000):
+            order.pk = None
+            order.order_id = f'I-{index % 40}-{index}'
+            order.order_status = statuses[index % len(statuses)]
+            order.is_active = order.order_status == choices.OrderStatus.PROCESSING
+            copies.append(copy.copy(order))
+        models.Order.objects.bulk_create(copies, batch_size=500)
+        for offset in range(40):  # created_at is auto_now_add, spread the orders over 40 days afterwards
+            models.Order.objects.filter(order_id__startswith=f'I-{offset}-').update(
+                created_at=timezone.now() - timedelta(days=offset)
+            )
+        models.User.objects.bulk_create([
+            models.User(email=f'seed{index}@example.com', username=f'seed{index}', first_name='Seed', last_name='User')
+            for index in range(200)
+        ])
+        models.User.objects.filter(email__startswith='seed').update(created_at=timezone.now() - timedelta(days=90))
+        design = models.UserDesign.objects.first()
+        for _ in range(20):
+            design.pk = None
+            models.UserDesign.objects.bulk_create([copy.copy(design)])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def explain(self, queryset):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.explain()
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = self.explain(queryset)
+        self.assertIn(index_name, plan, plan)
+
+    def test_hot_filters_use_indexes(self):
+        since = timezone.localdate() - timedelta(days=7)
+        self.assertUsesIndex(models.Order.objects.filter(created_at__gte=rollups.day_start(since)), 'order_created_idx')
+        self.assertUsesIndex(models.Order.objects.filter(order_status=choices.OrderStatus.CANCELLED), 'order_status_payment_idx')
+        self.assertUsesIndex(
+            models.Order.objects.filter(is_active=True, created_at__gte=rollups.day_start(since)),
+            'order_active_created_idx',
+        )
+        self.assertUsesIndex(
+            models.Order.objects.filter(order_status=choices.OrderStatus.PROCESSING, order_tracking_status='placed'),
+            'order_processing_idx',
+        )
+        self.assertUsesIndex(models.Order.objects.filter(user=self.user).order_by('-created_at')[:6], 'order_user_created_idx')
+        self.assertUsesIndex(models.User.objects.filter(created_at__gte=rollups.day_start(since)), 'user_created_idx')
+        self.assertUsesIndex(
+            models.UserDesign.objects.filter(user=self.user, is_draft=True).order_by('-created_at'),
+            'design_user_drafts_idx',
+        )
+
+    def test_day_ranges_match_date_lookups(self):
+        days = [timezone.localdate() - timedelta(days=offset) for offset in (0, 3, 39)]
+        self.assertEqual(
+            models.Order.objects.filter(rollups.created_on(days)).count(),
+            models.Order.objects.filter(created_at__date__in=days).count(),
+        )
+        self.assertFalse(models.Order.objects.filter(rollups.created_on([])).exists())
+
+
+class OTPTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = create_user(1, is_active=False)
+
+    def resend(self):
+        return self.client.post('/user/resend-otp/', {'email': self.user.email}, format='json')
+
+    def last_code(self):
+        body = models.OutboxMessage.objects.order_by('-id').first().body
+        return re.search(r'registration: (\d{6})', body).group(1)
+
+    def verify(self, code):
+        return self.client.post('/user/verify-otp/', {'email': self.user.email, 'otp': code}, format='json')
+
+    def test_code_verifies_once(self):
+        self.assertEqual(self.resend().status_code, 200)
+        code = self.last_code()
+        wrong = '000000' if code != '000000' else '111111'
+        self.assertEqual(self.verify(wrong).status_code, 403)
+        self.assertEqual(self.verify(code).status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_active)
+        self.assertIsNone(self.user.otp)
+        self.assertEqual(self.verify(code).status_code, 403)
+
+    def test_expired_code_is_rejected(self):
+        self.resend()
+        code = self.last_code()
+        models.User.objects.filter(id=self.user.id).update(otp_expiry=timezone.now())
+        self.assertEqual(self.verify(code).status_code, 403)
+
+    @override_settings(OTP_SEND_LIMIT=2)
+    def test_resends_are_rate_limited(self):
+        self.assertEqual(self.resend().status_code, 200)
+        self.assertEqual(self.resend().status_code, 200)
+        response = self.resend()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(models.OutboxMessage.objects.count(), 2)
+
+    def test_wrong_guesses_burn_the_code(self):
+        self.resend()
+        code = self.last_code()
+        wrong = '000000' if code != '000000' else '111111'
+        for _ in range(settings.OTP_MAX_ATTEMPTS):
+            self.assertEqual(self.verify(wrong).status_code, 403)
+        self.assertEqual(self.verify(code).status_code, 403)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+
+        self.resend()  # a new code starts a new count
+        self.assertEqual(self.verify(self.last_code()).status_code, 200)
+
+    def test_issue_only_writes_the_otp_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            otp.DatabaseOTPStore().issue(otp.WELCOME, self.user.email)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('password', queries[0]['sql'])
+
+
+@skipUnless(settings.CACHES['default']['BACKEND'].startswith('django_redis'), 'needs redis')
+class RedisOTPStoreTests(TestCase):
+
+    def setUp(self):
+        self.store = otp.RedisOTPStore()
+        self.email = f'otp-{time.time_ns()}@example.com'
+
+    def test_compare_and_delete(self):
+        code = self.store.issue(otp.WELCOME, self.email)
+        self.assertFalse(self.store.verify(otp.PASSWORD_RESET, self.email, code))
+        self.assertTrue(self.store.verify(otp.WELCOME, self.email, code))
+        self.assertFalse(self.store.verify(otp.WELCOME, self.email, code))
+
+    def test_wrong_guesses_burn_the_code(self):
+        code = self.store.issue(otp.WELCOME, self.email)
+        wrong = '000000' if code != '000000' else '111111'
+        for _ in range(settings.OTP_MAX_ATTEMPTS):
+            self.assertFalse(self.store.verify(otp.WELCOME, self.email, wrong))
+        self.assertFalse(self.store.verify(otp.WELCOME, self.email, code))
+
+    def test_codes_issued_during_an_outage_still_verify(self):
+        user = create_user(1)
+        code = self.store.fallback.issue(otp.WELCOME, user.email)
+        self.assertTrue(self.store.verify(otp.WELCOME, user.email, code))
+
+    def test_sliding_window(self):
+        for _ in range(settings.OTP_SEND_LIMIT):
+            self.assertEqual(self.store.send_retry_after(self.email), 0)
+        self.assertGreater(self.store.send_retry_after(self.email), 0)
+
+
+def image_upload(name='design.jpg', size=(2400, 1800), mode='RGB', format='JPEG'):
+    buffer = io.BytesIO()
+    Image.new(mode, size, 'red').save(buffer, format)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+class ImageRenditionTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.user = create_user(1)
+        self.order = create_order(self.user)
+        self.design = self.order.user_design
+
+    def upload(self, design, upload):
+        with self.captureOnCommitCallbacks(execute=True):
+            design.image_front = upload
+            design.save()
+        design.refresh_from_db()
+        return design
+
+    def test_renditions_and_webp_are_generated(self):
+        design = self.upload(self.design, image_upload())
+        renditions = design.renditions['image_front']
+        self.assertEqual(renditions['source'], design.image_front.name)
+        for rendition, size in images.RENDITIONS.items():
+            for name in (renditions[rendition], renditions[f'{rendition}_webp']):
+                with default_storage.open(name) as file, Image.open(file) as image:
+                    self.assertLessEqual(max(image.size), size)
+        self.assertTrue(renditions['thumb'].endswith('.jpg'))
+        self.assertTrue(renditions['thumb_webp'].endswith('.webp'))
+
+        data = serializers.ListOrderSerializer(models.Order.objects.with_apparel().with_thumbnail().get(id=self.order.id)).data
+        self.assertTrue(data['thumbnail']['thumb'].endswith(renditions['thumb']))
+
+    def test_transparent_uploads_keep_alpha(self):
+        design = self.upload(self.design, image_upload('logo.png', (800, 800), 'RGBA', 'PNG'))
+        self.assertTrue(design.renditions['image_front']['preview'].endswith('.png'))
+
+    def test_identical_uploads_are_stored_once(self):
+        first = self.upload(self.design, image_upload())
+        stored = sum(len(files) for _, _, files in os.walk(self.media_root))
+        other = models.UserDesign.objects.create(user=self.user, apparel=first.apparel, shirt_size=first.shirt_size)
+        second = self.upload(other, image_upload('copy.jpg'))
+        self.assertEqual(second.image_front.name, first.image_front.name)
+        self.assertEqual(second.renditions, first.renditions)
+        self.assertEqual(sum(len(files) for _, _, files in os.walk(self.media_root)), stored)
+
+    def test_saves_without_new_images_do_not_render(self):
+        self.upload(self.design, image_upload())
+        with mock.patch('app.tasks.generate_image_renditions.delay') as delay, self.captureOnCommitCallbacks(execute=True):
+            self.design.color = 'white'
+            self.design.save()
+        delay.assert_not_called()
+
+
+class DesignUploadTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.user = create_user(1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        design = create_order(self.user).user_design
+        self.data = {'apparel': design.apparel_id, 'shirt_size': design.shirt_size_id, 'is_draft': True}
+
+    def post(self, upload):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/user-dashboard/', {**self.data, 'image_front': upload}, format='multipart')
+
+    def test_upload_is_stored(self):
+        response = self.post(image_upload())
+        self.assertEqual(response.status_code, 201, response.content)
+        design = models.UserDesign.objects.get(id=response.json()['id'])
+        self.assertRegex(design.image_front.name, r'^user/product-design/front_images/[0-9a-f]{2}/[0-9a-f]{32}\.jpg$')
+
+    def test_oversized_dimensions_are_rejected(self):
+        response = self.post(image_upload('banner.png', (13000, 10), 'L', 'PNG'))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('13000x10', response.json()['detail'])
+        self.assertFalse(models.UserDesign.objects.filter(image_front__gt='').exists())
+
+    @override_settings(DESIGN_UPLOAD_MAX_BYTES=256 * 1024)
+    def test_size_cap(self):
+        artwork = image_upload().read()
+        self.assertEqual(self.post(SimpleUploadedFile('art.jpg', artwork)).status_code, 201)
+        response = self.post(SimpleUploadedFile('art.jpg', artwork + b'\0' * 256 * 1024))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('larger than', response.json()['detail'])
+
+    def test_not_an_image(self):
+        response = self.post(SimpleUploadedFile('art.jpg', b'not an image' * 100))
+        self.assertEqual(response.status_code, 400)
+
+    def test_peak_memory_does_not_grow_with_file_size(self):
+        command = benchmark_uploads.Command()
+        peaks = []
+        for size in (2, 32):
+            path = os.path.join(self.media_root, f'body-{size}')
+            length = benchmark_uploads.write_body(path, size * 1024 * 1024)
+            peaks.append(command.upload(path, length, baseline=False))
+        self.assertLess(peaks[1], peaks[0] + 1024 * 1024)
+
+
+class ResumableUploadTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        settings_override = override_settings(
+            MEDIA_ROOT=self.media_root, RESUMABLE_UPLOAD_DIR=os.path.join(self.media_root, 'partial-uploads'),
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.user = create_user(1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.design = create_order(self.user).user_design
+        self.design.is_draft = True
+        self.design.save()
+        self.artwork = image_upload().read()
+
+    def start(self, artwork=None, **kwargs):
+        artwork = artwork or self.artwork
+        data = {
+            'design': self.design.id, 'field': 'image_front', 'filename': 'art.jpg',
+            'size': len(artwork), 'checksum': hashlib.sha256(artwork).hexdigest(), **kwargs,
+        }
+        return self.client.post('/design-uploads/', data, format='json')
+
+    def put(self, upload_id, offset, data, **headers):
+        return self.client.put(
+            f'/design-uploads/{upload_id}/chunk/?offset={offset}', data,
+            content_type='application/octet-stream', headers=headers,
+        )
+
+    def test_interrupted_upload_resumes(self):
+        upload_id = self.start().json()['id']
+        half = len(self.artwork) // 2
+        self.assertEqual(self.put(upload_id, 0, self.artwork[:half]).json()['offset'], half)
+
+        # the connection drops halfway through the next chunk: nothing of it is confirmed
+        upload = models.DesignUpload.objects.get(id=upload_id)
+        with self.assertRaises(resumable.UploadError):
+            resumable.write_chunk(upload, half, io.BytesIO(self.artwork[half:half + 100]), len(self.artwork) - half)
+
+        # a client that lost track is told where to carry on
+        response = self.put(upload_id, 0, self.artwork[:half])
+        self.assertEqual(response.status_code, 409)
+        offset = self.client.get(f'/design-uploads/{upload_id}/').json()['offset']
+        self.assertEqual(offset, half)
+
+        rest = self.artwork[offset:]
+        response = self.put(upload_id, offset, rest, upload_checksum=hashlib.sha256(rest).hexdigest())
+        self.assertEqual(response.json()['offset'], len(self.artwork))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/design-uploads/{upload_id}/complete/')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.design.refresh_from_db()
+        with self.design.image_front.open('rb') as stored:
+            self.assertEqual(stored.read(), self.artwork)
+        self.assertIn('image_front', self.design.renditions)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'partial-uploads')), [])
+        self.assertEqual(self.client.post(f'/design-uploads/{upload_id}/complete/').status_code, 400)
+
+    def test_failed_complete_can_be_retried(self):
+        upload_id = self.start().json()['id']
+        self.put(upload_id, 0, self.artwork)
+        with mock.patch('app.models.UserDesign.save', side_effect=DatabaseError('connection lost')):
+            with self.assertRaises(DatabaseError):
+                self.client.post(f'/design-uploads/{upload_id}/complete/')
+        self.assertEqual(models.DesignUpload.objects.get(id=upload_id).status, choices.DesignUploadStatus.PENDING)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/design-uploads/{upload_id}/complete/')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.design.refresh_from_db()
+        with self.design.image_front.open('rb') as stored:
+            self.assertEqual(stored.read(), self.artwork)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'partial-uploads')), [])
+
+    def test_chunk_checksum_mismatch_is_not_confirmed(self):
+        upload_id = self.start().json()['id']
+        response = self.put(upload_id, 0, self.artwork[:1000], upload_checksum='0' * 64)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(models.DesignUpload.objects.get(id=upload_id).offset, 0)
+
+    def test_file_checksum_mismatch(self):
+        upload_id = self.start(checksum='0' * 64).json()['id']
+        self.put(upload_id, 0, self.artwork)
+        response = self.client.post(f'/design-uploads/{upload_id}/complete/')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(models.DesignUpload.objects.filter(id=upload_id).exists())
+        self.design.refresh_from_db()
+        self.assertFalse(self.design.image_front)
+
+    def test_oversized_artwork_is_rejected_from_the_first_chunk(self):
+        buffer = io.BytesIO()
+        Image.new('L', (13000, 10)).save(buffer, 'PNG')
+        artwork = buffer.getvalue() + b'\0' * 1000
+        upload_id = self.start(artwork).json()['id']
+        response = self.put(upload_id, 0, artwork[:len(artwork) // 2])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(models.DesignUpload.objects.filter(id=upload_id).exists())
+
+    def test_only_own_drafts(self):
+        other = create_user(2)
+        self.design.user = other
+        self.design.save()
+        self.assertEqual(self.start().status_code, 400)
+
+
+def png_bytes(color, size=(400, 400), mode='RGBA'):
+    buffer = io.BytesIO()
+    Image.new(mode, size, color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class CompositorTests(TestCase):
+
+    def render(self, template, color, artwork=None):
+        with Image.open(io.BytesIO(compositor.render_mockup(template, color, artwork, max_side=200, quality=100))) as image:
+            return image.convert('RGBA')
+
+    def test_flat_cloth_takes_the_design_color(self):
+        mockup = self.render(png_bytes((200, 200, 200, 255)), '#3366cc')
+        for channel, expected in zip(mockup.getpixel((10, 10)), (0x33, 0x66, 0xcc, 255)):
+            self.assertAlmostEqual(channel, expected, delta=8)
+
+    def test_transparent_background_stays_transparent(self):
+        template = Image.new('RGBA', (400, 400), (0, 0, 0, 0))
+        template.paste((200, 200, 200, 255), (100, 0, 300, 400))
+        buffer = io.BytesIO()
+        template.save(buffer, 'PNG')
+        mockup = self.render(buffer.getvalue(), 'red')
+        self.assertEqual(mockup.getpixel((10, 100))[3], 0)
+        self.assertEqual(mockup.getpixel((100, 100))[3], 255)
+
+    def test_artwork_is_printed_inside_the_print_area(self):
+        mockup = self.render(png_bytes((255, 255, 255, 255)), 'white', png_bytes((0, 0, 255, 255), (100, 100)))
+        left, top, width, height = compositor.PRINT_AREA
+        red, green, blue, _ = mockup.getpixel((100, int(200 * top) + 10))
+        self.assertGreater(blue, 200)
+        self.assertLess(red, 40)
+        self.assertEqual(mockup.getpixel((10, 10))[:3], (255, 255, 255))
+
+
+class MockupTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        settings_override = override_settings(MEDIA_ROOT=self.media_root, MOCKUP_WORKERS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.user = create_user(1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.design = create_order(self.user).user_design
+        self.design.is_draft = True
+        with self.captureOnCommitCallbacks(execute=True):
+            self.design.apparel.upload_image = image_upload('hoodie.jpg', (1200, 1200))
+            self.design.apparel.save()
+            self.design.image_front = image_upload('art.png', (800, 800), 'RGBA', 'PNG')
+            self.design.save()
+        self.design.refresh_from_db()
+
+    def get_mockup(self):
+        return self.client.get(f'/user-dashboard/{self.design.id}/mockup/')
+
+    def test_mockups_are_rendered_from_previews_and_cached(self):
+        with mock.patch('app.compositor.render_mockup', wraps=compositor.render_mockup) as render:
+            response = self.get_mockup()
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(render.call_count, 2)
+            artwork = render.call_args_list[0].args[2]
+            self.assertTrue(artwork.endswith(self.design.renditions['image_front']['preview']))
+            for side in mockups.SIDES:
+                name = response.json()[side].split(settings.MEDIA_URL, 1)[1]
+                with default_storage.open(name) as file, Image.open(file) as image:
+                    self.assertEqual(image.format, 'WEBP')
+                    self.assertLessEqual(max(image.size), settings.MOCKUP_MAX_SIDE)
+
+            self.assertEqual(self.get_mockup().json(), response.json())
+            self.assertEqual(render.call_count, 2)
+
+    def test_new_color_renders_a_new_mockup(self):
+        first = mockups.get_mockups(self.design)
+        self.design.color = 'white'
+        second = mockups.get_mockups(self.design)
+        self.assertNotEqual(first['front'], second['front'])
+        self.assertTrue(default_storage.exists(second['front']))
+
+    def test_apparel_without_image_is_rejected(self):
+        models.ApparelProduct.objects.filter(id=self.design.apparel_id).update(upload_image='')
+        self.assertEqual(self.get_mockup().status_code, 400)
+
+    @override_settings(MOCKUP_WORKERS=1)
+    def test_renders_in_process_pool(self):
+        names = mockups.get_mockups(self.design)
+        self.assertTrue(all(default_storage.exists(name) for name in names.values()))
+
+    @override_settings(MOCKUP_WORKERS=1)
+    def test_crashed_render_worker_is_replaced(self):
+        broken = mockups.get_render_pool()
+        with self.assertRaises(BrokenProcessPool):
+            broken.submit(os._exit, 1).result()
+        names = mockups.get_mockups(self.design)
+        self.assertTrue(all(default_storage.exists(name) for name in names.values()))
+        self.assertIsNot(mockups.get_render_pool(), broken)
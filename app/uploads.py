@@ -0,0 +1,96 @@
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.http.multipartparser import MultiPartParserError
+from rest_framework.parsers import MultiPartParser
+from PIL import Image
+
+# formats accepted for design artwork, checked from the file header
+IMAGE_FORMATS = {'JPEG', 'PNG', 'WEBP', 'TIFF'}
+
+# the header of every accepted format sits well inside the first megabyte
+PROBE_LIMIT = 1024 * 1024
+
+
+class UploadRejected(MultiPartParserError):
+    pass
+
+
+def check_image(image):
+    if image.format not in IMAGE_FORMATS:
+        raise UploadRejected(f'unsupported image format {image.format}, use one of {", ".join(sorted(IMAGE_FORMATS))}')
+    width, height = image.size
+    if max(width, height) > settings.DESIGN_UPLOAD_MAX_SIDE or width * height > settings.DESIGN_UPLOAD_MAX_PIXELS:
+        raise UploadRejected(f'image is {width}x{height}, the limit is {settings.DESIGN_UPLOAD_MAX_SIDE}px per side')
+    return image.format, image.size
+
+
+def probe_image(file):
+    '''
+    Format and size from the header only. Image.open is lazy and never decodes
+    pixels; files on disk are opened by path, nothing is copied into memory.
+    '''
+    source = file.temporary_file_path() if hasattr(file, 'temporary_file_path') else file
+    position = file.tell() if source is file else None
+    try:
+        with Image.open(source) as image:
+            return check_image(image)
+    except Image.DecompressionBombError:
+        raise UploadRejected('image dimensions are too large')
+    except OSError:
+        raise UploadRejected('upload a valid image, the file is not an image or is corrupted')
+    finally:
+        if position is not None:
+            file.seek(position)
+
+
+def probe_header(path):
+    # format and size once the header is on disk, None while it is still incomplete
+    try:
+        with Image.open(path) as image:
+            return check_image(image)
+    except Image.DecompressionBombError:
+        raise UploadRejected('image dimensions are too large')
+    except (OSError, SyntaxError):
+        return None
+
+
+class DesignUploadHandler(TemporaryFileUploadHandler):
+    '''
+    Streams every file part straight to a temp file, whatever its size, and
+    stops the upload as soon as a file crosses DESIGN_UPLOAD_MAX_BYTES or its
+    header announces an image over the dimension caps, instead of after the
+    whole body has been read.
+    '''
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+        self.probed = None
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.DESIGN_UPLOAD_MAX_BYTES:
+            raise UploadRejected(
+                f'{self.field_name} is larger than {settings.DESIGN_UPLOAD_MAX_BYTES // (1024 * 1024)} MB'
+            )
+        super().receive_data_chunk(raw_data, start)
+        if self.probed is None and self.received <= PROBE_LIMIT:
+            self.probe()
+        return None
+
+    def probe(self):
+        self.file.flush()
+        self.probed = probe_header(self.file.temporary_file_path())
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.image_format, file.image_size = self.probed or probe_image(file)
+        return file
+
+
+class DesignUploadParser(MultiPartParser):
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context['request']
+        request._request.upload_handlers = [DesignUploadHandler(request._request)]
+        return super().parse(stream, media_type, parser_context)
@@ -1,8 +1,6 @@
 from rest_framework_simplejwt.tokens import RefreshToken
-from django.core.mail import send_mail
 from project import settings
-from celery import shared_task
-from app import models
+from app import notifications
 
 def get_tokens_for_user(user):
     refresh = RefreshToken.for_user(user)
@@ -11,100 +9,43 @@ def get_tokens_for_user(user):
         'access': str(refresh.access_token),
     }
 
-@shared_task
+# the helpers below only write to the outbox (see notifications.py),
+# delivery happens in batches on the drain_email_outbox task
+
 def send_login_email(user_email):
     subject = "Login Alert - CAD"
     message = "You have successfully logged in to your account."
-    sender = settings.EMAIL_HOST_USER
-    to_email = [user_email]
-    send_mail(
-        subject,
-        message,
-        sender,
-        to_email,
-        fail_silently=False,
-    )
+    return notifications.enqueue_email(user_email, subject, message, dedupe_seconds=settings.NOTIFICATION_ALERT_DEDUPE)
 
-@shared_task
-def login_failed_email(user):
+def login_failed_email(user_email):
     subject = "Login Failed Alert - CAD"
     message = "There was a failed login attempt to your account. If this wasn't you, please reset your password immediately."
-    sender = settings.EMAIL_HOST_USER
-    to_email = [user.email]
-    send_mail(
-        subject,
-        message,
-        sender,
-        to_email,
-        fail_silently=False,
-    )
+    return notifications.enqueue_email(user_email, subject, message, dedupe_seconds=settings.NOTIFICATION_ALERT_DEDUPE)
 
-@shared_task
-def send_logout_email(user):
+def send_logout_email(user_email):
     subject = "Logout Alert - CAD"
     message = "You have successfully logged out of your account."
-    sender = settings.EMAIL_HOST_USER
-    to_email = [user.email]
-    send_mail(
-        subject,
-        message,
-        sender,
-        to_email,
-        fail_silently=False,
-    )
+    return notifications.enqueue_email(user_email, subject, message, dedupe_seconds=settings.NOTIFICATION_ALERT_DEDUPE)
 
-@shared_task
-def send_order_confirmation_email(user, order):
+def send_order_confirmation_email(user_email, order_id):
     subject = "Order Confirmation - CAD"
-    message = f"Thank you for your order #{order.id}. We are processing it and will update you once it's shipped."
-    sender = settings.EMAIL_HOST_USER
-    to_email = [user.email]
-    send_mail(
-        subject,
-        message,
-        sender,
-        to_email,
-        fail_silently=False,
-    )
+    message = f"Thank you for your order #{order_id}. We are processing it and will update you once it's shipped."
+    return notifications.enqueue_email(user_email, subject, message)
 
-@shared_task
-def payment_success_email(user, order):
+def payment_success_email(user_email, order_id):
     subject = "Payment Successful - CAD"
-    message = f"Your payment for order #{order.id} was successful. Thank you for shopping with us!"
-    sender = settings.EMAIL_HOST_USER
-    to_email = [user.email]
-    send_mail(
-        subject,
-        message,
-        sender,
-        to_email,
-        fail_silently=False,
-    )
+    message = f"Your payment for order #{order_id} was successful. Thank you for shopping with us!"
+    return notifications.enqueue_email(user_email, subject, message)
+
+def shipping_delivery_message(user_email, order_id, status):
+    subject = f"Order #{order_id} - {status}"
+    message = f"Your order #{order_id} status has been updated to: {status}."
+    return user_email, subject, message
 
-@shared_task
-def shipping_delivery_updated(user, order, status):
-    subject = f"Order #{order.id} - {status}"
-    message = f"Your order #{order.id} status has been updated to: {status}."
-    sender = settings.EMAIL_HOST_USER
-    to_email = [user.email]
-    send_mail(
-        subject,
-        message,
-        sender,
-        to_email,
-        fail_silently=False,
-    )
+def shipping_delivery_updated(user_email, order_id, status):
+    return notifications.enqueue_email(*shipping_delivery_message(user_email, order_id, status))
 
-@shared_task
-def ai_design_alerts(user, design_details):
+def ai_design_alerts(user_email, username, design_details):
     subject = "Your AI-Generated Design is Ready - CAD"
-    message = f"Hello {user.username}, your AI-generated design is ready! Details: {design_details}"
-    sender = settings.EMAIL_HOST_USER
-    to_email = [user.email]
-    send_mail(
-        subject,
-        message,
-        sender,
-        to_email,
-        fail_silently=False,
-    )
\ No newline at end of file
+    message = f"Hello {username}, your AI-generated design is ready! Details: {design_details}"
+    return notifications.enqueue_email(user_email, subject, message)
@@ -1,3 +1,4 @@
+import json
 from django.shortcuts import render
 from rest_framework.viewsets import GenericViewSet
 from rest_framework.mixins import CreateModelMixin, ListModelMixin, RetrieveModelMixin
@@ -7,6 +8,7 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework.decorators import action
+from rest_framework.parsers import JSONParser, FormParser
 from django.utils import timezone
 from django.shortcuts import get_object_or_404
 from datetime import timedelta
@@ -15,49 +17,80 @@ from django.contrib.auth import get_user_model
 from django.utils.encoding import force_str, force_bytes
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.contrib.auth.tokens import default_token_generator
-from django.core.mail import EmailMultiAlternatives
-from django.db.models import Sum, F
-from django.db.models.functions import TruncWeek, TruncMonth, TruncQuarter, TruncYear
-from django.contrib.auth import login
-from app import models, serializers, choices, utils
-from app import permissions
+from django.db import transaction
+from django.db.models import Sum, F, Prefetch
+from django.core.files.storage import default_storage
+from django.contrib.auth import alogin
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from django.utils.decorators import method_decorator
+from app import models, serializers, choices, utils, dashboard, catalog, notifications
+from app import permissions, auth, profiles, checkout, order_states, counters, uploads, resumable, mockups
 from .pagination import CustomPagination
 from project.settings import frontend_url
 from django.contrib.auth.signals import user_logged_in, user_login_failed, user_logged_out
 
 User = get_user_model()
 
-class LoginView(APIView):
-    permission_classes = [AllowAny]
-    authentication_classes = []
-    def post(self, request):
-        serializer = serializers.LoginSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
+
+def parse_request_data(request):
+    if request.content_type == 'application/json':
+        try:
+            return json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+    return request.POST
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class LoginView(View):
+    # plain async django view: under asgi the password hash runs on auth.get_hash_pool()
+    # and the login signal only buffers an event, so the event loop never blocks on either
+
+    async def post(self, request):
+        data = parse_request_data(request)
+        if data is None:
+            return JsonResponse({"detail": "JSON parse error"}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = serializers.LoginSerializer(data=data)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         email = serializer.validated_data.get('email')
         password = serializer.validated_data.get('password')
 
         if not email or not password:
-            return Response(
+            return JsonResponse(
                 {"detail": "Email and password are required."},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        wait = await auth.alogin_retry_after(request, email)
+        if wait:
+            response = JsonResponse(
+                {"detail": f"Request was throttled. Expected available in {wait} seconds."},
+                status=status.HTTP_429_TOO_MANY_REQUESTS
+            )
+            response['Retry-After'] = str(wait)
+            return response
+
         try:
-            user = User.objects.get(email=email)
+            user = await User.objects.aget(email=email)
         except User.DoesNotExist:
-            return Response(
+            return JsonResponse(
                 {"detail": "No user found with this email"},
                 status=status.HTTP_401_UNAUTHORIZED
             )
 
-        if not user.check_password(password):
-            return Response(
+        if not await auth.acheck_password(user, password):
+            await user_login_failed.asend(sender=__name__, credentials={'username': email}, request=request)
+            return JsonResponse(
                 {"detail": "Incorrect password"},
                 status=status.HTTP_401_UNAUTHORIZED
             )
 
         if not user.is_active:
-            return Response(
+            return JsonResponse(
                 {
                     "detail": "User is inactive. Please verify OTP.",
                     "is_active": False,
@@ -68,45 +101,18 @@ class LoginView(APIView):
 
         tokens = utils.get_tokens_for_user(user)
 
-        shipping = getattr(user, "shipping_address", None)
-        login(request, user)
-        return Response({
+        await alogin(request, user)
+        profile = await profiles.aget_profile(user.id)
+        return JsonResponse({
             **tokens,
-            "user": {
-                "id": user.id,
-                "role": user.role,
-                "profile_picture": request.build_absolute_uri(user.profile_picture.url) if user.profile_picture else "",
-                "first_name": user.first_name,
-                "last_name": user.last_name,
-                "phone_number": user.phone_number,
-                "email": user.email,
-                "consent": user.consent,
-                "is_active": user.is_active,
-                "shipping_address": {
-                    'full_name': shipping.full_name if shipping else "",
-                    'phone_number': shipping.phone_number if shipping else "",
-                    'email': shipping.email if shipping else "",
-                    'street_address': shipping.street_address if shipping else "",
-                    'city': shipping.city if shipping else "",
-                    'postal_code': shipping.postal_code if shipping else "",
-                    'province_state': shipping.province_state if shipping else "",
-                    'country': shipping.country if shipping else ""
-                },
-                "notifications": {
-                    'order_confirmation_email': user.order_confirmation_email,
-                    'payment_success_notification': user.payment_success_notification,
-                    'shipping_delivery_updates': user.shipping_delivery_updates,
-                    'AI_design_approvals_alerts': user.AI_design_approvals_alerts,
-                    'account_activity_alerts': user.account_activity_alerts
-                }
-            }
+            "user": profiles.profile_payload(request, profile),
         })
 
 
 class UserViewset(GenericViewSet, CreateModelMixin):
     queryset = models.User.objects.none()
     serializer_class = serializers.UserSerializer
-    http_method_names = ['post']
+    http_method_names = ['get', 'post']
     permission_classes = []
 
     @action(
@@ -131,12 +137,9 @@ class UserViewset(GenericViewSet, CreateModelMixin):
         url_path='verify-otp'
     )
     def verify_otp(self, request):
-        user = get_object_or_404(models.User, email=request.data['email'])
-        if request.data['otp'] == user.otp and user.otp_expiry > timezone.now():
-            user.otp = ''
-            user.otp_expiry = None
-            user.is_active = True
-            user.save()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if serializer.save() is not None:
             return Response({'detail': 'email verified successfully'}, status=status.HTTP_200_OK)
         return Response(
             {'otp': 'otp either invalid or expired'}, 
@@ -182,16 +185,7 @@ class UserViewset(GenericViewSet, CreateModelMixin):
                             </html>
             """
 
-            
-            email_message = EmailMultiAlternatives(
-                subject,
-                message,
-                settings.EMAIL_HOST_USER,
-                [email]
-            )
-
-            email_message.attach_alternative(message, "text/html")
-            email_message.send()
+            notifications.enqueue_email(email, subject, message, html_body=message)
 
             return Response(
                 {"success": "Password reset link sent"}, status=status.HTTP_200_OK
@@ -259,6 +253,16 @@ class UserViewset(GenericViewSet, CreateModelMixin):
             )
     
 
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=[IsAuthenticated],
+        url_path='profile'
+    )
+    def profile(self, request):
+        return Response(profiles.profile_payload(request, profiles.get_profile(request.user.id)))
+
+
     @action(
         detail=False,
         methods=['post'],
@@ -302,8 +306,8 @@ class UserViewset(GenericViewSet, CreateModelMixin):
 
 
 
-class ApparelProductView(viewsets.ModelViewSet):
-    queryset = models.ApparelProduct.objects.all()
+class ApparelProductView(catalog.CatalogCacheMixin, viewsets.ModelViewSet):
+    queryset = models.ApparelProduct.objects.select_related('product').prefetch_related('sizes_available').order_by('id')
     serializer_class = serializers.ApparelProductSerializer
     permission_classes = [IsAdminUser]
     pagination_class = CustomPagination
@@ -329,7 +333,7 @@ class PricingRulesView(viewsets.ModelViewSet):
     permission_classes = [IsAdminUser]
 
 
-class ApparelSizesView(viewsets.ModelViewSet):
+class ApparelSizesView(catalog.CatalogCacheMixin, viewsets.ModelViewSet):
     queryset = models.Size.objects.all()
     serializer_class = serializers.SizeSerializer
     permission_classes = [IsAdminUser]
@@ -351,12 +355,58 @@ class UserDesignView(viewsets.ModelViewSet):
     queryset = models.UserDesign.objects.all()
     serializer_class = serializers.UserDesignSerializer
     permission_classes = [permissions.IsOwnerOrAdmin]
+    parser_classes = [JSONParser, FormParser, uploads.DesignUploadParser]
 
     def get_queryset(self):
         if self.request.user.is_superuser:
             return models.UserDesign.objects.all()
         return models.UserDesign.objects.filter(user=self.request.user, is_draft=True)
 
+    @action(detail=True, methods=['get'], url_path='mockup')
+    def mockup(self, request, pk=None):
+        design = self.get_object()
+        try:
+            names = mockups.get_mockups(design)
+        except mockups.MockupError as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({side: request.build_absolute_uri(default_storage.url(name)) for side, name in names.items()})
+
+
+class DesignUploadViewSet(GenericViewSet, CreateModelMixin, RetrieveModelMixin):
+    # resumable artwork uploads: POST to start, GET for the confirmed offset, PUT chunks, POST complete
+    serializer_class = serializers.DesignUploadSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return models.DesignUpload.objects.filter(user=self.request.user)
+
+    @action(detail=True, methods=['put'], url_path='chunk')
+    def chunk(self, request, pk=None):
+        upload = self.get_object()
+        try:
+            offset = int(request.query_params.get('offset', request.headers.get('Upload-Offset')))
+            length = int(request.headers.get('Content-Length') or 0)
+        except (TypeError, ValueError):
+            return Response({'offset': 'send the byte offset of this chunk'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            # request.stream is the raw body, the chunk is written to disk as it arrives
+            resumable.write_chunk(upload, offset, request.stream, length, request.headers.get('Upload-Checksum'))
+        except resumable.UploadConflict as exc:
+            return Response({'detail': str(exc), 'offset': exc.offset}, status=status.HTTP_409_CONFLICT)
+        except (resumable.UploadError, uploads.UploadRejected) as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.get_serializer(upload).data)
+
+    @action(detail=True, methods=['post'], url_path='complete')
+    def complete(self, request, pk=None):
+        upload = self.get_object()
+        try:
+            design = resumable.complete(upload)
+        except (resumable.UploadError, uploads.UploadRejected) as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(serializers.UserDesignSerializer(design, context={'request': request}).data)
+
 
 class OrderFromDraftAPIView(APIView):
     def post(self, request):
@@ -393,6 +443,31 @@ class OrderFromDraftAPIView(APIView):
         }, status=status.HTTP_201_CREATED)
 
 
+class BulkOrderCreateAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = serializers.BulkOrderSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        orders = serializer.save()
+
+        return Response({
+            "message": "Orders placed successfully",
+            "created": len(orders),
+            "total_amount": sum(order.total_amount for order in orders),
+            "lines": [
+                {
+                    "line": index,
+                    "order_id": order.order_id,
+                    "user_design": order.user_design_id,
+                    "quantity": order.quantity,
+                    "total_amount": order.total_amount
+                }
+                for index, order in enumerate(orders)
+            ]
+        }, status=status.HTTP_201_CREATED)
+
+
 class ShippingAddressView(viewsets.ModelViewSet):
     serializer_class = serializers.ShippingAddressSerializer
     permission_classes = [permissions.IsOwnerOrAdmin]
@@ -420,9 +495,12 @@ class OrderView(viewsets.ModelViewSet):
 
     def get_queryset(self):
         user = self.request.user
+        queryset = models.Order.objects.all()
+        if self.action == 'retrieve':
+            queryset = queryset.with_details()
         if user.is_superuser:
-            return models.Order.objects.all()
-        return models.Order.objects.filter(user=user)
+            return queryset
+        return queryset.filter(user=user)
     
     def get_serializer_class(self):
         if self.action == 'create':
@@ -447,91 +525,7 @@ class AdminDashboardViewset(viewsets.ViewSet):
                 {'detail': 'You do not have permission to access this resource.'},
                 status=status.HTTP_403_FORBIDDEN
             )
-        now = timezone.now()
-        monthly_revenue = models.Order.objects.filter(
-            created_at__year = now.year,
-            created_at__month = now.month  
-        ).aggregate(total=Sum(F('total_amount')*F('quantity')))['total'] or 0
-        new_apparel_designs = models.UserDesign.objects.filter(created_at__month = now.month).count()
-        active_orders  =models.Order.objects.filter(is_active =True).count()
-        payments_received = models.Order.objects.filter(order_status = 'Completed').aggregate(amount = Sum('total_amount'))['amount'] or 0
-        new_customers = models.User.objects.filter(created_at__month = now.month).count()
-        cancelled_orders = models.Order.objects.filter(order_status = 'Cancelled').count()
-
-
-        # ---- 1M (weekly revenue for current month) ----
-        orders_this_month = models.Order.objects.filter(
-            created_at__year=now.year,
-            created_at__month=now.month
-        ).annotate(week=TruncWeek('created_at')).values('week') \
-         .annotate(value=Sum(F('total_amount') * F('quantity'))) \
-         .order_by('week')
-
-        one_m = []
-        for i, o in enumerate(orders_this_month, start=1):
-            one_m.append({"name": f"Week {i}", "value": o["value"] or 0})
-
-        # ---- 3M (monthly revenue, last 3 months) ----
-        last_3m = now - timedelta(days=90)
-        orders_3m = models.Order.objects.filter(created_at__gte=last_3m) \
-            .annotate(month=TruncMonth('created_at')).values('month') \
-            .annotate(value=Sum(F('total_amount') * F('quantity'))) \
-            .order_by('month')
-
-        three_m = [
-            {"name": o["month"].strftime("%b"), "value": o["value"] or 0}
-            for o in orders_3m
-        ]
-
-        # ---- 6M (two halves: Q1+Q2 and Q3+Q4 style) ----
-        last_6m = now - timedelta(days=180)
-        orders_6m = models.Order.objects.filter(created_at__gte=last_6m) \
-            .annotate(quarter=TruncQuarter('created_at')).values('quarter') \
-            .annotate(value=Sum(F('total_amount') * F('quantity'))) \
-            .order_by('quarter')
-
-        six_m = []
-        for i, o in enumerate(orders_6m, start=1):
-            six_m.append({"name": f"Q{i}", "value": o["value"] or 0})
-
-        # ---- 1Y (2 halves: H1 + H2) ----
-        start_year = now.replace(month=1, day=1)
-        orders_year = models.Order.objects.filter(created_at__gte=start_year) \
-            .annotate(month=TruncMonth('created_at')).values('month') \
-            .annotate(value=Sum(F('total_amount') * F('quantity'))) \
-            .order_by('month')
-
-        h1 = sum(o["value"] or 0 for o in orders_year if o["month"].month <= 6)
-        h2 = sum(o["value"] or 0 for o in orders_year if o["month"].month > 6)
-        one_y = [{"name": "H1", "value": h1}, {"name": "H2", "value": h2}]
-
-        # ---- ALL (last 4 years) ----
-        orders_all = models.Order.objects.annotate(year=TruncYear('created_at')) \
-            .values('year') \
-            .annotate(value=Sum(F('total_amount') * F('quantity'))) \
-            .order_by('year')
-
-        all_data = [
-            {"name": o["year"].year, "value": o["value"] or 0}
-            for o in orders_all
-        ]
-                
-        return Response(
-            {
-                'monthly_revenue': monthly_revenue,
-                'new_apparel_designs': new_apparel_designs,
-                'active_orders': active_orders,
-                'payments_received': payments_received,
-                'new_customers': new_customers,
-                'cancelled_orders': cancelled_orders,
-                "1M": one_m,
-                "3M": three_m,
-                "6M": six_m,
-                "1Y": one_y,
-                "ALL": all_data,
-            },
-            status=status.HTTP_200_OK
-        )
+        return Response(dashboard.get_dashboard_metrics(), status=status.HTTP_200_OK)
     
 
 class OrderViewSet(viewsets.ModelViewSet):
@@ -569,17 +563,17 @@ class ListOrderViewset(GenericViewSet , ListModelMixin):
     pagination_class = CustomPagination
 
     def list(self ,request):
-        show_orders = models.Order.objects.all().order_by('created_at')
+        show_orders = models.Order.objects.with_apparel().with_thumbnail().order_by('created_at')
         page = self.paginate_queryset(show_orders)
         if page is not None:
-            serializer = serializers.ListOrderSerializer(page , many=True)
+            serializer = serializers.ListOrderSerializer(page , many=True, context={'request': request})
             return self.get_paginated_response(serializer.data)        
-        serializer = serializers.ListOrderSerializer(show_orders , many=True)
+        serializer = serializers.ListOrderSerializer(show_orders , many=True, context={'request': request})
         return Response(serializer.data)
 
     @action(detail=True , methods=['get'] , url_path='view_orders')
     def view_order(self , request , pk=None):
-        query_set = models.Order.objects.all()
+        query_set = models.Order.objects.with_details()
         user = get_object_or_404(query_set , pk=pk)
         serializer = serializers.TrackOrderSerializer(user, context={'request': request})
         return Response(serializer.data)        
@@ -587,18 +581,57 @@ class ListOrderViewset(GenericViewSet , ListModelMixin):
     @action(detail=True , methods=['post'] , url_path='cancel_order', permission_classes=[IsAdminUser])
     def canceling_order(self , request , pk=None):
         try:
-            order = models.Order.objects.get(id=pk)
-        except:
-            return Response({'message':'Order with this ID does not exist'})
-        if order.is_active == False and order.order_status == choices.OrderStatus.CANCELLED:
-            return Response({"message":f"Order {order.order_id} has been already cancelled."})
-        
-        order.is_active=False
-        order.order_status = choices.OrderStatus.CANCELLED  
-        order.save()
+            order = order_states.transition_order(pk, 'order_status', choices.OrderStatus.CANCELLED)
+        except order_states.TransitionError:
+            order = models.Order.objects.filter(id=pk).values_list('order_id', 'order_status').first()
+            if order is None:
+                return Response({'message':'Order with this ID does not exist'}, status=status.HTTP_404_NOT_FOUND)
+            order_id, order_status = order
+            if order_status == choices.OrderStatus.CANCELLED:
+                return Response({"message":f"Order {order_id} has been already cancelled."}, status=status.HTTP_409_CONFLICT)
+            return Response(
+                {"message":f"Order {order_id} is {order_status} and cannot be cancelled."}, status=status.HTTP_409_CONFLICT
+            )
         return Response({
             "message":f"Order {order.order_id} has been cancelled successfully."
         })
+
+    @action(detail=True , methods=['post'] , url_path='update_status', permission_classes=[IsAdminUser])
+    def update_status(self , request , pk=None):
+        serializer = serializers.OrderTransitionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        field = serializer.validated_data['field']
+        target = serializer.validated_data['status']
+        try:
+            order = order_states.transition_order(pk, field, target)
+        except order_states.TransitionError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_409_CONFLICT)
+        return Response({
+            'id': order.id,
+            'order_id': order.order_id,
+            'order_status': order.order_status,
+            'order_tracking_status': order.order_tracking_status,
+            'payment': order.payment,
+        })
+
+    @action(detail=False , methods=['post'] , url_path='bulk_update_status', permission_classes=[IsAdminUser])
+    def bulk_update_status(self , request):
+        serializer = serializers.BulkOrderTransitionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            matched, updated = order_states.transition_matching(
+                serializer.get_queryset(),
+                serializer.validated_data['field'],
+                serializer.validated_data['status'],
+                settings.BULK_ORDER_ACTION_MAX_IDS,
+            )
+        except order_states.TransitionError as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'matched': matched,
+            'updated': len(updated),
+            'skipped': matched - len(updated),
+        })
     
 
 
@@ -607,14 +640,11 @@ class UserManagementViewset(GenericViewSet , ListModelMixin):
     permission_classes = [IsAdminUser , IsAuthenticated]
 
     def list(self , request):
-        total_users = User.objects.all().count()
-        active_users = User.objects.filter(is_active = True).count()
-        suspended_users = User.objects.filter(is_active = False).count()
- 
+        user_counters = counters.get_user_counters()
         return Response({
-            "totals_users":total_users,
-            "active_users":active_users,
-            "suspended_user":suspended_users,
+            "totals_users":user_counters['total'],
+            "active_users":user_counters['active'],
+            "suspended_user":user_counters['suspended'],
         })
     
     
@@ -624,7 +654,9 @@ class ListUserViewSet(GenericViewSet , ListModelMixin):
 
 
     def list(self , request):
-        list_of_user = User.objects.all().order_by('id')
+        filters = serializers.ListUserFilterSerializer(data=request.query_params)
+        filters.is_valid(raise_exception=True)
+        list_of_user = filters.filter_queryset(User.objects.with_order_stats())
         page = self.paginate_queryset(list_of_user)
         if page is not None:
             serializer = serializers.ListUserSerializer(page , many=True)
@@ -656,6 +688,31 @@ class ListUserViewSet(GenericViewSet , ListModelMixin):
         user.is_active = True
         user.save()
         return Response({'details':f'user {pk} reactivated successfully!'}) 
+
+    def set_users_active(self, request, is_active):
+        serializer = serializers.BulkUserIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        users = User.objects.filter(id__in=serializer.validated_data['ids']).exclude(is_active=is_active)
+        if not is_active:
+            users = users.exclude(is_superuser=True)
+
+        with transaction.atomic():
+            user_ids = list(users.select_for_update().values_list('id', flat=True))
+            # one UPDATE for the whole list, signals are skipped so counters/profiles are adjusted here
+            updated = User.objects.filter(id__in=user_ids).update(is_active=is_active)
+            counters.adjust_user_counters(active=updated if is_active else -updated)
+            profiles.invalidate_profiles(user_ids)
+        return updated
+
+    @action(detail=False, methods=['post'], url_path='bulk-suspend')
+    def bulk_suspend(self, request):
+        updated = self.set_users_active(request, False)
+        return Response({'details': f'{updated} users suspended', 'updated': updated})
+
+    @action(detail=False, methods=['post'], url_path='bulk-reactivate')
+    def bulk_reactivate(self, request):
+        updated = self.set_users_active(request, True)
+        return Response({'details': f'{updated} users reactivated successfully!', 'updated': updated})
         
 
 class ViewUserViewSet(GenericViewSet , RetrieveModelMixin):
@@ -664,23 +721,22 @@ class ViewUserViewSet(GenericViewSet , RetrieveModelMixin):
     permission_classes = [IsAdminUser ,IsAuthenticated]
    
     def retrieve(self ,request, pk=None):
+        # one query for the user and its order stats, one for the latest orders (user, created_at index)
+        recent_orders = models.Order.objects.with_apparel().order_by('-created_at', '-id')[:settings.CUSTOMER_RECENT_ORDERS]
         try:
-            user =  User.objects.get(id=pk)
-        except User.DoesNotExist:
+            user = User.objects.with_order_stats().prefetch_related(
+                Prefetch('user_orders', queryset=recent_orders, to_attr='recent_orders')
+            ).get(id=pk)
+        except (User.DoesNotExist, ValueError):
             raise serializers.ValidationError({
                 'details': 'user with this id not found'
             })
         serializer =serializers.ViewUserSerializer(user, context={'request': request})
-        
-        user_orders  = models.Order.objects.filter(user__id=pk)
-        total_orders = user_orders.count()
-        total_spent = user_orders.aggregate(orders_sum = Sum('total_amount'))['orders_sum'] or 0
-        user_orders = models.Order.objects.order_by('created_at')[:6]
-        orders = serializers.AdminUserViewOrdersSerializer(user_orders, many=True).data
+        orders = serializers.AdminUserViewOrdersSerializer(user.recent_orders, many=True).data
         
         return Response({
-            "total_user_orders":total_orders,
-            "total_spent":total_spent,
+            "total_user_orders":user.total_orders,
+            "total_spent":user.total_spent,
             "user_details":serializer.data,
             "list_of_recent_orders":orders
             },  status=status.HTTP_200_OK
@@ -702,88 +758,20 @@ from django.utils.decorators import method_decorator
 
 @method_decorator(csrf_exempt, name='dispatch')
 class CreateCheckoutSessionView(View):
-    def post(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         order_id = kwargs.get("order_id")
-        order = models.Order.objects.get(id=order_id)
-
         try:
-            checkout_session = stripe.checkout.Session.create(
-                payment_method_types=['card'],
-                line_items=[{
-                    "price_data": {
-                        "currency": "usd",
-                        "unit_amount": int(order.total_amount * 100),  # Stripe expects cents
-                        "product_data": {
-                            "name": f"Order {order.id}",
-                        },
-                    },
-                    "quantity": 1,
-                }],
-                mode="payment",
-                success_url="http://localhost:5173/payment/success?session_id={CHECKOUT_SESSION_ID}",
-                cancel_url="http://localhost:5173/payment/cancel",
-
-                # Metadata at session level
-                metadata={"order_id": order.id},
-
-                # ✅ Ensure metadata flows to PaymentIntent as well
-                payment_intent_data={
-                    "metadata": {"order_id": order.id}
-                }
-            )
-
-            return JsonResponse({
-                "id": checkout_session.id,
-                "url": checkout_session.url,   # 👈 front-end should redirect here
-            })
+            order = await models.Order.objects.aget(id=order_id)
+        except models.Order.DoesNotExist:
+            return JsonResponse({"error": "Order not found"}, status=404)
 
-        except Exception as e:
+        try:
+            # the pooled client only pays off with the long lived event loop of an asgi worker
+            session_id, url = await checkout.get_checkout_session(order, pooled=isinstance(request, ASGIRequest))
+        except (checkout.CheckoutError, stripe.StripeError) as e:
             return JsonResponse({"error": str(e)}, status=400)
 
-
-@csrf_exempt
-def stripe_webhook(request):
-    payload = request.body
-    sig_header = request.META.get("HTTP_STRIPE_SIGNATURE")
-
-    try:
-        event = stripe.Webhook.construct_event(
-            payload, sig_header, settings.STRIPE_WEBHOOK_KEY
-        )
-    except ValueError:
-        # Invalid payload
-        return JsonResponse({"error": "Invalid payload"}, status=400)
-    except stripe.error.SignatureVerificationError:
-        # Invalid signature
-        return JsonResponse({"error": "Invalid signature"}, status=400)
-
-    event_type = event["type"]
-    data = event["data"]["object"]
-
-    print(f"🔔 Received event: {event_type}")
-
-    if event_type == "checkout.session.completed":
-        # When checkout is successful
-        order_id = data.get("metadata", {}).get("order_id")
-        if order_id:
-            try:
-                order = models.Order.objects.get(id=order_id)
-                order.payment = choices.PaymentStatus.PAID
-                order.save()
-                return JsonResponse({"status": "success", "order_id": order.id, "payment": "PAID"}, status=200)
-            except models.Order.DoesNotExist:
-                return JsonResponse({"error": "Order not found"}, status=404)
-
-    elif event_type == "payment_intent.payment_failed":
-        # When payment fails
-        order_id = data.get("metadata", {}).get("order_id")
-        if order_id:
-            try:
-                order = models.Order.objects.get(id=order_id)
-                order.payment = choices.PaymentStatus.FAILED
-                order.save()
-                return JsonResponse({"status": "failed", "order_id": order.id, "payment": "FAILED"}, status=200)
-            except models.Order.DoesNotExist:
-                return JsonResponse({"error": "Order not found"}, status=404)
-
-    return JsonResponse({"status": "ignored", "event": event_type}, status=200)
\ No newline at end of file
+        return JsonResponse({
+            "id": session_id,
+            "url": url,   # 👈 front-end should redirect here
+        })
@@ -1,15 +1,30 @@
-
+import json
+import logging
 from django.views.decorators.csrf import csrf_exempt
 from django.http import HttpResponse
 from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
 import stripe
 from app import models, choices
-print(settings.STRIPE_WEBHOOK_KEY, '------------------')
+from app.order_states import transition_orders
+
+logger = logging.getLogger(__name__)
+
+PROCESS_SCHEDULED_KEY = 'stripe-events:process-scheduled'
+
+# event type -> payment status it sets on the order named in the metadata
+PAYMENT_EVENTS = {
+    'checkout.session.completed': choices.PaymentStatus.PAID,
+    'payment_intent.payment_failed': choices.PaymentStatus.FAILED,
+}
+
+
 @csrf_exempt
 def stripe_webhook(request):
     payload = request.body
     sig_header = request.META.get("HTTP_STRIPE_SIGNATURE")
-    event = None 
     try:
         event = stripe.Webhook.construct_event(
             payload, sig_header, settings.STRIPE_WEBHOOK_KEY
@@ -19,25 +34,70 @@ def stripe_webhook(request):
     except stripe.error.SignatureVerificationError:
         return HttpResponse(status=400)
 
-    if event["type"] == "checkout.session.completed":
-        print("babes")
-        session = event["data"]["object"]
-        # Find the order using session metadata
-        order_id = session.get("metadata", {}).get("order_id")
-        print("inside babes")
-        if order_id:
-            print("babes")
-            order = models.Order.objects.get(id=order_id)
-            print("----------",order.id)
-            order.payment = choices.PaymentStatus.PAID
-            order.save()
-    if event["type"] == "payment_intent.payment_failed":
-        print("failed")
-        intent = event["data"]["object"]
-        order_id = intent.get("metadata", {}).get("order_id")
-        if order_id:
-            order = models.Order.objects.get(id=order_id)
-            order.payment = choices.PaymentStatus.FAILED
-            order.save()        
-
-    return HttpResponse(status=200)    
\ No newline at end of file
+    # one INSERT .. ON CONFLICT DO NOTHING, so redeliveries cost the same as the first one
+    models.StripeEvent.objects.bulk_create(
+        [models.StripeEvent(event_id=event['id'], event_type=event['type'], payload=json.loads(payload))],
+        ignore_conflicts=True,
+    )
+    transaction.on_commit(schedule_processing)
+    return HttpResponse(status=200)
+
+
+def schedule_processing(countdown=None):
+    from app.tasks import process_stripe_events
+
+    if countdown is None:
+        countdown = settings.STRIPE_EVENT_PROCESS_DELAY
+    if cache.add(PROCESS_SCHEDULED_KEY, 1, countdown + 1):
+        process_stripe_events.apply_async(countdown=countdown)
+
+
+def event_order_id(event):
+    order_id = event.payload.get('data', {}).get('object', {}).get('metadata', {}).get('order_id')
+    try:
+        return int(order_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def process_events(batch_size=None):
+    batch_size = batch_size or settings.STRIPE_EVENT_BATCH_SIZE
+    cache.delete(PROCESS_SCHEDULED_KEY)
+    processed = 0
+
+    while True:
+        with transaction.atomic():
+            batch = list(
+                models.StripeEvent.objects.select_for_update(skip_locked=True).filter(
+                    status=choices.StripeEventStatus.PENDING
+                ).order_by('id')[:batch_size]
+            )
+            if not batch:
+                break
+
+            orders = {status: set() for status in PAYMENT_EVENTS.values()}
+            handled, ignored = [], []
+            for event in batch:
+                order_id = event_order_id(event)
+                if event.event_type in PAYMENT_EVENTS and order_id is not None:
+                    orders[PAYMENT_EVENTS[event.event_type]].add(order_id)
+                    handled.append(event.id)
+                else:
+                    ignored.append(event.id)
+
+            # plain UPDATEs: a payment status change needs none of Order.save()'s id/status/price logic.
+            # paid first, the state machine then keeps a late failure from undoing a payment
+            for status in (choices.PaymentStatus.PAID, choices.PaymentStatus.FAILED):
+                if orders[status]:
+                    transition_orders(orders[status], 'payment', status)
+
+            now = timezone.now()
+            models.StripeEvent.objects.filter(id__in=handled).update(status=choices.StripeEventStatus.PROCESSED, processed_at=now)
+            models.StripeEvent.objects.filter(id__in=ignored).update(status=choices.StripeEventStatus.IGNORED, processed_at=now)
+            processed += len(batch)
+
+        if len(batch) < batch_size:
+            break
+
+    logger.info('applied %s stripe events', processed)
+    return processed
@@ -8,6 +8,23 @@ app = Celery('project')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
+app.conf.beat_schedule = {
+    # safety net for drains that were lost (worker restart, broker hiccup)
+    'drain-email-outbox': {
+        'task': 'app.tasks.drain_email_outbox',
+        'schedule': 60.0,
+    },
+    'process-stripe-events': {
+        'task': 'app.tasks.process_stripe_events',
+        'schedule': 60.0,
+    },
+    # partial files of abandoned resumable uploads
+    'expire-design-uploads': {
+        'task': 'app.tasks.expire_design_uploads',
+        'schedule': 60.0 * 60,
+    },
+}
+
 
 # app.conf.beat_schedule = {
 #     'delete-unverified-users-daily': {
@@ -58,6 +58,25 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# per request SQL accounting (app/middleware.py), debug headers + /metrics/db/
+QUERY_INSTRUMENTATION = os.getenv('QUERY_INSTRUMENTATION', 'False') == 'True'
+if QUERY_INSTRUMENTATION:
+    MIDDLEWARE.insert(0, 'app.middleware.QueryInstrumentationMiddleware')
+
+QUERY_BUDGETS = {  # max queries per 'View.action', checked by the middleware
+    'AdminDashboardViewset.list': 5,
+    'ListOrderViewset.list': 5,
+    'ListOrderViewset.view_order': 5,
+    'OrderView.list': 5,
+    'OrderView.retrieve': 5,
+    'ListUserViewSet.list': 5,
+    'ViewUserViewSet.retrieve': 6,
+    'ApparelProductView.list': 5,
+}
+QUERY_BUDGET_DEFAULT = int(os.getenv('QUERY_BUDGET_DEFAULT')) if os.getenv('QUERY_BUDGET_DEFAULT') else None
+QUERY_BUDGET_STRICT = os.getenv('QUERY_BUDGET_STRICT', 'False') == 'True'  # raise instead of logging
+QUERY_METRICS_TOKEN = os.getenv('QUERY_METRICS_TOKEN')  # bearer token for /metrics/db/, which is closed without one
+
 ROOT_URLCONF = 'project.urls'
 
 CORS_ALLOW_ALL_ORIGINS = True
@@ -175,16 +194,83 @@ CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL')
 CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND')
 
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.getenv('REDIS_CACHE_URL', 'redis://redis:6379/1'),
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            'IGNORE_EXCEPTIONS': True,  # a cache outage falls back to the database
+        }
+    }
+}
+
+DASHBOARD_CACHE_TTL = int(os.getenv('DASHBOARD_CACHE_TTL', 60))  # seconds
+CATALOG_CACHE_TTL = int(os.getenv('CATALOG_CACHE_TTL', 60 * 60 * 24))  # seconds, entries are versioned so this only bounds memory
+PRICING_TABLE_CHECK_INTERVAL = int(os.getenv('PRICING_TABLE_CHECK_INTERVAL', 5))  # seconds between checks for rule changes made by other workers
+USER_COUNTERS_TTL = int(os.getenv('USER_COUNTERS_TTL', 60 * 60))  # seconds before the user-management counters are recounted
+PROFILE_CACHE_TTL = int(os.getenv('PROFILE_CACHE_TTL', 3600))  # seconds, login/profile snapshots, versioned per user
+PAGINATION_COUNT_CACHE_TTL = int(os.getenv('PAGINATION_COUNT_CACHE_TTL', 30))  # seconds, 0 = exact COUNT(*) every page
+PAGINATION_ESTIMATE_THRESHOLD = int(os.getenv('PAGINATION_ESTIMATE_THRESHOLD', 1000000))  # rows before pg_class estimates are used
+
+
 
 #for smtp email configuration (import send_email, use send_email(subject, message, sender, to_email))
-EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', "django.core.mail.backends.smtp.EmailBackend")
 EMAIL_HOST = "smtp.gmail.com"
 EMAIL_USE_TLS = True
 EMAIL_PORT = 587 
 EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 
+# outgoing mail is written to the OutboxMessage table and sent in batches by app.tasks.drain_email_outbox
+NOTIFICATION_DRAIN_DELAY = int(os.getenv('NOTIFICATION_DRAIN_DELAY', 2))  # seconds to collect messages before a drain
+NOTIFICATION_BATCH_SIZE = int(os.getenv('NOTIFICATION_BATCH_SIZE', 100))  # messages per SMTP connection
+NOTIFICATION_MAX_ATTEMPTS = int(os.getenv('NOTIFICATION_MAX_ATTEMPTS', 5))
+NOTIFICATION_RETRY_BACKOFF = int(os.getenv('NOTIFICATION_RETRY_BACKOFF', 30))  # seconds, doubled on every failed attempt
+NOTIFICATION_CLAIM_TIMEOUT = int(os.getenv('NOTIFICATION_CLAIM_TIMEOUT', 300))  # seconds a drain holds its batch, retried after a crash
+NOTIFICATION_ALERT_DEDUPE = int(os.getenv('NOTIFICATION_ALERT_DEDUPE', 60))  # seconds, login/logout alerts to one address
+
+LOGIN_HASH_WORKERS = int(os.getenv('LOGIN_HASH_WORKERS', os.cpu_count() or 2))  # threads for password hashing in the async login view
+LOGIN_RATE_LIMIT = int(os.getenv('LOGIN_RATE_LIMIT', 10))  # login attempts per minute per client address and per email
+AUTH_EVENT_BATCH_SIZE = int(os.getenv('AUTH_EVENT_BATCH_SIZE', 200))  # login/logout events per celery task
+AUTH_EVENT_FLUSH_INTERVAL = float(os.getenv('AUTH_EVENT_FLUSH_INTERVAL', 1))  # seconds, 0 = publish every event right away
+AUTH_EVENT_BUFFER_LIMIT = int(os.getenv('AUTH_EVENT_BUFFER_LIMIT', 10000))  # events kept in memory before new ones are dropped
+
+OTP_STORE = os.getenv('OTP_STORE', '')  # 'redis' or 'db', empty = redis when the default cache is django-redis
+OTP_TTL = int(os.getenv('OTP_TTL', 600))  # seconds a code stays valid, the emails say 10 minutes
+OTP_MAX_ATTEMPTS = int(os.getenv('OTP_MAX_ATTEMPTS', 5))  # wrong guesses before a code is burnt
+OTP_SEND_LIMIT = int(os.getenv('OTP_SEND_LIMIT', 3))  # codes sent to one address per OTP_SEND_WINDOW
+OTP_SEND_WINDOW = int(os.getenv('OTP_SEND_WINDOW', 900))  # seconds, sliding
+
+
+
+BULK_ORDER_MAX_LINES = int(os.getenv('BULK_ORDER_MAX_LINES', 5000))
+BULK_ORDER_ACTION_MAX_IDS = int(os.getenv('BULK_ORDER_ACTION_MAX_IDS', 10000))  # orders per admin bulk status change, by ids or filters
+BULK_USER_ACTION_MAX_IDS = int(os.getenv('BULK_USER_ACTION_MAX_IDS', 10000))  # user ids per bulk suspend/reactivate
+CUSTOMER_RECENT_ORDERS = int(os.getenv('CUSTOMER_RECENT_ORDERS', 6))  # orders shown on the admin customer detail
+
+# design artwork uploads stream to temp files, see app/uploads.py
+DESIGN_UPLOAD_MAX_BYTES = int(os.getenv('DESIGN_UPLOAD_MAX_BYTES', 50 * 1024 * 1024))  # per file
+DESIGN_UPLOAD_MAX_SIDE = int(os.getenv('DESIGN_UPLOAD_MAX_SIDE', 12000))  # px
+DESIGN_UPLOAD_MAX_PIXELS = int(os.getenv('DESIGN_UPLOAD_MAX_PIXELS', 80_000_000))  # below Pillow's decompression bomb limit
+# resumable uploads, see app/resumable.py. the directory must be shared by all web workers
+RESUMABLE_UPLOAD_DIR = os.getenv('RESUMABLE_UPLOAD_DIR', str(BASE_DIR / 'media' / 'partial-uploads'))
+RESUMABLE_UPLOAD_MAX_CHUNK = int(os.getenv('RESUMABLE_UPLOAD_MAX_CHUNK', 8 * 1024 * 1024))  # bytes per PUT
+RESUMABLE_UPLOAD_TTL = int(os.getenv('RESUMABLE_UPLOAD_TTL', 60 * 60 * 24))  # seconds an unfinished upload is kept
+# design mockups, see app/compositor.py and app/mockups.py
+MOCKUP_WORKERS = int(os.getenv('MOCKUP_WORKERS', 2))  # render processes per web worker (so x the web workers per host), 0 renders in the request
+MOCKUP_MAX_SIDE = int(os.getenv('MOCKUP_MAX_SIDE', 640))  # px, matches the preview rendition
+
 
 
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
-STRIPE_WEBHOOK_KEY = os.getenv('STRIPE_WEBHOOK_KEY')
\ No newline at end of file
+STRIPE_WEBHOOK_KEY = os.getenv('STRIPE_WEBHOOK_KEY')
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE')  # e.g. a local fake/mock server, defaults to api.stripe.com
+STRIPE_TIMEOUT = int(os.getenv('STRIPE_TIMEOUT', 20))  # seconds
+STRIPE_MAX_NETWORK_RETRIES = int(os.getenv('STRIPE_MAX_NETWORK_RETRIES', 2))
+STRIPE_SESSION_REUSE_MARGIN = int(os.getenv('STRIPE_SESSION_REUSE_MARGIN', 10))  # minutes left before a stored session is replaced
+STRIPE_SUCCESS_URL = os.getenv('STRIPE_SUCCESS_URL', 'http://localhost:5173/payment/success?session_id={CHECKOUT_SESSION_ID}')
+STRIPE_CANCEL_URL = os.getenv('STRIPE_CANCEL_URL', 'http://localhost:5173/payment/cancel')
+STRIPE_EVENT_PROCESS_DELAY = int(os.getenv('STRIPE_EVENT_PROCESS_DELAY', 1))  # seconds to collect webhook events before applying them
+STRIPE_EVENT_BATCH_SIZE = int(os.getenv('STRIPE_EVENT_BATCH_SIZE', 500))
\ No newline at end of file
@@ -14,16 +14,18 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenRefreshView, TokenBlacklistView
 from app.views import *
-from app import webhooks
+from app import webhooks, middleware
 
 router = DefaultRouter()
 router.register(r'user', UserViewset, basename='user-auth')
 router.register(r'user-dashboard', UserDesignView, basename='user-dashboard')
+router.register(r'design-uploads', DesignUploadViewSet, basename='design-uploads')
 router.register(r'shipping-address', ShippingAddressView, basename='shipping-address')
 router.register(r'billing-address', BillingAddressView, basename='billing-address')
 router.register(r'orders', OrderView, basename='orders')
@@ -42,10 +44,14 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include(router.urls)),
     path('user/order-from-draft/', OrderFromDraftAPIView.as_view()),
+    path('user/bulk-orders/', BulkOrderCreateAPIView.as_view()),
     path('user/login/', LoginView.as_view()),
     path('user/refresh-token/', TokenRefreshView.as_view()),
     path('user/logout/', TokenBlacklistView.as_view()),
-    path("stripe/webhook/", stripe_webhook, name="stripe-webhook"),
+    path("stripe/webhook/", webhooks.stripe_webhook, name="stripe-webhook"),
     path("create-checkout-session/<str:order_id>/", CreateCheckoutSessionView.as_view(), name="create-checkout-session"),
 ]
 
+if settings.QUERY_INSTRUMENTATION:
+    urlpatterns.append(path('metrics/db/', middleware.db_metrics, name='db-metrics'))
+